@@ -0,0 +1,94 @@
+import os
+import json
+import time
+import platform
+import subprocess
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "..", "data", "cache", "benchmarks")
+# A metric that moves by more than this between runs is flagged by compare()
+REGRESSION_THRESHOLD = 0.10
+COMPARED_METRICS = ("p50_ms", "p95_ms", "p99_ms", "_per_s")
+
+
+def summarize(samples: Sequence[float]) -> Dict[str, float]:
+    """p50/p95/p99/mean/min/max of a list of durations in seconds, reported in milliseconds"""
+    if not len(samples):
+        return {"n": 0}
+    ms = np.asarray(samples, dtype=np.float64) * 1000
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {
+        "n": int(len(ms)),
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3),
+        "mean_ms": round(float(ms.mean()), 3),
+        "min_ms": round(float(ms.min()), 3),
+        "max_ms": round(float(ms.max()), 3),
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def write_results(name: str, config: Dict, results: List[Dict], out_path: Optional[str] = None) -> str:
+    """
+    Write one run as JSON: {"benchmark", "timestamp", "commit", "python", "config", "results"}.
+
+    Every entry in `results` has a "name" plus metrics, which is what compare() matches
+    on between runs. Defaults to data/cache/benchmarks/<name>-<timestamp>.json.
+    """
+    if out_path is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        out_path = os.path.join(RESULTS_DIR, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    report = {
+        "benchmark": name,
+        "timestamp": time.time(),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "config": config,
+        "results": results,
+    }
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    return out_path
+
+
+def compare(baseline_path: str, results: List[Dict], threshold: float = REGRESSION_THRESHOLD) -> List[str]:
+    """
+    Lines describing how each percentile and throughput metric moved against a baseline run.
+    Latencies (p50/p95/p99) regress when they grow, throughput (*_per_s) when it shrinks.
+    """
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {r["name"]: r for r in json.load(f)["results"]}
+    lines = []
+    for result in results:
+        before = baseline.get(result["name"])
+        if before is None:
+            continue
+        for metric, value in _flatten(result).items():
+            old = _flatten(before).get(metric)
+            if not old or not isinstance(value, (int, float)) or not metric.endswith(COMPARED_METRICS):
+                continue
+            change = (value - old) / old
+            worse = change > threshold if metric.endswith("_ms") else change < -threshold
+            flag = "REGRESSION" if worse else ""
+            lines.append(f"{result['name']:<32} {metric:<28} {old:>10.3f} -> {value:>10.3f} {change:+7.1%} {flag}")
+    return lines
+
+
+def _flatten(result: Dict, prefix: str = "") -> Dict:
+    flat = {}
+    for key, value in result.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{prefix}{key}."))
+        else:
+            flat[f"{prefix}{key}"] = value
+    return flat
@@ -0,0 +1,95 @@
+import os
+import sys
+import time
+import argparse
+import subprocess
+from typing import Dict, List, Tuple
+
+from bench_results import compare, summarize, write_results
+
+# Cold-import cost of the backend modules, via `python -X importtime`.
+#
+#   python benchmark_import.py                        # server and model_service
+#   python benchmark_import.py --module server --top 25
+#
+# Each module is imported in a fresh interpreter, without OPEN_AI_KEY, so the numbers are
+# what an autoscaled worker pays before it can accept a connection. Heavy optional
+# dependencies that should only load on first use are reported if they show up.
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFERRED = ("openai", "httpx", "PyPDF2", "ollama", "tiktoken", "pdfplumber")
+
+
+def parse_importtime(stderr: str) -> List[Tuple[str, int, int]]:
+    """(module, self us, cumulative us) for every line `-X importtime` printed"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        rows.append((name.rstrip(), int(self_us), int(cumulative_us)))
+    return rows
+
+
+def import_once(module: str) -> Tuple[float, List[Tuple[str, int, int]]]:
+    env = {k: v for k, v in os.environ.items() if k != "OPEN_AI_KEY"}
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                          cwd=BACKEND_DIR, env=env, capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr[-2000:]}")
+    return wall, parse_importtime(proc.stderr)
+
+
+def bench_module(module: str, repeat: int, top: int) -> Dict:
+    walls, cumulative, rows = [], [], []
+    for _ in range(repeat):
+        wall, rows = import_once(module)
+        walls.append(wall)
+        cumulative.append(next(c for name, _, c in rows if name.strip() == module) / 1e6)
+    loaded = {name.strip() for name, _, _ in rows}
+    # Self time summed per top-level package (numpy, fastapi, ...) shows where the time goes
+    packages: Dict[str, int] = {}
+    for name, self_us, _ in rows:
+        package = name.strip().split(".")[0]
+        packages[package] = packages.get(package, 0) + self_us
+    slowest = sorted(((us, package) for package, us in packages.items()), reverse=True)
+    return {
+        "name": f"import/{module}",
+        "module": module,
+        "import": summarize(cumulative),
+        "interpreter_wall": summarize(walls),
+        "modules_loaded": len(loaded),
+        "deferred_loaded": [name for name in DEFERRED if name in loaded],
+        "slowest": [{"package": package, "self_ms": round(us / 1000, 1)} for us, package in slowest[:top]],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure cold import time of backend modules")
+    parser.add_argument("--module", action="append", help="module to import (repeatable)")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="slowest packages to list")
+    parser.add_argument("--out", help="results file (default data/cache/benchmarks/import-<time>.json)")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    results = []
+    for module in args.module or ["server", "model_service"]:
+        try:
+            result = bench_module(module, args.repeat, args.top)
+        except RuntimeError as e:
+            print(e)
+            continue
+        results.append(result)
+        print(f"{module}: import p50 {result['import']['p50_ms']:.0f}ms, interpreter + import p50 "
+              f"{result['interpreter_wall']['p50_ms']:.0f}ms, {result['modules_loaded']} modules")
+        if result["deferred_loaded"]:
+            print(f"  loaded eagerly: {', '.join(result['deferred_loaded'])}")
+        for row in result["slowest"]:
+            print(f"  {row['self_ms']:>8.1f}ms  {row['package']}")
+    path = write_results("import", {k: v for k, v in vars(args).items() if k not in ("out", "compare")}, results, args.out)
+    print(f"Results written to {path}")
+    if args.compare:
+        print("\n".join(compare(args.compare, results)))
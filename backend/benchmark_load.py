@@ -0,0 +1,175 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from typing import Dict, List, Optional
+
+import httpx
+
+from bench_results import compare, summarize, write_results
+from llm_stub import StubConfig, start_stub
+
+# Load generator for /api/ai/generate_questions.
+#
+#   python benchmark_load.py --spawn                       # stub LLM + server started here
+#   python benchmark_load.py --url http://127.0.0.1:8000   # an already running server
+#   python benchmark_load.py --spawn --stream --concurrency 1,8,32 --compare old.json
+#
+# With --spawn the server runs against llm_stub.py (no OpenAI/Ollama needed), with a
+# throwaway pool and cache, so runs are repeatable and comparable across commits.
+# Each request gets a unique topic unless --repeat-topics, so the generation cache and
+# coalescing do not hide the cost of generation.
+
+TOPICS = ["soil pH", "crop rotation", "liver fluke", "forest thinning", "silage making", "milk quality",
+          "potato blight", "sheep breeding", "grassland management", "photosynthesis"]
+
+
+def request_topic(i: int, repeat_topics: bool) -> str:
+    topic = TOPICS[i % len(TOPICS)]
+    return topic if repeat_topics else f"{topic} {i}"
+
+
+async def one_request(client: httpx.AsyncClient, url: str, body: Dict, stream: bool) -> Dict:
+    """Latency and, when streaming, time to the first token event of one request"""
+    start = time.perf_counter()
+    ttft = None
+    try:
+        if stream:
+            async with client.stream("POST", f"{url}/api/ai/generate_questions/stream", json=body) as response:
+                if response.status_code != 200:
+                    return {"ok": False, "status": response.status_code, "latency_s": time.perf_counter() - start}
+                async for line in response.aiter_lines():
+                    if ttft is None and line and json.loads(line).get("event") == "token":
+                        ttft = time.perf_counter() - start
+        else:
+            response = await client.post(f"{url}/api/ai/generate_questions", json=body)
+            if response.status_code != 200:
+                return {"ok": False, "status": response.status_code, "latency_s": time.perf_counter() - start}
+    except httpx.HTTPError as e:
+        return {"ok": False, "status": type(e).__name__, "latency_s": time.perf_counter() - start}
+    return {"ok": True, "latency_s": time.perf_counter() - start, "ttft_s": ttft}
+
+
+async def run_level(url: str, concurrency: int, requests: int, level: str, stream: bool,
+                    repeat_topics: bool, offset: int) -> Dict:
+    """`requests` requests with at most `concurrency` in flight"""
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(120.0)) as client:
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def bounded(i: int):
+            async with semaphore:
+                body = {"topic_name": request_topic(offset + i, repeat_topics), "level": level}
+                return await one_request(client, url, body, stream)
+
+        start = time.perf_counter()
+        samples = await asyncio.gather(*(bounded(i) for i in range(requests)))
+        wall = time.perf_counter() - start
+
+    ok = [s for s in samples if s["ok"]]
+    errors: Dict[str, int] = {}
+    for s in samples:
+        if not s["ok"]:
+            errors[str(s["status"])] = errors.get(str(s["status"]), 0) + 1
+    result = {
+        "name": f"generate_questions{'/stream' if stream else ''}/c{concurrency}",
+        "concurrency": concurrency,
+        "requests": requests,
+        "completed": len(ok),
+        "errors": errors,
+        "wall_s": round(wall, 3),
+        "throughput_per_s": round(len(ok) / wall, 3) if wall else 0.0,
+        "latency": summarize([s["latency_s"] for s in ok]),
+    }
+    if stream:
+        result["ttft"] = summarize([s["ttft_s"] for s in ok if s["ttft_s"] is not None])
+    return result
+
+
+def wait_until_up(url: str, process: subprocess.Popen, timeout_s: float = 60.0):
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode} during startup")
+        try:
+            # /ready only turns 200 once indexes, caches and LLM clients are warmed up
+            if httpx.get(f"{url}/ready", timeout=1.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Server at {url} did not come up within {timeout_s:.0f}s")
+
+
+def spawn_server(port: int, stub_url: str, workdir: str) -> subprocess.Popen:
+    """uvicorn server:app wired to the stub, with its pool and caches in `workdir`"""
+    env = dict(os.environ,
+               OPENAI_BASE_URL=stub_url,
+               OPEN_AI_KEY=os.getenv("OPEN_AI_KEY", "stub"),
+               LLM_BACKENDS="openai",
+               LLM_HEDGE="0",
+               QUESTION_POOL_DB=os.path.join(workdir, "pool.sqlite3"),
+               QUESTION_POOL_PREGENERATE="0")
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+    )
+
+
+async def run(args) -> List[Dict]:
+    results, offset = [], 0
+    for concurrency in args.concurrency:
+        result = await run_level(args.url, concurrency, args.requests, args.level, args.stream, args.repeat_topics, offset)
+        offset += args.requests
+        latency = result["latency"]
+        print(f"c={concurrency:<4} {result['completed']}/{args.requests} ok  {result['throughput_per_s']:.2f} req/s  "
+              f"p50 {latency.get('p50_ms', 0):.0f}ms  p95 {latency.get('p95_ms', 0):.0f}ms  p99 {latency.get('p99_ms', 0):.0f}ms"
+              + (f"  ttft p50 {result['ttft'].get('p50_ms', 0):.0f}ms" if args.stream else ""))
+        results.append(result)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load-test /api/ai/generate_questions")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--concurrency", type=lambda s: [int(c) for c in s.split(",")], default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=40, help="requests per concurrency level")
+    parser.add_argument("--level", default="higher", choices=["higher", "ordinary"])
+    parser.add_argument("--stream", action="store_true", help="use the streaming endpoint and measure time to first token")
+    parser.add_argument("--repeat-topics", action="store_true", help="reuse topics, so the cache and coalescing take part")
+    parser.add_argument("--spawn", action="store_true", help="start the LLM stub and a server for the run")
+    parser.add_argument("--port", type=int, default=8765, help="server port with --spawn")
+    parser.add_argument("--stub-first-token-s", type=float, default=StubConfig.first_token_s)
+    parser.add_argument("--stub-tokens-per-s", type=float, default=StubConfig.tokens_per_s)
+    parser.add_argument("--out", help="results file (default data/cache/benchmarks/load-<time>.json)")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    server: Optional[subprocess.Popen] = None
+    stub_config = StubConfig(args.stub_first_token_s, args.stub_tokens_per_s)
+    if args.spawn:
+        stub = start_stub(0, stub_config)
+        stub_url = f"http://127.0.0.1:{stub.server_address[1]}/v1"
+        args.url = f"http://127.0.0.1:{args.port}"
+        workdir = tempfile.mkdtemp(prefix="bench-")
+        server = spawn_server(args.port, stub_url, workdir)
+        wait_until_up(args.url, server)
+        print(f"Server on {args.url}, LLM stub on {stub_url}")
+    try:
+        results = asyncio.run(run(args))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=10)
+
+    config = {k: v for k, v in vars(args).items() if k not in ("out", "compare")}
+    if args.spawn:
+        config["stub"] = vars(stub_config)
+    path = write_results("load", config, results, args.out)
+    print(f"Results written to {path}")
+    if args.compare:
+        print("\n".join(compare(args.compare, results)))
@@ -0,0 +1,127 @@
+import os
+import glob
+import json
+import time
+import argparse
+from typing import Callable, Dict, List, Optional
+
+from bench_results import compare, summarize, write_results
+from retrieval import MERGED_DIR, RetrievalIndex, iter_merged_parts, load_or_build_index
+from topic_index import load_or_build_topic_index
+from question_bank import load_or_compile_bank
+from near_duplicates import NearDuplicateIndex
+
+# Micro-benchmarks for the CPU-bound pieces of request handling.
+#
+#   python benchmark_micro.py                    # everything
+#   python benchmark_micro.py --only retrieval   # one group: pdf, json, retrieval
+#   python benchmark_micro.py --compare data/cache/benchmarks/micro-<time>.json
+
+PROJECT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+QUERIES = ["soil pH", "crop rotation", "liver fluke control", "thinning forest trees", "silage",
+           "milk hygiene", "potato blight", "genetics and breeding", "grassland", "photosynthesis"]
+
+
+def measure(name: str, func: Callable, repeat: int, ops: int = 1, **extra) -> Dict:
+    """Time `func` `repeat` times; `ops` is how many operations one call performs"""
+    func()  # warm-up: imports, lazy caches, page cache
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    total = sum(samples)
+    result = {"name": name, "repeat": repeat, "ops": ops,
+              "ops_per_s": round(ops * repeat / total, 3) if total else 0.0, "latency": summarize(samples)}
+    result.update(extra)
+    return result
+
+
+def bench_pdf(repeat: int, limit: Optional[int]) -> List[Dict]:
+    try:
+        import PyPDF2
+    except ImportError:
+        print("PyPDF2 not installed; skipping PDF extraction")
+        return []
+    pdfs = sorted(glob.glob(os.path.join(PROJECT_DIR, "data", "initial", "*", "*.pdf")))[:limit]
+    if not pdfs:
+        print("No PDFs under data/initial; skipping PDF extraction")
+        return []
+
+    def extract_all():
+        for path in pdfs:
+            with open(path, "rb") as f:
+                "".join(page.extract_text() or "" for page in PyPDF2.PdfReader(f).pages)
+
+    return [measure("pdf/extract_text", extract_all, repeat, ops=len(pdfs), pdfs=len(pdfs))]
+
+
+def bench_json(repeat: int) -> List[Dict]:
+    paths = sorted(glob.glob(os.path.join(MERGED_DIR, "*.json")))
+    size = sum(os.path.getsize(p) for p in paths)
+
+    def load_all():
+        for path in paths:
+            with open(path, encoding="utf-8") as f:
+                json.load(f)
+
+    return [
+        measure("json/load_merged", load_all, repeat, ops=len(paths), files=len(paths), bytes=size),
+        measure("json/iter_merged_parts", lambda: list(iter_merged_parts(include_skipped=True)), repeat),
+    ]
+
+
+def bench_retrieval(repeat: int) -> List[Dict]:
+    passages = list(iter_merged_parts())
+    index = load_or_build_index()
+    topics = load_or_build_topic_index()
+    bank = load_or_compile_bank(topic_index=topics)
+    duplicates = NearDuplicateIndex()
+    for i in range(len(bank)):
+        duplicates.add(bank.record(i).text, source="bank")
+
+    def resolve_cold():
+        topics.resolve.cache_clear()
+        for query in QUERIES:
+            topics.resolve(query, "higher", 8)
+
+    results = [
+        measure("retrieval/bm25_build", lambda: RetrievalIndex.build(passages), max(1, repeat // 10),
+                passages=len(passages)),
+        measure("retrieval/bm25_search", lambda: [index.search(q, level="higher", k=8) for q in QUERIES],
+                repeat, ops=len(QUERIES)),
+        measure("retrieval/topic_resolve_cold", resolve_cold, repeat, ops=len(QUERIES)),
+        measure("retrieval/bank_find_tag", lambda: bank.find(level="higher", tag=bank.tags()[0]), repeat),
+        measure("retrieval/near_duplicate_check", lambda: [duplicates.query(q) for q in QUERIES],
+                repeat, ops=len(QUERIES), indexed=len(duplicates)),
+    ]
+    bank.close()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for PDF extraction, JSON loading and retrieval")
+    parser.add_argument("--only", choices=["pdf", "json", "retrieval"], action="append")
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--pdf-limit", type=int, default=4, help="PDFs per extraction run")
+    parser.add_argument("--out", help="results file (default data/cache/benchmarks/micro-<time>.json)")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    groups = args.only or ["pdf", "json", "retrieval"]
+    results = []
+    if "pdf" in groups:
+        results += bench_pdf(max(1, args.repeat // 10), args.pdf_limit)
+    if "json" in groups:
+        results += bench_json(args.repeat)
+    if "retrieval" in groups:
+        results += bench_retrieval(args.repeat)
+
+    for result in results:
+        latency = result["latency"]
+        print(f"{result['name']:<32} p50 {latency['p50_ms']:>9.3f}ms  p95 {latency['p95_ms']:>9.3f}ms  "
+              f"p99 {latency['p99_ms']:>9.3f}ms  {result['ops_per_s']:>10.1f} ops/s")
+    path = write_results("micro", {k: v for k, v in vars(args).items() if k not in ("out", "compare")}, results, args.out)
+    print(f"Results written to {path}")
+    if args.compare:
+        print("\n".join(compare(args.compare, results)))
@@ -0,0 +1,131 @@
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class SharedGeneration:
+    """
+    One in-flight generation that any number of requests can follow.
+
+    The producer publishes events into a buffer; every subscriber replays the
+    buffer from the start and then follows it live, so a request that joins late
+    still receives the whole stream. `ready` resolves once the producer has got
+    past its setup (prompt building), which lets endpoints turn setup failures
+    into ordinary HTTP errors before they start streaming.
+    """
+
+    def __init__(self, key: str):
+        self.key = key
+        self.events: List[Dict] = []
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.finished = False
+        self.followers = 0
+        self.ready: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._changed = asyncio.Condition()
+
+    def mark_ready(self):
+        if not self.ready.done():
+            self.ready.set_result(True)
+
+    async def publish(self, event: Dict):
+        async with self._changed:
+            self.events.append(event)
+            self._changed.notify_all()
+
+    async def finish(self, result: Any = None, error: Optional[BaseException] = None):
+        if error is not None and not self.ready.done():
+            self.ready.set_exception(error)
+            # Retrieved here so an unawaited failure is not reported as never-retrieved
+            self.ready.exception()
+        self.mark_ready()
+        async with self._changed:
+            self.result, self.error, self.finished = result, error, True
+            self._changed.notify_all()
+
+    async def subscribe(self) -> AsyncIterator[Dict]:
+        seen = 0
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: len(self.events) > seen or self.finished)
+                batch = self.events[seen:]
+                finished = self.finished
+            seen += len(batch)
+            for event in batch:
+                yield event
+            if finished and seen == len(self.events):
+                return
+
+    async def wait(self) -> Any:
+        """The producer's final result; re-raises its error"""
+        async with self._changed:
+            await self._changed.wait_for(lambda: self.finished)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class Coalescer:
+    """
+    Single-flight: concurrent requests with the same key share one generation.
+
+    The first request for a key (the leader) starts the producer as a background
+    task. Later requests for the key join the running generation instead of
+    starting their own, until it finishes. The producer is not tied to any one
+    client, so a leader disconnecting does not cut off its followers.
+    """
+
+    def __init__(self):
+        self._in_flight: Dict[str, Tuple[SharedGeneration, asyncio.Task]] = {}
+        self.requests = 0
+        self.leaders = 0
+        self.coalesced = 0
+        self.max_followers = 0
+
+    def join(self, key: str, producer: Callable[[SharedGeneration], Awaitable[None]]) -> SharedGeneration:
+        self.requests += 1
+        if key in self._in_flight:
+            generation = self._in_flight[key][0]
+            generation.followers += 1
+            self.coalesced += 1
+            self.max_followers = max(self.max_followers, generation.followers)
+            return generation
+
+        self.leaders += 1
+        generation = SharedGeneration(key)
+        task = asyncio.ensure_future(self._run(generation, producer))
+        self._in_flight[key] = (generation, task)
+        return generation
+
+    async def _run(self, generation: SharedGeneration, producer: Callable[[SharedGeneration], Awaitable[None]]):
+        try:
+            await producer(generation)
+            if not generation.finished:
+                await generation.finish()
+        except Exception as e:
+            logger.error(f"Shared generation {generation.key} failed: {e!r}")
+            await generation.finish(error=e)
+        except BaseException:
+            # Cancelled (shutdown, loop teardown): followers get an error instead of waiting forever
+            if not generation.finished:
+                await generation.finish(error=RuntimeError(f"Shared generation {generation.key} was cancelled"))
+            raise
+        finally:
+            self._in_flight.pop(generation.key, None)
+
+    def stats(self) -> Dict:
+        return {
+            "requests": self.requests,
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            # Share of requests that piggybacked on another request's generation
+            "coalescing_ratio": round(self.coalesced / self.requests, 4) if self.requests else 0.0,
+            "in_flight": len(self._in_flight),
+            "max_followers": self.max_followers,
+        }
+
+    async def close(self):
+        for _, task in list(self._in_flight.values()):
+            task.cancel()
@@ -0,0 +1,175 @@
+import os
+import re
+import sys
+import time
+import json
+import random
+import sqlite3
+import threading
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_NON_WORD = re.compile(r"[^a-z0-9]+")
+
+
+def normalize_topic(topic: str) -> str:
+    """
+    Collapse trivially different spellings of the same topic onto one key:
+    "Liver Fluke", "liver  fluke." and "liver flukes" all become "liver fluke".
+    """
+    words = _NON_WORD.sub(" ", (topic or "").lower()).split()
+    stemmed = [w[:-1] if len(w) > 3 and w.endswith("s") and not w.endswith("ss") else w for w in words]
+    return " ".join(stemmed)
+
+
+def normalize_key(topic: str, level: str, paper: Optional[str], model: str, temperature: Optional[float]) -> str:
+    temp = "default" if temperature is None else f"{float(temperature):.2f}"
+    return "|".join([
+        normalize_topic(topic),
+        (level or "").strip().lower(),
+        (paper or "").strip().lower(),
+        model or "",
+        temp,
+    ])
+
+
+@dataclass
+class Variant:
+    value: Any
+    created: float
+
+
+@dataclass
+class CacheEntry:
+    variants: List[Variant] = field(default_factory=list)
+    served: int = 0
+
+
+class GenerationCache:
+    """
+    LRU + TTL cache of generated questions keyed on a normalized request.
+
+    Each key holds a pool of up to `pool_size` distinct variants. Until the pool is
+    full a lookup misses, so the caller generates a fresh variant and `put`s it;
+    once full, lookups rotate through the pool so repeat users still see different
+    questions without another LLM round trip.
+
+    With `db_path` set, variants are written through to SQLite and reloaded on a
+    memory miss, so the cache survives restarts.
+    """
+
+    def __init__(self, max_entries: int = 512, ttl_s: float = 24 * 3600, pool_size: int = 3,
+                 db_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.pool_size = max(1, pool_size)
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._db = None
+        if db_path:
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS generations (key TEXT NOT NULL, created REAL NOT NULL, value TEXT NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS generations_key ON generations (key)")
+            self._db.commit()
+
+    def _fresh(self, variants: List[Variant], now: float) -> List[Variant]:
+        return [v for v in variants if now - v.created < self.ttl_s]
+
+    def _load_from_db(self, key: str, now: float) -> Optional[CacheEntry]:
+        rows = self._db.execute(
+            "SELECT created, value FROM generations WHERE key = ? AND created > ? ORDER BY created",
+            (key, now - self.ttl_s),
+        ).fetchall()
+        if not rows:
+            return None
+        return CacheEntry(variants=[Variant(json.loads(value), created) for created, value in rows][-self.pool_size:])
+
+    def _touch(self, key: str, entry: CacheEntry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return a cached variant, or None if the caller should generate a new one."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and self._db is not None:
+                entry = self._load_from_db(key, now)
+            if entry is not None:
+                entry.variants = self._fresh(entry.variants, now)
+                self._touch(key, entry)
+                if len(entry.variants) >= self.pool_size:
+                    # Rotate through the pool, starting at a random variant per process
+                    if entry.served == 0:
+                        entry.served = random.randrange(len(entry.variants))
+                    variant = entry.variants[entry.served % len(entry.variants)]
+                    entry.served += 1
+                    self.hits += 1
+                    return variant.value
+            self.misses += 1
+            return None
+
+    def put(self, key: str, value: Any):
+        """Add a freshly generated variant to the key's pool (duplicates are ignored)."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key) or CacheEntry()
+            entry.variants = self._fresh(entry.variants, now)
+            if any(v.value == value for v in entry.variants):
+                self._touch(key, entry)
+                return
+            entry.variants.append(Variant(value, now))
+            entry.variants = entry.variants[-self.pool_size:]
+            self._touch(key, entry)
+            if self._db is not None:
+                self._db.execute("DELETE FROM generations WHERE created <= ?", (now - self.ttl_s,))
+                self._db.execute(
+                    "INSERT INTO generations (key, created, value) VALUES (?, ?, ?)",
+                    (key, now, json.dumps(value, ensure_ascii=False)),
+                )
+                self._db.commit()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM generations")
+                self._db.commit()
+
+    def memory_bytes(self) -> int:
+        """Approximate footprint of the cached values held in memory"""
+        total = 0
+        for key, entry in self._entries.items():
+            total += sys.getsizeof(key)
+            for v in entry.variants:
+                total += sys.getsizeof(v.value)
+                if isinstance(v.value, (list, tuple)):
+                    total += sum(sys.getsizeof(item) for item in v.value)
+        return total
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "variants": sum(len(e.variants) for e in self._entries.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": (self.hits / lookups) if lookups else 0.0,
+                "evictions": self.evictions,
+                "memory_bytes": self.memory_bytes(),
+                "persistent": self._db is not None,
+            }
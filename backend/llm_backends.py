@@ -0,0 +1,383 @@
+import re
+import time
+import asyncio
+import logging
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Callable, Deque, Dict, List, Optional, Sequence, Tuple
+
+from token_budget import count_message_tokens, count_tokens
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OLLAMA_URL = "http://localhost:11434/v1"
+DEFAULT_OLLAMA_MODEL = "llama3.1:8b"
+
+
+@dataclass
+class Chunk:
+    """One streamed piece of a completion. The last chunk of a stream may carry token usage only"""
+    text: str = ""
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    # Set by the router to the backend that served the stream
+    backend: str = ""
+
+
+@dataclass
+class Completion:
+    text: str
+    backend: str
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+
+
+class LLMBackend:
+    """A chat model that streams completions. Subclasses implement `stream`"""
+
+    name = "backend"
+    model = ""
+
+    def stream(self, messages: List[Dict], max_tokens: Optional[int] = None,
+               temperature: Optional[float] = None) -> AsyncIterator[Chunk]:
+        raise NotImplementedError
+
+    async def complete(self, messages: List[Dict], max_tokens: Optional[int] = None,
+                       temperature: Optional[float] = None) -> Completion:
+        result = Completion("", self.name)
+        parts = []
+        async for chunk in self.stream(messages, max_tokens, temperature):
+            parts.append(chunk.text)
+            result.prompt_tokens = chunk.prompt_tokens or result.prompt_tokens
+            result.completion_tokens = chunk.completion_tokens or result.completion_tokens
+        result.text = "".join(parts)
+        return result
+
+    async def warm_up(self):
+        pass
+
+    async def close(self):
+        pass
+
+
+class OpenAIBackend(LLMBackend):
+    """
+    Any OpenAI-protocol chat endpoint, through an `openai.AsyncOpenAI` client.
+
+    Pass `client_factory` instead of `client` to defer creating the client (and importing
+    openai) until the first request or warm-up.
+    """
+
+    def __init__(self, client=None, model: str = "", name: str = "openai", stream_usage: bool = True,
+                 client_factory: Optional[Callable[[], Any]] = None):
+        if client is None and client_factory is None:
+            raise ValueError("OpenAIBackend needs a client or a client_factory")
+        self._client = client
+        self._client_factory = client_factory
+        self.model = model
+        self.name = name
+        # Ask for a final usage chunk; not every OpenAI-compatible server supports it
+        self.stream_usage = stream_usage
+
+    async def stream(self, messages, max_tokens=None, temperature=None):
+        kwargs = {}
+        if max_tokens is not None:
+            kwargs["max_tokens"] = max_tokens
+        if temperature is not None:
+            kwargs["temperature"] = temperature
+        if self.stream_usage:
+            kwargs["stream_options"] = {"include_usage": True}
+        response = await self.client.chat.completions.create(
+            model=self.model, messages=messages, stream=True, **kwargs)
+        async for chunk in response:
+            usage = getattr(chunk, "usage", None)
+            if usage is not None:
+                yield Chunk("", usage.prompt_tokens, usage.completion_tokens)
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield Chunk(chunk.choices[0].delta.content)
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = self._client_factory()
+        return self._client
+
+    async def warm_up(self):
+        """Create the client now rather than on the first request"""
+        self.client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.close()
+
+
+class OllamaBackend(OpenAIBackend):
+    """A local Ollama model through its OpenAI-compatible /v1 endpoint (the model_service setup)"""
+
+    def __init__(self, model: str = DEFAULT_OLLAMA_MODEL, base_url: str = DEFAULT_OLLAMA_URL,
+                 name: str = "ollama", http_client=None):
+        def make_client():
+            import openai
+
+            return openai.AsyncOpenAI(base_url=base_url, api_key="ollama", http_client=http_client)
+
+        super().__init__(model=model, name=name, stream_usage=False, client_factory=make_client)
+
+
+class StubBackend(LLMBackend):
+    """
+    Deterministic local backend for tests and benchmarks: no network, no model.
+
+    Replies with `reply` after `first_token_s`, then streams it word by word at
+    `tokens_per_s`. `fail` raises before the first token, like an unreachable server.
+    """
+
+    def __init__(self, name: str = "stub", reply: str = "1. Stub question (a) part one (b) part two",
+                 first_token_s: float = 0.0, tokens_per_s: Optional[float] = None, fail: bool = False):
+        self.name = name
+        self.model = name
+        self.reply = reply
+        self.first_token_s = first_token_s
+        self.tokens_per_s = tokens_per_s
+        self.fail = fail
+        self.calls = 0
+
+    async def stream(self, messages, max_tokens=None, temperature=None):
+        self.calls += 1
+        await asyncio.sleep(self.first_token_s)
+        if self.fail:
+            raise ConnectionError(f"{self.name} is unavailable")
+        pieces = re.findall(r"\S+\s*|\s+", self.reply)
+        if max_tokens is not None:
+            pieces = pieces[:max_tokens]
+        for i, piece in enumerate(pieces):
+            if i and self.tokens_per_s:
+                await asyncio.sleep(1.0 / self.tokens_per_s)
+            yield Chunk(piece)
+        yield Chunk("", count_message_tokens(messages), count_tokens("".join(pieces)))
+
+
+@dataclass
+class BackendStats:
+    requests: int = 0
+    errors: int = 0
+    wins: int = 0
+    consecutive_failures: int = 0
+    down_until: float = 0.0
+    ttft: Deque[float] = field(default_factory=lambda: deque(maxlen=200))
+    latency: Deque[float] = field(default_factory=lambda: deque(maxlen=200))
+
+    @staticmethod
+    def percentile(samples: Sequence[float], q: float) -> Optional[float]:
+        if not samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def parse_routes(spec: str) -> Dict[str, List[str]]:
+    """"higher=openai,ollama;ordinary=ollama,openai" -> {"higher": ["openai", "ollama"], ...}"""
+    routes = {}
+    for entry in filter(None, (e.strip() for e in spec.split(";"))):
+        level, _, names = entry.partition("=")
+        routes[level.strip()] = [n.strip() for n in names.split(",") if n.strip()]
+    return routes
+
+
+class BackendRouter:
+    """
+    Picks a backend per request and fails over between them.
+
+    Each level has a preference order. Backends whose observed p95 latency misses
+    the request's SLO, or that failed `max_failures` times in a row (benched for
+    `cooldown_s`), move to the back. An attempt that errors, or produces no token
+    within `first_token_timeout_s`, falls through to the next backend. With
+    `hedge` on, the next backend is also started - without cancelling the first -
+    when the first has produced no token by its own p95 time-to-first-token; the
+    first to produce a token wins and the other is cancelled.
+
+    Once tokens have reached the caller a failure is raised rather than retried,
+    since a second backend would repeat text already sent.
+    """
+
+    def __init__(self, backends: Sequence[LLMBackend], routes: Optional[Dict[str, List[str]]] = None,
+                 slo_s: Optional[float] = None, first_token_timeout_s: float = 15.0, idle_timeout_s: float = 30.0,
+                 hedge: bool = True, min_samples: int = 10, max_failures: int = 3, cooldown_s: float = 30.0):
+        if not backends:
+            raise ValueError("BackendRouter needs at least one backend")
+        self.backends = {b.name: b for b in backends}
+        self.routes = routes or {}
+        self.slo_s = slo_s
+        self.first_token_timeout_s = first_token_timeout_s
+        self.idle_timeout_s = idle_timeout_s
+        self.hedge = hedge
+        self.min_samples = min_samples
+        self.max_failures = max_failures
+        self.cooldown_s = cooldown_s
+        self.stats_by_backend = {name: BackendStats() for name in self.backends}
+        self.hedges = 0
+        self.fallbacks = 0
+
+    def _route(self, level: Optional[str]) -> List[str]:
+        names = [n for n in self.routes.get(level, []) if n in self.backends]
+        return names + [n for n in self.backends if n not in names]
+
+    def preferred(self, level: Optional[str] = None) -> LLMBackend:
+        """The backend a level is routed to first when every backend is healthy"""
+        return self.backends[self._route(level)[0]]
+
+    def order(self, level: Optional[str] = None, slo_s: Optional[float] = None) -> List[LLMBackend]:
+        names = self._route(level)
+        slo_s = slo_s if slo_s is not None else self.slo_s
+        now = time.monotonic()
+
+        def rank(name: str) -> Tuple[bool, bool]:
+            s = self.stats_by_backend[name]
+            p95 = BackendStats.percentile(s.latency, 0.95) if len(s.latency) >= self.min_samples else None
+            return s.down_until > now, slo_s is not None and p95 is not None and p95 > slo_s
+
+        return [self.backends[n] for n in sorted(names, key=rank)]
+
+    def _hedge_delay(self, backend: LLMBackend) -> Optional[float]:
+        ttft = self.stats_by_backend[backend.name].ttft
+        if len(ttft) < self.min_samples:
+            return None
+        return BackendStats.percentile(ttft, 0.95)
+
+    def _failed(self, backend: LLMBackend, error: BaseException):
+        s = self.stats_by_backend[backend.name]
+        s.errors += 1
+        s.consecutive_failures += 1
+        if s.consecutive_failures >= self.max_failures:
+            s.down_until = time.monotonic() + self.cooldown_s
+        logger.warning(f"Backend {backend.name} failed: {error!r}")
+
+    async def _open(self, backend: LLMBackend, messages, max_tokens, temperature):
+        """Start a stream and wait for its first chunk: (stream, first chunk or None if empty)"""
+        stream = backend.stream(messages, max_tokens, temperature)
+        try:
+            first = await asyncio.wait_for(stream.__anext__(), self.first_token_timeout_s)
+        except StopAsyncIteration:
+            return stream, None
+        except BaseException:
+            await stream.aclose()
+            raise
+        return stream, first
+
+    @staticmethod
+    async def _discard(task: asyncio.Task):
+        task.cancel()
+        try:
+            stream, _ = await task
+            await stream.aclose()
+        except BaseException:
+            pass
+
+    async def stream(self, messages: List[Dict], level: Optional[str] = None, max_tokens: Optional[int] = None,
+                     temperature: Optional[float] = None, slo_s: Optional[float] = None) -> AsyncIterator[Chunk]:
+        candidates = self.order(level, slo_s)
+        attempts: Dict[asyncio.Task, Tuple[LLMBackend, float]] = {}
+        errors: List[str] = []
+
+        def launch():
+            backend = candidates[len(errors) + len(attempts)]
+            self.stats_by_backend[backend.name].requests += 1
+            task = asyncio.ensure_future(self._open(backend, messages, max_tokens, temperature))
+            attempts[task] = (backend, time.monotonic())
+
+        launch()
+        winner = None
+        try:
+            while winner is None:
+                spare = len(errors) + len(attempts) < len(candidates)
+                newest = list(attempts.values())[-1][0]
+                delay = self._hedge_delay(newest) if self.hedge and spare and len(attempts) == 1 else None
+                done, _ = await asyncio.wait(attempts, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # No token by the leader's p95 time-to-first-token: race the next backend too
+                    self.hedges += 1
+                    launch()
+                    continue
+                for task in done:
+                    backend, started = attempts.pop(task)
+                    try:
+                        stream, first = task.result()
+                    except Exception as e:
+                        self._failed(backend, e)
+                        errors.append(f"{backend.name}: {e!r}")
+                        continue
+                    winner = backend, started, stream, first
+                    break
+                if winner is None and not attempts:
+                    if len(errors) >= len(candidates):
+                        raise RuntimeError("All LLM backends failed: " + "; ".join(errors))
+                    self.fallbacks += 1
+                    launch()
+        finally:
+            for task in list(attempts):
+                await self._discard(task)
+
+        backend, started, stream, first = winner
+        s = self.stats_by_backend[backend.name]
+        s.wins += 1
+        s.consecutive_failures = 0
+        s.ttft.append(time.monotonic() - started)
+        try:
+            chunk = first
+            while chunk is not None:
+                chunk.backend = backend.name
+                yield chunk
+                try:
+                    chunk = await asyncio.wait_for(stream.__anext__(), self.idle_timeout_s)
+                except StopAsyncIteration:
+                    chunk = None
+            s.latency.append(time.monotonic() - started)
+        except Exception as e:
+            self._failed(backend, e)
+            raise
+        finally:
+            await stream.aclose()
+
+    async def complete(self, messages: List[Dict], level: Optional[str] = None, max_tokens: Optional[int] = None,
+                       temperature: Optional[float] = None, slo_s: Optional[float] = None) -> Completion:
+        result = Completion("", "")
+        parts = []
+        async for chunk in self.stream(messages, level, max_tokens, temperature, slo_s):
+            parts.append(chunk.text)
+            result.backend = chunk.backend
+            result.prompt_tokens = chunk.prompt_tokens or result.prompt_tokens
+            result.completion_tokens = chunk.completion_tokens or result.completion_tokens
+        result.text = "".join(parts)
+        return result
+
+    def stats(self) -> Dict:
+        now = time.monotonic()
+        backends = {}
+        for name, s in self.stats_by_backend.items():
+            backends[name] = {
+                "model": self.backends[name].model,
+                "requests": s.requests,
+                "wins": s.wins,
+                "errors": s.errors,
+                "available": s.down_until <= now,
+                "ttft_p50_s": BackendStats.percentile(s.ttft, 0.5),
+                "ttft_p95_s": BackendStats.percentile(s.ttft, 0.95),
+                "latency_p95_s": BackendStats.percentile(s.latency, 0.95),
+            }
+        return {"routes": self.routes, "slo_s": self.slo_s, "hedge": self.hedge,
+                "hedges": self.hedges, "fallbacks": self.fallbacks, "backends": backends}
+
+    async def warm_up(self) -> Dict[str, str]:
+        """Set up every backend's client; returns {name: error} for the ones that failed"""
+        errors = {}
+        for name, backend in self.backends.items():
+            try:
+                await backend.warm_up()
+            except Exception as e:
+                logger.error(f"Backend {name} failed to warm up: {e}")
+                errors[name] = str(e)
+        return errors
+
+    async def close(self):
+        for backend in self.backends.values():
+            await backend.close()
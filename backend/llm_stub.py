@@ -0,0 +1,180 @@
+import re
+import json
+import time
+import zlib
+import argparse
+import threading
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+# Deterministic stand-in for an OpenAI-compatible chat-completions server, for benchmarks.
+#
+#   python llm_stub.py --port 8900 --first-token-s 0.3 --tokens-per-s 60
+#
+# Point the backend at it with OPENAI_BASE_URL=http://127.0.0.1:8900/v1 (the openai client
+# reads it) or with LLM_BACKENDS=ollama OLLAMA_BASE_URL=http://127.0.0.1:8900/v1.
+# The same prompt always gets the same reply, timed only by the configured latency.
+
+PIECE = re.compile(r"\s*\S+")
+STEMS = [
+    "Explain the importance of {topic} on Irish farms.",
+    "Describe an experiment to investigate {topic}.",
+    "Outline two advantages and two disadvantages of {topic}.",
+    "Discuss the role of {topic} in sustainable agriculture.",
+    "State three factors that affect {topic}.",
+]
+PARTS = [
+    "Define the term {topic}.",
+    "Give two examples and explain each.",
+    "Suggest one way a farmer could improve this.",
+    "Name one disease associated with it and state its cause.",
+    "Describe how it is measured.",
+]
+
+
+@dataclass
+class StubConfig:
+    # Delay before the first token, then one token every 1 / tokens_per_s seconds
+    first_token_s: float = 0.2
+    tokens_per_s: float = 80.0
+    # Every Nth request fails with a 500 (0 never fails)
+    fail_every: int = 0
+    model: str = "stub"
+
+
+def reply_for(prompt: str) -> str:
+    """Numbered exam questions on the prompt's topic; identical prompts get identical replies"""
+    topic = re.search(r"topic(?: of|:)\s*'?([^'\n.]+)", prompt)
+    topic = topic.group(1).strip() if topic else "soil fertility"
+    count = re.search(r"(?:Write|Generate) (\d+)", prompt)
+    count = int(count.group(1)) if count else 1
+    seed = zlib.crc32(prompt.encode("utf-8"))
+    questions = []
+    for i in range(count):
+        stem = STEMS[(seed + i) % len(STEMS)].format(topic=topic)
+        parts = [f"({letter}) {PARTS[(seed + i + j) % len(PARTS)].format(topic=topic)}"
+                 for j, letter in enumerate("abc")]
+        questions.append(f"{i + 1}. {stem}\n" + "\n".join(parts))
+    return "\n\n".join(questions)
+
+
+def prompt_tokens(messages: List[Dict]) -> int:
+    return sum(len(PIECE.findall(str(m.get("content", "")))) + 4 for m in messages)
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], config: StubConfig):
+        super().__init__(address, StubHandler)
+        self.config = config
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def next_request(self) -> int:
+        with self._lock:
+            self.requests += 1
+            return self.requests
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _json(self, status: int, body: Dict):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _chunk(self, payload: Dict):
+        data = f"data: {json.dumps(payload)}\n\n".encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._json(200, {"object": "list", "data": [{"id": self.server.config.model, "object": "model"}]})
+        else:
+            self._json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._json(404, {"error": {"message": "not found"}})
+            return
+        config: StubConfig = self.server.config
+        number = self.server.next_request()
+        if config.fail_every and number % config.fail_every == 0:
+            self._json(500, {"error": {"message": "stub failure", "type": "server_error"}})
+            return
+
+        messages = body.get("messages", [])
+        prompt = "\n".join(str(m.get("content", "")) for m in messages if m.get("role") == "user")
+        pieces = PIECE.findall(reply_for(prompt))
+        max_tokens: Optional[int] = body.get("max_tokens")
+        finish = "stop"
+        if max_tokens is not None and len(pieces) > max_tokens:
+            pieces, finish = pieces[:max_tokens], "length"
+        usage = {"prompt_tokens": prompt_tokens(messages), "completion_tokens": len(pieces),
+                 "total_tokens": prompt_tokens(messages) + len(pieces)}
+        base = {"id": f"chatcmpl-stub-{number}", "created": int(time.time()), "model": body.get("model", config.model)}
+        interval = 1.0 / config.tokens_per_s if config.tokens_per_s > 0 else 0.0
+
+        time.sleep(config.first_token_s)
+        if not body.get("stream"):
+            time.sleep(interval * max(len(pieces) - 1, 0))
+            self._json(200, dict(base, object="chat.completion", usage=usage, choices=[{
+                "index": 0, "finish_reason": finish,
+                "message": {"role": "assistant", "content": "".join(pieces)},
+            }]))
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        chunk = dict(base, object="chat.completion.chunk")
+        try:
+            for i, piece in enumerate(pieces):
+                if i:
+                    time.sleep(interval)
+                delta = {"content": piece} if i else {"role": "assistant", "content": piece}
+                self._chunk(dict(chunk, choices=[{"index": 0, "delta": delta, "finish_reason": None}]))
+            self._chunk(dict(chunk, choices=[{"index": 0, "delta": {}, "finish_reason": finish}]))
+            if (body.get("stream_options") or {}).get("include_usage"):
+                self._chunk(dict(chunk, choices=[], usage=usage))
+            data = b"data: [DONE]\n\n"
+            self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # Client gave up mid-stream (timeouts, hedging); nothing left to send
+            self.close_connection = True
+
+
+def start_stub(port: int = 0, config: Optional[StubConfig] = None, host: str = "127.0.0.1") -> StubServer:
+    """Serve in a background thread; port 0 picks a free port (see server.server_address)"""
+    server = StubServer((host, port), config or StubConfig())
+    threading.Thread(target=server.serve_forever, name="llm-stub", daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Deterministic OpenAI-compatible chat-completions stub")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--first-token-s", type=float, default=StubConfig.first_token_s)
+    parser.add_argument("--tokens-per-s", type=float, default=StubConfig.tokens_per_s)
+    parser.add_argument("--fail-every", type=int, default=0)
+    args = parser.parse_args()
+
+    stub = StubServer((args.host, args.port), StubConfig(args.first_token_s, args.tokens_per_s, args.fail_every))
+    print(f"LLM stub listening on http://{args.host}:{stub.server_address[1]}/v1")
+    try:
+        stub.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,261 @@
+import os
+import time
+import bisect
+import cProfile
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Dependency-free metrics in the Prometheus text format, plus per-request stage tracing.
+#
+#   with stage("retrieval"):                       # time into stage_seconds{stage="retrieval"}
+#       ...
+#   TOKENS.observe(812, kind="prompt")             # any histogram / counter
+#   print(REGISTRY.render())                       # what GET /metrics serves
+#
+# Only the standard library is used, so the offline scripts can import it too.
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (32, 64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384)
+CHAR_BUCKETS = (256, 1024, 4096, 8192, 16384, 32768, 65536, 131072)
+
+
+def _label_key(labelnames: Sequence[str], labels: Dict[str, str]) -> Tuple[str, ...]:
+    if set(labels) != set(labelnames):
+        raise ValueError(f"Expected labels {sorted(labelnames)}, got {sorted(labels)}")
+    return tuple(str(labels[name]) for name in labelnames)
+
+
+def _format_labels(pairs: Sequence[Tuple[str, str]]) -> str:
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_label_key(self.labelnames, labels), 0.0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(list(zip(self.labelnames, key)))} {_format_value(value)}")
+        return lines
+
+
+class Gauge:
+    """A value read from `func` at render time, e.g. a cache's current size"""
+
+    def __init__(self, name: str, help: str, func: Callable[[], float]):
+        self.name, self.help, self.func = name, help, func
+
+    def render(self) -> List[str]:
+        try:
+            value = float(self.func())
+        except Exception as e:
+            logger.warning(f"Gauge {self.name} failed: {e}")
+            return []
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {_format_value(value)}"]
+
+
+class Histogram:
+    """Cumulative-bucket histogram; one set of buckets, sum and count per label combination"""
+
+    def __init__(self, name: str, help: str, buckets: Sequence[float] = LATENCY_BUCKETS, labelnames: Sequence[str] = ()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # per label key: [count per bucket (+Inf last), sum]
+        self._series: Dict[Tuple[str, ...], List] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _label_key(self.labelnames, labels)
+        slot = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][slot] += 1
+            series[1] += value
+
+    def count(self, **labels) -> int:
+        series = self._series.get(_label_key(self.labelnames, labels))
+        return sum(series[0]) if series else 0
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total) in sorted(self._series.items()):
+                pairs = list(zip(self.labelnames, key))
+                cumulative = 0
+                for bound, n in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += n
+                    le = "+Inf" if bound == float("inf") else _format_value(bound)
+                    lines.append(f"{self.name}_bucket{_format_labels(pairs + [('le', le)])} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(pairs)} {_format_value(total)}")
+                lines.append(f"{self.name}_count{_format_labels(pairs)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                # Re-registering (module reloads, several generators) returns the first instance
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, buckets: Sequence[float] = LATENCY_BUCKETS,
+                  labelnames: Sequence[str] = ()) -> Histogram:
+        return self._register(Histogram(name, help, buckets, labelnames))
+
+    def gauge(self, name: str, help: str, func: Callable[[], float]) -> Gauge:
+        return self._register(Gauge(name, help, func))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(line for metric in metrics for line in metric.render()) + "\n"
+
+    def write(self, path: str):
+        """Write the current values to a file, e.g. for node-exporter's textfile collector"""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+
+REGISTRY = MetricsRegistry()
+STAGE_SECONDS = REGISTRY.histogram("stage_seconds", "Time spent in each pipeline stage", labelnames=["stage"])
+TOKENS = REGISTRY.histogram("llm_tokens", "Tokens per LLM call", TOKEN_BUCKETS, labelnames=["kind"])
+PROMPT_CHARS = REGISTRY.histogram("prompt_chars", "Characters per prompt sent to an LLM", CHAR_BUCKETS)
+LLM_CALLS = REGISTRY.counter("llm_calls_total", "LLM calls by backend and outcome", ["backend", "outcome"])
+
+
+class Trace:
+    """The stages of one request, in the order they finished"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.start = time.perf_counter()
+        self.spans: List[Tuple[str, float]] = []
+
+    def server_timing(self) -> str:
+        """The spans as a Server-Timing header value (durations in ms), which browser dev tools display"""
+        return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.spans)
+
+
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("current_trace", default=None)
+
+
+@contextmanager
+def trace(name: str) -> Iterator[Trace]:
+    """Collect every stage finished inside the block (including tasks it starts) into one Trace"""
+    current = Trace(name)
+    token = _current_trace.set(current)
+    try:
+        yield current
+    finally:
+        _current_trace.reset(token)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+def observe_stage(name: str, seconds: float):
+    STAGE_SECONDS.observe(seconds, stage=name)
+    current = _current_trace.get()
+    if current is not None:
+        current.spans.append((name, seconds))
+
+
+@contextmanager
+def stage(name: str):
+    """Time the block into stage_seconds{stage=name} and the current trace; works around awaits too"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(name, time.perf_counter() - start)
+
+
+def observe_llm_call(backend: str, prompt_tokens: int, completion_tokens: int, prompt_chars: Optional[int] = None,
+                     ok: bool = True):
+    LLM_CALLS.inc(backend=backend, outcome="ok" if ok else "error")
+    if not ok:
+        return
+    TOKENS.observe(prompt_tokens, kind="prompt")
+    TOKENS.observe(completion_tokens, kind="completion")
+    if prompt_chars is not None:
+        PROMPT_CHARS.observe(prompt_chars)
+
+
+class SamplingProfiler:
+    """
+    Runs cProfile around every `every_n`-th `profile()` block and dumps the stats to
+    `out_dir/<name>-<n>.prof` (open with `python -m pstats` or snakeviz). 0 disables it.
+
+    Only one block is profiled at a time. Under asyncio the profile covers everything the
+    event loop ran meanwhile, not just the sampled request.
+    """
+
+    def __init__(self, every_n: int = 0, out_dir: str = "profiles"):
+        self.every_n = every_n
+        self.out_dir = out_dir
+        self.calls = 0
+        self.written = 0
+        self._busy = threading.Lock()
+
+    @contextmanager
+    def profile(self, name: str):
+        self.calls += 1
+        if not self.every_n or self.calls % self.every_n or not self._busy.acquire(blocking=False):
+            yield
+            return
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler (py-spy is fine, a second cProfile is not) already owns this thread
+            self._busy.release()
+            yield
+            return
+        try:
+            yield
+        finally:
+            profiler.disable()
+            os.makedirs(self.out_dir, exist_ok=True)
+            safe_name = "".join(c if c.isalnum() else "_" for c in name).strip("_")
+            profiler.dump_stats(os.path.join(self.out_dir, f"{safe_name}-{self.calls}.prof"))
+            self.written += 1
+            self._busy.release()
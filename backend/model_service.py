@@ -1,11 +1,18 @@
-from typing import Optional, Literal, List
+from typing import Optional, Literal, List, Dict, Iterator, Tuple, Union
 
-import ollama
-import json
-from openai import Client, OpenAI
+import asyncio
 import logging
+import threading
+import time
 from dataclasses import dataclass
 
+from streaming import QUESTION_HEADER, split_stream
+from generation_cache import GenerationCache, normalize_key
+from token_budget import TokenAccounting, completion_budget, count_message_tokens, count_tokens, fit_to_budget
+from near_duplicates import NearDuplicateIndex
+from metrics import observe_llm_call, stage
+from llm_backends import BackendRouter, Completion, LLMBackend, OllamaBackend
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -31,14 +38,30 @@ class ModelConfig:
 @dataclass
 class GenerationConfig:
     temperature: float = 0.4
-    max_tokens: int = 50
+    # None sizes max_tokens to the question structure: parts_per_question parts per question
+    max_tokens: Optional[int] = None
+    parts_per_question: int = 2
+    # Input budget per prompt; example questions beyond it are dropped, last first
+    prompt_token_budget: int = 1024
     num_questions: int = 3
+    # "sequential": one completion at a time
+    # "concurrent": one completion per question, up to `concurrency` in flight
+    # "batch": a single completion asking for all questions at once
+    mode: Literal["sequential", "concurrent", "batch"] = "sequential"
+    concurrency: int = 3
 
 @dataclass
 class QuestionTaskConfig:
     topic: str = "general knowledge"
     level: Literal["higher", "ordinary"] = "higher"
 
+@dataclass
+class QuestionStats:
+    index: int
+    latency_s: float
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+
 @dataclass
 class AppConfig:
     model: ModelConfig
@@ -48,14 +71,197 @@ class AppConfig:
 
 class QuestionGenerator:
     #This parameter can be either a GenerationConfig object OR None
-    def __init__(self, config: Optional[AppConfig] = None):
+    def __init__(self, config: Optional[AppConfig] = None, cache: Optional[GenerationCache] = None,
+                 duplicates: Optional[NearDuplicateIndex] = None,
+                 backend: Optional[Union[LLMBackend, BackendRouter]] = None,
+                 loop: Optional[asyncio.AbstractEventLoop] = None):
         """
         Initialize the QuestionGenerator with the given configuration.
         Args:
             config (GenerationConfig): Configuration for question generation.
+            cache (GenerationCache): Optional cache of previously generated question sets.
+            duplicates (NearDuplicateIndex): Optional shared index (e.g. seeded with the question bank);
+                generated questions that repeat anything in it are dropped.
+            backend (LLMBackend | BackendRouter): What completions go through; by default an
+                OllamaBackend for config.model. A router routes by the task's level.
+            loop (AbstractEventLoop): The running loop `backend` belongs to, e.g. the server's;
+                calls are then made on it from this (worker) thread. Without one the generator
+                runs the backend on a private loop of its own.
         """
         self.config = config or AppConfig(model=ModelConfig(), generation=GenerationConfig(), task=QuestionTaskConfig())
-        self.client = Client(base_url=self.config.model.base_url, api_key="ollama")  # No API key needed for local Ollama
+        self.cache = cache
+        self.duplicates = duplicates if duplicates is not None else NearDuplicateIndex()
+        # The few-shot examples are the likeliest thing for the model to parrot back; a shared
+        # index gets them from the first generator only
+        self.duplicates.seed((line[2:].strip().strip('",') for line in self._examples()), source="example")
+        self.backend = backend or OllamaBackend(model=self.config.model.model_name,
+                                                base_url=self.config.model.base_url)
+        self._loop = loop
+        self._own_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_lock = threading.Lock()
+        # Backends that answered during the current generate_questions call
+        self._served_by = set()
+        # Latency and token usage per question from the most recent generate_questions call
+        self.last_stats: List[QuestionStats] = []
+        # Prompt/completion token histograms across every call made by this generator
+        self.tokens = TokenAccounting()
+
+    def _run(self, coro):
+        """Run a coroutine on the backend's loop and wait for its result from this thread"""
+        if self._loop is not None:
+            return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+        # A private loop that outlives the call, since backend clients hold connections bound to it
+        with self._loop_lock:
+            if self._own_loop is None:
+                self._own_loop = asyncio.new_event_loop()
+            return self._own_loop.run_until_complete(coro)
+
+    def _backend_kwargs(self) -> Dict:
+        return {"level": self.config.task.level} if isinstance(self.backend, BackendRouter) else {}
+
+    @property
+    def _backend_name(self) -> str:
+        return getattr(self.backend, "name", "router")
+
+    async def _complete(self, messages: List[Dict], max_tokens: int) -> Completion:
+        response = await self.backend.complete(messages, max_tokens=max_tokens,
+                                               temperature=self.config.generation.temperature, **self._backend_kwargs())
+        self._served_by.add(response.backend)
+        return response
+
+    def _cache_key(self, backend: Optional[str] = None) -> str:
+        """
+        Keyed on the backend and model that answer - by default the router's preferred route
+        for the level - like the server's cache_key, so models never share an entry.
+        """
+        if isinstance(self.backend, BackendRouter):
+            llm = self.backend.backends[backend] if backend else self.backend.preferred(self.config.task.level)
+        else:
+            llm = self.backend
+        return normalize_key(self.config.task.topic, self.config.task.level, None,
+                             f"{llm.name}:{llm.model}", self.config.generation.temperature)
+
+    def _examples(self) -> List[str]:
+        examples = HIGHER_EXAMPLE_QUESTIONS if self.config.task.level == "higher" else ORDINARY_EXAMPLE_QUESTIONS
+        return [line.strip() for line in examples.strip().splitlines() if line.strip()]
+
+    def _fit_examples(self, template: str) -> str:
+        """Fill the template's {examples} slot with as many example questions as fit the input budget"""
+        render = lambda examples: template.replace("{examples}", "\n            ".join(examples))
+        prompt, _, _ = fit_to_budget(render, self._examples(), self.config.generation.prompt_token_budget,
+                                     self.config.model.model_name)
+        return prompt
+
+    def _drop_duplicates(self, questions: List[str]) -> List[str]:
+        """Drop questions that repeat an example, an indexed question or each other; no re-prompting"""
+        kept = []
+        for question in questions:
+            match = self.duplicates.check(question, topic=self.config.task.topic, add_as="generated")
+            if match is None:
+                kept.append(question)
+            else:
+                logger.info(f"Dropped near-duplicate question ({match.similarity:.2f} similar to {match.source}): {question}")
+        return kept
+
+    def _max_tokens(self, num_questions: int = 1) -> int:
+        if self.config.generation.max_tokens is not None:
+            return self.config.generation.max_tokens * num_questions
+        return completion_budget(num_questions, self.config.generation.parts_per_question)
+
+    def _record_usage(self, messages: List[Dict], usage, completion: str) -> Tuple[int, int]:
+        """Token counts from the API's usage report, or the local tokenizer when it sends none"""
+        prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+        completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+        estimated = not prompt_tokens
+        if estimated:
+            prompt_tokens = count_message_tokens(messages, self.config.model.model_name)
+            completion_tokens = count_tokens(completion, self.config.model.model_name)
+        self.tokens.record(prompt_tokens, completion_tokens, estimated=estimated)
+        return prompt_tokens, completion_tokens
+
+    def _build_prompt(self) -> str:
+        return self._fit_examples(f"""Generate a {self.config.task.level} level Agricultural Science exam question on the topic of {self.config.task.topic}.
+            Example questions:
+            {{examples}}
+            Now generate a new question. Q:""")
+
+    def _messages(self) -> List[Dict]:
+        return [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": self._build_prompt()}
+        ]
+
+    def _batch_prompt(self, num_questions: int) -> str:
+        return self._fit_examples(f"""Generate {num_questions} different {self.config.task.level} level Agricultural Science exam questions on the topic of {self.config.task.topic}.
+            Example questions:
+            {{examples}}
+            Number each question "1.", "2.", ... on a new line. Output only the questions.""")
+
+    async def _generate_one(self, index: int) -> Optional[str]:
+        """Run a single completion, recording its latency and token usage"""
+        start = time.perf_counter()
+        with stage("prompt_build"):
+            messages = self._messages()
+        try:
+            with stage("llm"):
+                response = await self._complete(messages, self._max_tokens())
+        except Exception as e:
+            logger.error(f"Error generating question: {e}")
+            observe_llm_call(self._backend_name, 0, 0, ok=False)
+            return None
+        question = response.text
+        prompt_tokens, completion_tokens = self._record_usage(messages, response, question or "")
+        observe_llm_call(response.backend, prompt_tokens, completion_tokens,
+                         prompt_chars=len(messages[-1]["content"]))
+        self.last_stats.append(QuestionStats(
+            index=index,
+            latency_s=time.perf_counter() - start,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+        ))
+        logger.info(f"Generated question: {question}")
+        return question
+
+    async def _generate_batch(self, num_questions: int) -> List[str]:
+        """Ask for every question in one completion and split the numbered answer"""
+        start = time.perf_counter()
+        with stage("prompt_build"):
+            messages = [
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": self._batch_prompt(num_questions)}
+            ]
+        try:
+            with stage("llm"):
+                response = await self._complete(messages, self._max_tokens(num_questions))
+        except Exception as e:
+            logger.error(f"Error generating question batch: {e}")
+            observe_llm_call(self._backend_name, 0, 0, ok=False)
+            return []
+        latency = time.perf_counter() - start
+
+        content = response.text or ""
+        prompt_tokens, completion_tokens = self._record_usage(messages, response, content)
+        observe_llm_call(response.backend, prompt_tokens, completion_tokens,
+                         prompt_chars=len(messages[-1]["content"]))
+        questions = [
+            QUESTION_HEADER.sub("", event["text"], count=1).strip()
+            for event in split_stream([content])
+            if event["event"] == "question_end"
+        ][:num_questions]
+        if not questions and content.strip():
+            questions = [content.strip()]
+
+        # One completion covers every question, so usage is shared out evenly
+        n = max(len(questions), 1)
+        for i, question in enumerate(questions):
+            self.last_stats.append(QuestionStats(
+                index=i,
+                latency_s=latency / n,
+                prompt_tokens=prompt_tokens // n,
+                completion_tokens=completion_tokens // n,
+            ))
+            logger.info(f"Generated question: {question}")
+        return questions
 
     def generate_questions(self, num_questions: Optional[int] = None) -> List[str]:
         """
@@ -65,33 +271,102 @@ class QuestionGenerator:
             num_questions: Number of questions to generate
             
         Returns:
-            List of generated questions
+            List of generated questions, in request order for every mode
+        """
+        num_questions = num_questions or self.config.generation.num_questions
+        mode = self.config.generation.mode
+        self.last_stats = []
+        self._served_by = set()
+        start = time.perf_counter()
+
+        key = None
+        if self.cache is not None:
+            key = self._cache_key()
+            cached = self.cache.get(key)
+            if cached is not None and len(cached) >= num_questions:
+                logger.info(f"Served {num_questions} question(s) from cache")
+                return cached[:num_questions]
+
+        questions = self._run(self._generate(num_questions, mode))
+        with stage("postprocess"):
+            questions = self._drop_duplicates(questions)
+
+        self.last_stats.sort(key=lambda s: s.index)
+        for stat in self.last_stats:
+            logger.info(
+                f"Question {stat.index + 1}: {stat.latency_s:.2f}s, "
+                f"{stat.prompt_tokens} prompt / {stat.completion_tokens} completion tokens"
+            )
+        logger.info(f"Generated {len(questions)} question(s) in {time.perf_counter() - start:.2f}s ({mode}, {self._backend_name})")
+        if key is not None and questions and len(self._served_by) == 1:
+            # A fallback backend's answers go under its own key; a mix of backends is not cached
+            served_by = next(iter(self._served_by))
+            if isinstance(self.backend, BackendRouter) and served_by in self.backend.backends:
+                key = self._cache_key(served_by)
+            self.cache.put(key, questions)
+        return questions
+
+    def close(self):
+        """Close the backend and the private loop, unless they belong to the caller"""
+        if self._own_loop is not None:
+            self._own_loop.run_until_complete(self.backend.close())
+            self._own_loop.close()
+            self._own_loop = None
+
+    async def _generate(self, num_questions: int, mode: str) -> List[str]:
+        if mode == "batch":
+            return await self._generate_batch(num_questions)
+        if mode == "concurrent":
+            semaphore = asyncio.Semaphore(max(1, min(self.config.generation.concurrency, num_questions)))
+
+            async def bounded(i: int) -> Optional[str]:
+                async with semaphore:
+                    return await self._generate_one(i)
+
+            # gather() returns results in submission order, so ordering is stable
+            results = await asyncio.gather(*(bounded(i) for i in range(num_questions)))
+        else:
+            results = [await self._generate_one(i) for i in range(num_questions)]
+        return [q for q in results if q is not None]
+
+    def stream_questions(self, num_questions: Optional[int] = None) -> Iterator[Dict]:
+        """
+        Stream generated questions token by token.
+
+        Yields the same events as the server's streaming endpoint:
+        "question_start", "token", "question_end" for each question and a final "done".
         """
         num_questions = num_questions or self.config.generation.num_questions
         questions = []
-    
-        for i in range(num_questions):
-            prompt = f"""Generate a {self.config.task.level} level Agricultural Science exam question on the topic of {self.config.task.topic}.
-            Example questions:
-            {HIGHER_EXAMPLE_QUESTIONS if self.config.task.level == "higher" else ORDINARY_EXAMPLE_QUESTIONS}
-            Now generate a new question. Q:"""
-            
+
+        for i in range(1, num_questions + 1):
+            yield {"event": "question_start", "question": i}
+            parts = []
+            usage = Completion("", self._backend_name)
+            messages = self._messages()
+            stream = self.backend.stream(messages, max_tokens=self._max_tokens(),
+                                         temperature=self.config.generation.temperature, **self._backend_kwargs())
             try:
-                response = self.client.chat.completions.create(
-                    model=self.config.model.model_name,
-                    messages=[
-                        {"role": "system", "content": SYSTEM_PROMPT},
-                        {"role": "user", "content": prompt}
-                    ],
-                    max_tokens=self.config.generation.max_tokens,
-                    temperature=self.config.generation.temperature,
-                )
-                question = response.choices[0].message.content
-                questions.append(question)
-                logger.info(f"Generated question: {question}")
+                while True:
+                    try:
+                        chunk = self._run(stream.__anext__())
+                    except StopAsyncIteration:
+                        break
+                    usage.prompt_tokens = chunk.prompt_tokens or usage.prompt_tokens
+                    usage.completion_tokens = chunk.completion_tokens or usage.completion_tokens
+                    if chunk.text:
+                        parts.append(chunk.text)
+                        yield {"event": "token", "question": i, "text": chunk.text}
             except Exception as e:
-                logger.error(f"Error generating question: {e}")
-        return questions
+                logger.error(f"Error streaming question: {e}")
+                yield {"event": "error", "question": i, "detail": str(e)}
+            finally:
+                self._run(stream.aclose())
+            question = "".join(parts).strip()
+            self._record_usage(messages, usage, question)
+            questions.append(question)
+            yield {"event": "question_end", "question": i, "text": question}
+        yield {"event": "done", "questions": questions}
 
 if __name__ == "__main__":
     print("Starting question generation...")
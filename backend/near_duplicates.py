@@ -0,0 +1,220 @@
+import re
+import zlib
+import threading
+from collections import defaultdict, deque
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+MERSENNE_PRIME = np.uint64((1 << 31) - 1)
+SHINGLE_WORDS = 3
+NUM_PERM = 64
+# 16 bands of 4 rows: pairs above ~0.5 Jaccard collide in some band with high probability
+BANDS = 16
+DUPLICATE_THRESHOLD = 0.6
+
+
+def shingle_hashes(text: str, k: int = SHINGLE_WORDS) -> np.ndarray:
+    """crc32 of every k-word shingle; texts shorter than k words fall back to single words"""
+    words = TOKEN_PATTERN.findall((text or "").lower())
+    if len(words) < k:
+        grams = words
+    else:
+        grams = [" ".join(words[i:i + k]) for i in range(len(words) - k + 1)]
+    return np.unique(np.fromiter((zlib.crc32(g.encode("utf-8")) for g in grams), dtype=np.uint64, count=len(grams)))
+
+
+class MinHasher:
+    """MinHash signatures from `num_perm` universal hashes (a*x + b) mod p, computed in one array op"""
+
+    def __init__(self, num_perm: int = NUM_PERM, seed: int = 1):
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self.a = rng.integers(1, int(MERSENNE_PRIME), size=num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, int(MERSENNE_PRIME), size=num_perm, dtype=np.uint64)
+
+    def signature(self, hashes: np.ndarray) -> np.ndarray:
+        if len(hashes) == 0:
+            return np.full(self.num_perm, MERSENNE_PRIME, dtype=np.uint64)
+        return ((self.a[:, None] * hashes[None, :] + self.b[:, None]) % MERSENNE_PRIME).min(axis=1)
+
+
+@dataclass
+class Match:
+    similarity: float
+    item_id: int
+    source: str
+    topic: str
+    text: str
+
+
+class NearDuplicateIndex:
+    """
+    MinHash/LSH index of question texts.
+
+    Signatures are split into `bands`; a text is only compared with texts that
+    share a band bucket, so a lookup costs one signature plus a few candidate
+    comparisons however large the index grows. Candidates are confirmed by the
+    estimated Jaccard similarity (share of equal signature slots).
+
+    `check` also keeps per-topic counters, which `stats` reports as duplicate rates.
+    Texts it indexes (`add_as`) are capped at `max_added`, oldest evicted first, so a
+    long-running process does not grow the index with every question it generates.
+    Texts without a single word are never indexed: they would all share one signature.
+    """
+
+    def __init__(self, threshold: float = DUPLICATE_THRESHOLD, num_perm: int = NUM_PERM, bands: int = BANDS,
+                 max_added: Optional[int] = None):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.threshold = threshold
+        self.hasher = MinHasher(num_perm)
+        self.bands = bands
+        self.rows = num_perm // bands
+        self._buckets: List[Dict[bytes, List[int]]] = [defaultdict(list) for _ in range(bands)]
+        self._signatures: Dict[int, np.ndarray] = {}
+        self._items: Dict[int, Tuple[str, str, str]] = {}
+        self._next_id = 0
+        self.max_added = max_added
+        # Ids indexed through check(add_as=...), oldest first
+        self._added: deque = deque()
+        self.evicted = 0
+        # Sources already added through seed()
+        self._seeded = set()
+        self._lock = threading.Lock()
+        self._checked: Dict[str, int] = defaultdict(int)
+        self._duplicates: Dict[str, int] = defaultdict(int)
+        self._sources: Dict[str, int] = defaultdict(int)
+
+    def __len__(self):
+        return len(self._items)
+
+    def _band_keys(self, signature: np.ndarray) -> List[bytes]:
+        return [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def _add_signature(self, signature: np.ndarray, text: str, source: str, topic: str) -> int:
+        item_id = self._next_id
+        self._next_id += 1
+        self._signatures[item_id] = signature
+        self._items[item_id] = (source, topic, text)
+        self._sources[source] += 1
+        for band, key in zip(self._buckets, self._band_keys(signature)):
+            band[key].append(item_id)
+        return item_id
+
+    def _remove(self, item_id: int):
+        signature = self._signatures.pop(item_id)
+        source, _, _ = self._items.pop(item_id)
+        self._sources[source] -= 1
+        for band, key in zip(self._buckets, self._band_keys(signature)):
+            band[key].remove(item_id)
+            if not band[key]:
+                del band[key]
+
+    def add(self, text: str, source: str = "", topic: str = "") -> Optional[int]:
+        """Index `text`; returns its id, or None if it has no words to compare"""
+        hashes = shingle_hashes(text)
+        if len(hashes) == 0:
+            return None
+        signature = self.hasher.signature(hashes)
+        with self._lock:
+            return self._add_signature(signature, text, source, topic)
+
+    def add_many(self, texts: Iterable[str], source: str = "", topic: str = "") -> int:
+        return sum(self.add(text, source, topic) is not None for text in texts)
+
+    def seed(self, texts: Iterable[str], source: str, topic: str = "") -> int:
+        """add_many, unless `source` was seeded before - for fixed texts every caller would re-add"""
+        with self._lock:
+            if source in self._seeded:
+                return 0
+            self._seeded.add(source)
+        return self.add_many(texts, source, topic)
+
+    def _query_signature(self, signature: np.ndarray, threshold: float) -> List[Match]:
+        candidates = set()
+        for band, key in zip(self._buckets, self._band_keys(signature)):
+            candidates.update(band.get(key, ()))
+        if not candidates:
+            return []
+        ids = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+        similarity = (np.stack([self._signatures[i] for i in ids]) == signature).mean(axis=1)
+        matches = [Match(float(s), int(i), *self._items[i]) for i, s in zip(ids, similarity) if s >= threshold]
+        return sorted(matches, key=lambda m: -m.similarity)
+
+    def query(self, text: str, threshold: Optional[float] = None) -> List[Match]:
+        """Indexed texts at least `threshold` similar to `text`, most similar first"""
+        signature = self.hasher.signature(shingle_hashes(text))
+        with self._lock:
+            return self._query_signature(signature, self.threshold if threshold is None else threshold)
+
+    def check(self, text: str, topic: str = "", add_as: Optional[str] = None) -> Optional[Match]:
+        """
+        The closest near-duplicate of `text`, or None. Counts toward `topic`'s duplicate
+        rate. With `add_as`, a text that is not a duplicate is indexed under that source,
+        so later repeats of it are caught too.
+        """
+        hashes = shingle_hashes(text)
+        signature = self.hasher.signature(hashes)
+        with self._lock:
+            self._checked[topic] += 1
+            if len(hashes) == 0:
+                return None
+            matches = self._query_signature(signature, self.threshold)
+            if matches:
+                self._duplicates[topic] += 1
+                return matches[0]
+            if add_as is not None:
+                self._added.append(self._add_signature(signature, text, add_as, topic))
+                while self.max_added is not None and len(self._added) > self.max_added:
+                    self._remove(self._added.popleft())
+                    self.evicted += 1
+            return None
+
+    def stats(self) -> Dict:
+        with self._lock:
+            topics = {
+                topic: {"checked": n, "duplicates": self._duplicates[topic],
+                        "duplicate_rate": round(self._duplicates[topic] / n, 4)}
+                for topic, n in sorted(self._checked.items())
+            }
+            checked, duplicates = sum(self._checked.values()), sum(self._duplicates.values())
+            return {
+                "indexed": len(self._items),
+                "sources": {source: n for source, n in self._sources.items() if n},
+                "evicted": self.evicted,
+                "threshold": self.threshold,
+                "checked": checked,
+                "duplicates": duplicates,
+                "duplicate_rate": round(duplicates / checked, 4) if checked else 0.0,
+                "topics": topics,
+            }
+
+
+def dedupe_texts(texts: Sequence[str], threshold: float = DUPLICATE_THRESHOLD) -> List[int]:
+    """Indices of the texts to keep: each one that near-duplicates an earlier text is dropped"""
+    index = NearDuplicateIndex(threshold)
+    return [i for i, text in enumerate(texts) if index.check(text, add_as="") is None]
+
+
+if __name__ == "__main__":
+    import time
+
+    from retrieval import iter_merged_parts
+    from topic_index import load_or_build_topic_index
+
+    # How much of the past-question bank repeats itself, per syllabus section
+    records = list(iter_merged_parts(include_skipped=True))
+    tags = load_or_build_topic_index().record_tags()
+    index = NearDuplicateIndex()
+    start = time.perf_counter()
+    for record, record_tags in zip(records, tags):
+        index.check(record["text"], topic=(record_tags or ["untagged"])[0], add_as="bank")
+    elapsed = time.perf_counter() - start
+    report = index.stats()
+    print(f"Checked {report['checked']} parts in {elapsed * 1000:.0f}ms "
+          f"({elapsed / max(report['checked'], 1) * 1e6:.0f}us each): {report['duplicates']} near-duplicates")
+    for topic, row in report["topics"].items():
+        print(f"{topic:<10} {row['duplicates']:>4}/{row['checked']:<4} {row['duplicate_rate']:.1%}")
@@ -0,0 +1,99 @@
+import os
+import threading
+import logging
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CachedPaper:
+    pdf_path: str
+    mtime: float
+    size: int
+    text: str
+
+
+class PdfTextCache:
+    """
+    In-memory cache of extracted past-paper text keyed by (level, paper).
+
+    Entries are validated against the file's mtime and size on every lookup,
+    so replacing a PDF on disk is picked up without restarting the server.
+    """
+
+    def __init__(self, path_resolver: Callable[[str, Optional[str]], str], extractor: Callable[[str], str]):
+        """
+        Args:
+            path_resolver: maps (level, paper) to a PDF path, e.g. `get_pdf_path`.
+            extractor: turns a PDF path into the prompt text.
+        """
+        self.path_resolver = path_resolver
+        self.extractor = extractor
+        self._entries: Dict[Tuple[str, Optional[str]], CachedPaper] = {}
+        self._lock = threading.Lock()
+        # One lock per key, so a burst of misses for the same paper parses it once
+        self._key_locks: Dict[Tuple[str, Optional[str]], threading.Lock] = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(level: str, paper: Optional[str]) -> Tuple[str, Optional[str]]:
+        return (level or "").strip().lower(), (paper or None)
+
+    def get_text(self, level: str, paper: Optional[str] = None) -> str:
+        """Return the extracted text for (level, paper), parsing the PDF only on a miss."""
+        key = self._key(level, paper)
+        pdf_path = self.path_resolver(*key)
+        stat = os.stat(pdf_path)
+
+        entry = self._lookup(key, pdf_path, stat)
+        if entry is not None:
+            return entry.text
+
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            # Whoever held the lock before us may have just extracted this paper
+            entry = self._lookup(key, pdf_path, stat)
+            if entry is not None:
+                return entry.text
+            with self._lock:
+                self.misses += 1
+            logger.info(f"PDF text cache miss for {key}, extracting {pdf_path}")
+            text = self.extractor(pdf_path)
+            with self._lock:
+                self._entries[key] = CachedPaper(pdf_path=pdf_path, mtime=stat.st_mtime, size=stat.st_size, text=text)
+        return text
+
+    def _lookup(self, key, pdf_path: str, stat) -> Optional[CachedPaper]:
+        """The entry for `key` if it is still current, counting a hit"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry.pdf_path == pdf_path and entry.mtime == stat.st_mtime and entry.size == stat.st_size:
+                self.hits += 1
+                return entry
+        return None
+
+    def warm_up(self, levels=("higher", "ordinary"), papers=(None,)) -> int:
+        """Preload every (level, paper) pair. Returns the number of papers loaded."""
+        loaded = 0
+        for level in levels:
+            for paper in papers:
+                try:
+                    self.get_text(level, paper)
+                    loaded += 1
+                except Exception as e:
+                    logger.warning(f"Could not preload past paper for {level}/{paper}: {e}")
+        return loaded
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": (self.hits / total) if total else 0.0,
+            }
@@ -0,0 +1,261 @@
+import os
+import json
+import mmap
+import struct
+import hashlib
+import logging
+from typing import Dict, Iterable, List, Optional
+
+from retrieval import MERGED_DIR, INDEX_DIR, iter_merged_parts, source_fingerprint
+from topic_index import TopicIndex, load_or_build_topic_index
+
+logger = logging.getLogger(__name__)
+
+BANK_PATH = os.path.join(INDEX_DIR, "question_bank.bin")
+
+# File layout (little-endian, every section 8-byte aligned):
+#   header   MAGIC, then u32 counts, u64 section offsets and the u64 source fingerprint (HEADER below)
+#   strings  u32 offsets[n_strings + 1] + utf-8 blob; every string stored once
+#   records  u32[n_records][RECORD_FIELDS] - string ids / year / flags / ref ranges
+#   sol_refs u32[]  string ids of solution lines, sliced per record
+#   tag_refs u32[]  string ids of topic tags, sliced per record
+#   tags     u32 tag_ids[n_tags], u32 post_offsets[n_tags + 1], u32 post_records[]
+MAGIC = b"QBANK\x00\x00\x01"
+HEADER = struct.Struct("<8s5I4x7Q")
+RECORD_FIELDS = 12
+(F_LEVEL, F_YEAR, F_QUESTION, F_PART, F_SUBPART, F_FLAGS,
+ F_TEXT, F_CONTEXT, F_SOL_START, F_SOL_COUNT, F_TAG_START, F_TAG_COUNT) = range(RECORD_FIELDS)
+FLAG_SKIP = 1
+
+class BankRecord:
+    __slots__ = ("index", "level", "year", "question_num", "part_id", "subpart_id",
+                 "skip", "text", "context", "solution", "tags")
+
+    def __init__(self, index, level, year, question_num, part_id, subpart_id, skip, text, context, solution, tags):
+        self.index = index
+        self.level = level
+        self.year = year
+        self.question_num = question_num
+        self.part_id = part_id
+        self.subpart_id = subpart_id
+        self.skip = skip
+        self.text = text
+        self.context = context
+        self.solution = solution
+        self.tags = tags
+
+    def to_dict(self) -> Dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        return f"BankRecord({self.level} {self.year} Q{self.question_num}{self.part_id}{self.subpart_id})"
+
+
+def _align(buf: bytearray):
+    buf.extend(b"\x00" * (-len(buf) % 8))
+
+
+def _u32(values: Iterable[int]) -> bytes:
+    values = list(values)
+    return struct.pack(f"<{len(values)}I", *values)
+
+
+def fingerprint_hash(fingerprint: List[List]) -> int:
+    """A source fingerprint (name, mtime, size rows) folded into the u64 stored in the bank header"""
+    digest = hashlib.sha256(json.dumps(fingerprint, sort_keys=True).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "little")
+
+
+def read_fingerprint_hash(path: str) -> Optional[int]:
+    """The fingerprint a bank was compiled from; None if the file is missing or not a bank"""
+    try:
+        with open(path, "rb") as f:
+            header = f.read(HEADER.size)
+        fields = HEADER.unpack(header)
+    except (OSError, struct.error):
+        return None
+    return fields[-2] if fields[0] == MAGIC else None
+
+
+def compile_bank(records: List[Dict], out_path: str = BANK_PATH, tags: Optional[List[List[str]]] = None,
+                 fingerprint: int = 0) -> int:
+    """
+    Write flattened records (see retrieval.iter_merged_parts) to one binary bank file.
+    `tags` holds the topic tags of each record, e.g. TopicIndex.record_tags(), and
+    `fingerprint` the fingerprint_hash() of the sources they were built from.
+    """
+    string_ids: Dict[str, int] = {}
+
+    def sid(value: str) -> int:
+        if value not in string_ids:
+            string_ids[value] = len(string_ids)
+        return string_ids[value]
+
+    rows, sol_refs, tag_refs = [], [], []
+    postings: Dict[int, List[int]] = {}
+    for i, r in enumerate(records):
+        record_tags = tags[i] if tags else []
+        row = [0] * RECORD_FIELDS
+        row[F_LEVEL], row[F_YEAR] = sid(r["level"]), int(r["year"])
+        row[F_QUESTION], row[F_PART], row[F_SUBPART] = sid(r["question_num"]), sid(r["part_id"]), sid(r["subpart_id"])
+        row[F_FLAGS] = FLAG_SKIP if r.get("skip") else 0
+        row[F_TEXT], row[F_CONTEXT] = sid(r["text"]), sid(r["context"])
+        row[F_SOL_START], row[F_SOL_COUNT] = len(sol_refs), len(r["solution"])
+        sol_refs.extend(sid(str(s)) for s in r["solution"])
+        row[F_TAG_START], row[F_TAG_COUNT] = len(tag_refs), len(record_tags)
+        for tag in record_tags:
+            tag_refs.append(sid(tag))
+            postings.setdefault(string_ids[tag], []).append(i)
+        rows.extend(row)
+
+    blobs = [s.encode("utf-8") for s in string_ids]
+    offsets = [0]
+    for b in blobs:
+        offsets.append(offsets[-1] + len(b))
+    tag_ids = sorted(postings)
+    post_offsets = [0]
+    for t in tag_ids:
+        post_offsets.append(post_offsets[-1] + len(postings[t]))
+
+    buf = bytearray(HEADER.size)
+    sections = []
+    for chunk in (_u32(offsets) + b"".join(blobs), _u32(rows), _u32(sol_refs), _u32(tag_refs),
+                  _u32(tag_ids) + _u32(post_offsets) + _u32(r for t in tag_ids for r in postings[t])):
+        _align(buf)
+        sections.append(len(buf))
+        buf.extend(chunk)
+    sections.extend([fingerprint, 0])  # source fingerprint, reserved
+    buf[:HEADER.size] = HEADER.pack(MAGIC, len(records), len(string_ids), len(sol_refs), len(tag_refs),
+                                    len(tag_ids), *sections)
+
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    tmp_path = out_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(buf)
+    # Atomic swap so workers that already mapped the old file keep a consistent view
+    os.replace(tmp_path, out_path)
+    return len(records)
+
+
+class QuestionBank:
+    """
+    Read-only, memory-mapped view of a compiled bank.
+
+    Nothing is parsed up front: opening maps the file and casts the sections to
+    u32 memoryviews, so every uvicorn worker shares the same physical pages and
+    records are only decoded when looked up.
+    """
+
+    def __init__(self, path: str = BANK_PATH):
+        self.path = path
+        self._file = open(path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, self.n_records, self.n_strings, n_sol, n_tag_refs, self.n_tags,
+         strings_at, records_at, sol_at, tags_at, postings_at, self.fingerprint, _) = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a compiled question bank")
+        view = memoryview(self._mm)
+        self._str_offsets = view[strings_at:strings_at + 4 * (self.n_strings + 1)].cast("I")
+        self._str_data_at = strings_at + 4 * (self.n_strings + 1)
+        self._records = view[records_at:records_at + 4 * RECORD_FIELDS * self.n_records].cast("I")
+        self._sol_refs = view[sol_at:sol_at + 4 * n_sol].cast("I")
+        self._tag_refs = view[tags_at:tags_at + 4 * n_tag_refs].cast("I")
+        self._tag_ids = view[postings_at:postings_at + 4 * self.n_tags].cast("I")
+        post_offsets_at = postings_at + 4 * self.n_tags
+        self._post_offsets = view[post_offsets_at:post_offsets_at + 4 * (self.n_tags + 1)].cast("I")
+        post_records_at = post_offsets_at + 4 * (self.n_tags + 1)
+        self._post_records = view[post_records_at:post_records_at + 4 * self._post_offsets[self.n_tags]].cast("I")
+        self._tag_lookup = {self.string(t): i for i, t in enumerate(self._tag_ids)}
+
+    def string(self, sid: int) -> str:
+        start, end = self._str_offsets[sid], self._str_offsets[sid + 1]
+        return self._mm[self._str_data_at + start:self._str_data_at + end].decode("utf-8")
+
+    def _field(self, i: int, f: int) -> int:
+        return self._records[i * RECORD_FIELDS + f]
+
+    def __len__(self):
+        return self.n_records
+
+    def record(self, i: int) -> BankRecord:
+        row = self._records[i * RECORD_FIELDS:(i + 1) * RECORD_FIELDS]
+        sols = self._sol_refs[row[F_SOL_START]:row[F_SOL_START] + row[F_SOL_COUNT]]
+        tags = self._tag_refs[row[F_TAG_START]:row[F_TAG_START] + row[F_TAG_COUNT]]
+        return BankRecord(
+            index=i, level=self.string(row[F_LEVEL]), year=row[F_YEAR],
+            question_num=self.string(row[F_QUESTION]), part_id=self.string(row[F_PART]),
+            subpart_id=self.string(row[F_SUBPART]), skip=bool(row[F_FLAGS] & FLAG_SKIP),
+            text=self.string(row[F_TEXT]), context=self.string(row[F_CONTEXT]),
+            solution=[self.string(s) for s in sols], tags=[self.string(t) for t in tags],
+        )
+
+    def tags(self) -> List[str]:
+        return sorted(self._tag_lookup)
+
+    def by_tag(self, tag: str, level: Optional[str] = None, include_skipped: bool = False) -> List[BankRecord]:
+        t = self._tag_lookup.get(tag)
+        if t is None:
+            return []
+        ids = self._post_records[self._post_offsets[t]:self._post_offsets[t + 1]]
+        return self._filter(ids, level=level, include_skipped=include_skipped)
+
+    def find(self, level: Optional[str] = None, year: Optional[int] = None, question: Optional[str] = None,
+             tag: Optional[str] = None, include_skipped: bool = False) -> List[BankRecord]:
+        if tag is not None:
+            return [r for r in self.by_tag(tag, level, include_skipped)
+                    if (year is None or r.year == year) and (question is None or r.question_num == str(question))]
+        return self._filter(range(self.n_records), level, year, question, include_skipped)
+
+    def _filter(self, ids, level=None, year=None, question=None, include_skipped=False) -> List[BankRecord]:
+        results = []
+        for i in ids:
+            if year is not None and self._field(i, F_YEAR) != year:
+                continue
+            if not include_skipped and self._field(i, F_FLAGS) & FLAG_SKIP:
+                continue
+            if level is not None and self.string(self._field(i, F_LEVEL)) != level:
+                continue
+            if question is not None and self.string(self._field(i, F_QUESTION)) != str(question):
+                continue
+            results.append(self.record(i))
+        return results
+
+    def close(self):
+        for name in ("_str_offsets", "_records", "_sol_refs", "_tag_refs", "_tag_ids", "_post_offsets", "_post_records"):
+            getattr(self, name).release()
+        self._mm.close()
+        self._file.close()
+
+
+def load_or_compile_bank(merged_dir: str = MERGED_DIR, bank_path: str = BANK_PATH,
+                         topic_index: Optional[TopicIndex] = None) -> QuestionBank:
+    """
+    Open the compiled bank, recompiling first if it was built from anything other than
+    the current merged files and topic index.
+
+    The header stores a hash of both fingerprints, so a deleted paper or a file restored
+    with an older mtime triggers a recompile just like an edit does - otherwise the topic
+    index's part ids would stop matching the bank's record order.
+    """
+    topic_index = topic_index or load_or_build_topic_index(merged_dir)
+    fingerprint = fingerprint_hash([source_fingerprint(merged_dir), list(topic_index.fingerprint)])
+    if read_fingerprint_hash(bank_path) != fingerprint:
+        records = list(iter_merged_parts(merged_dir, include_skipped=True))
+        count = compile_bank(records, bank_path, topic_index.record_tags(), fingerprint)
+        logger.info(f"Compiled question bank with {count} records to {bank_path}")
+    return QuestionBank(bank_path)
+
+
+if __name__ == "__main__":
+    import time
+
+    topic_index = load_or_build_topic_index()
+    count = compile_bank(list(iter_merged_parts(include_skipped=True)), tags=topic_index.record_tags(),
+                         fingerprint=fingerprint_hash([source_fingerprint(MERGED_DIR), list(topic_index.fingerprint)]))
+    start = time.perf_counter()
+    bank = QuestionBank()
+    opened = time.perf_counter() - start
+    print(f"Compiled {count} records ({os.path.getsize(BANK_PATH)} bytes), opened in {opened * 1000:.2f}ms")
+    print(f"Tags: {bank.tags()}")
+    for record in bank.find(level="higher", year=2019, question="3"):
+        print(record, record.tags, record.text[:60])
@@ -0,0 +1,275 @@
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from generation_cache import normalize_topic
+from near_duplicates import NearDuplicateIndex
+from streaming import QUESTION_HEADER
+from topic_index import SYLLABUS_PATH, parse_syllabus
+
+logger = logging.getLogger(__name__)
+
+LEVELS = ("higher", "ordinary")
+MIN_QUESTION_CHARS = 20
+MAX_QUESTION_CHARS = 800
+# Model chatter that means the reply is not a clean exam question
+REJECT_PATTERN = re.compile(r"\b(as an ai|i cannot|i can't|here (is|are) (a|the|some)|let me|sure[,!])", re.IGNORECASE)
+_NON_WORD = re.compile(r"[^a-z0-9]+")
+
+
+def syllabus_topics(syllabus_path: str = SYLLABUS_PATH) -> List[str]:
+    """One pre-generation topic per syllabus section, e.g. "Soils: Chemical" """
+    return [f"{s.strand}: {s.title}" for s in parse_syllabus(syllabus_path)]
+
+
+def clean_question(text: str) -> Optional[str]:
+    """Strip numbering/quotes from a generated question; None if it is not a usable question"""
+    text = QUESTION_HEADER.sub("", (text or "").strip(), count=1)
+    text = re.sub(r"^(?:Q\s*[:.]\s*)", "", text).strip().strip('"').strip()
+    if not MIN_QUESTION_CHARS <= len(text) <= MAX_QUESTION_CHARS or REJECT_PATTERN.search(text):
+        return None
+    if not re.search(r"[?.)]$", text):
+        # Cut off mid-sentence by max_tokens
+        return None
+    return text
+
+
+def fingerprint(text: str) -> str:
+    return hashlib.sha1(_NON_WORD.sub(" ", text.lower()).strip().encode("utf-8")).hexdigest()
+
+
+class QuestionPool:
+    """
+    SQLite pool of pre-generated questions per (topic, level).
+
+    `take` hands out questions exactly once by marking them served; a served
+    question keeps its fingerprint, so the same text is never pooled again.
+    With a `duplicates` index, reworded repeats of a pooled (or otherwise
+    indexed) question are rejected as well.
+    """
+
+    def __init__(self, db_path: str, duplicates: Optional[NearDuplicateIndex] = None):
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS pool ("
+            " id INTEGER PRIMARY KEY, topic TEXT NOT NULL, level TEXT NOT NULL, question TEXT NOT NULL,"
+            " fingerprint TEXT NOT NULL, created REAL NOT NULL, served REAL,"
+            " UNIQUE (topic, level, fingerprint))"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS pool_available ON pool (topic, level, served)")
+        self._db.commit()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.rejected = 0
+        self.duplicates = 0
+        self.near_duplicates = 0
+        self.index = duplicates
+        if duplicates is not None:
+            for topic, question in self._db.execute("SELECT topic, question FROM pool"):
+                duplicates.add(question, source="pool", topic=topic)
+
+    def add(self, topic: str, level: str, questions: Sequence[str]) -> int:
+        """Validate and store questions; returns how many were new"""
+        topic, added, now = normalize_topic(topic), 0, time.time()
+        with self._lock:
+            for raw in questions:
+                question = clean_question(raw)
+                if question is None:
+                    self.rejected += 1
+                    continue
+                if self.index is not None and self.index.check(question, topic=topic) is not None:
+                    self.near_duplicates += 1
+                    continue
+                cursor = self._db.execute(
+                    "INSERT OR IGNORE INTO pool (topic, level, question, fingerprint, created) VALUES (?, ?, ?, ?, ?)",
+                    (topic, level, question, fingerprint(question), now),
+                )
+                if cursor.rowcount:
+                    added += 1
+                    if self.index is not None:
+                        self.index.add(question, source="pool", topic=topic)
+                else:
+                    self.duplicates += 1
+            self._db.commit()
+        return added
+
+    def take(self, topic: str, level: str, n: int) -> Optional[List[str]]:
+        """Draw `n` unserved questions, oldest first, or None (drawing nothing) if fewer are pooled"""
+        topic = normalize_topic(topic)
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, question FROM pool WHERE topic = ? AND level = ? AND served IS NULL ORDER BY id LIMIT ?",
+                (topic, level, n),
+            ).fetchall()
+            if len(rows) < n:
+                self.misses += 1
+                return None
+            self._db.executemany("UPDATE pool SET served = ? WHERE id = ?", [(time.time(), row[0]) for row in rows])
+            self._db.commit()
+            self.hits += 1
+            return [row[1] for row in rows]
+
+    def depth(self, topic: str, level: str) -> int:
+        with self._lock:
+            return self._db.execute(
+                "SELECT COUNT(*) FROM pool WHERE topic = ? AND level = ? AND served IS NULL",
+                (normalize_topic(topic), level),
+            ).fetchone()[0]
+
+    def depths(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT topic, level, COUNT(*) FROM pool WHERE served IS NULL GROUP BY topic, level"
+            ).fetchall()
+        return {f"{topic}|{level}": count for topic, level, count in rows}
+
+    def stats(self) -> Dict:
+        depths = self.depths()
+        lookups = self.hits + self.misses
+        return {
+            "available": sum(depths.values()),
+            "topics": len(depths),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": (self.hits / lookups) if lookups else 0.0,
+            "rejected": self.rejected,
+            "duplicates": self.duplicates,
+            "near_duplicates": self.near_duplicates,
+        }
+
+    def close(self):
+        self._db.close()
+
+
+def make_generator(topic: str, level: str, num_questions: int, model_name: Optional[str] = None,
+                   base_url: Optional[str] = None, backend=None, loop=None):
+    """
+    A batch-mode QuestionGenerator for one topic (model_service is imported only when pre-generating).
+
+    `backend` and `loop` are handed to the generator as they are, e.g. the server's
+    BackendRouter and event loop; without them it talks to Ollama at model_name/base_url.
+    """
+    from model_service import AppConfig, GenerationConfig, ModelConfig, QuestionGenerator, QuestionTaskConfig
+
+    overrides = {"model_name": model_name, "base_url": base_url}
+    return QuestionGenerator(AppConfig(
+        model=ModelConfig(**{k: v for k, v in overrides.items() if v}),
+        generation=GenerationConfig(num_questions=num_questions, mode="batch", temperature=0.8),
+        task=QuestionTaskConfig(topic=topic, level=level),
+    ), backend=backend, loop=loop)
+
+
+class PoolFiller:
+    """
+    Keeps every (topic, level) pool topped up to `target_depth` questions.
+
+    Each round generates for the most depleted pools first, with at most
+    `workers` generations in flight. `run_forever` repeats rounds in a
+    background thread, and wakes early when `notify_drawn` signals that a
+    pool was drawn down. `is_idle()` is checked before every generation, so
+    live traffic arriving mid-round stops the rest of the round.
+    """
+
+    def __init__(self, pool: QuestionPool, topics: Sequence[str], levels: Sequence[str] = LEVELS,
+                 target_depth: int = 6, workers: int = 2, batch_size: int = 4,
+                 generator_factory: Callable = make_generator):
+        self.pool = pool
+        self.topics = list(topics)
+        self.levels = list(levels)
+        self.target_depth = target_depth
+        self.workers = workers
+        self.batch_size = batch_size
+        self.generator_factory = generator_factory
+        self.generated = 0
+        self.rounds = 0
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def deficits(self) -> List[Tuple[int, str, str]]:
+        """(missing, topic, level) for every pool below target, most depleted first"""
+        missing = [(self.target_depth - self.pool.depth(topic, level), topic, level)
+                   for topic in self.topics for level in self.levels]
+        return sorted((m for m in missing if m[0] > 0), reverse=True)
+
+    def _fill(self, topic: str, level: str, missing: int, is_idle: Callable[[], bool]) -> int:
+        if not is_idle():
+            return 0
+        generator = self.generator_factory(topic, level, min(missing, self.batch_size))
+        try:
+            questions = generator.generate_questions()
+        except Exception as e:
+            logger.error(f"Pre-generation failed for {topic} ({level}): {e}")
+            return 0
+        finally:
+            if hasattr(generator, "close"):
+                generator.close()
+        return self.pool.add(topic, level, questions)
+
+    def fill_round(self, is_idle: Callable[[], bool] = lambda: True) -> int:
+        """One pass over every depleted pool while `is_idle()` holds; returns the number of questions added"""
+        todo = self.deficits()
+        if not todo or not is_idle():
+            return 0
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="pregenerate") as executor:
+            added = sum(executor.map(lambda item: self._fill(item[1], item[2], item[0], is_idle), todo))
+        self.generated += added
+        self.rounds += 1
+        logger.info(f"Pre-generated {added} question(s) for {len(todo)} depleted pool(s)")
+        return added
+
+    def notify_drawn(self):
+        self._wake.set()
+
+    def run_forever(self, is_idle: Callable[[], bool] = lambda: True, interval_s: float = 30.0):
+        while not self._stop.is_set():
+            try:
+                self.fill_round(lambda: is_idle() and not self._stop.is_set())
+            except Exception as e:
+                logger.error(f"Pre-generation round failed: {e}")
+            self._wake.wait(interval_s)
+            self._wake.clear()
+
+    def start(self, is_idle: Callable[[], bool] = lambda: True, interval_s: float = 30.0):
+        self._thread = threading.Thread(target=self.run_forever, args=(is_idle, interval_s),
+                                        name="pool-filler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def stats(self) -> Dict:
+        return {
+            "target_depth": self.target_depth,
+            "pools": len(self.topics) * len(self.levels),
+            "depleted": len(self.deficits()),
+            "generated": self.generated,
+            "rounds": self.rounds,
+        }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Pre-generate questions for every syllabus topic and level")
+    parser.add_argument("--db", default=os.path.join(os.path.dirname(SYLLABUS_PATH), "cache", "question_pool.sqlite3"))
+    parser.add_argument("--depth", type=int, default=6, help="target questions per topic and level")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--level", choices=LEVELS, action="append")
+    args = parser.parse_args()
+
+    pool = QuestionPool(args.db)
+    filler = PoolFiller(pool, syllabus_topics(), args.level or LEVELS, target_depth=args.depth, workers=args.workers)
+    start = time.perf_counter()
+    filler.fill_round()
+    print(f"Filled in {time.perf_counter() - start:.1f}s: {pool.stats()}")
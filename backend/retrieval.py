@@ -0,0 +1,223 @@
+import os
+import re
+import json
+import glob
+import logging
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MERGED_DIR = os.path.join(PROJECT_DIR, "data", "merged")
+INDEX_DIR = os.path.join(PROJECT_DIR, "data", "index")
+
+MERGED_FILE_PATTERN = re.compile(r"(higher|ordinary)_merged_(\d{4})_\.json$")
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+STOP_WORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "each", "for", "from", "give", "how", "in",
+    "is", "it", "its", "of", "on", "or", "state", "that", "the", "their", "this", "to", "two",
+    "three", "what", "which", "with", "any", "one", "name", "describe", "explain", "outline",
+}
+LEVELS = ("higher", "ordinary")
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in TOKEN_PATTERN.findall((text or "").lower()) if t not in STOP_WORDS and len(t) > 1]
+
+
+def iter_merged_parts(merged_dir: str = MERGED_DIR, include_skipped: bool = False):
+    """
+    Flatten every merged file into one record per answerable part/subpart.
+    Parts or questions marked skip (diagram/photo questions) are left out
+    unless `include_skipped` is set; each record carries its "skip" flag.
+    """
+    for path in sorted(glob.glob(os.path.join(merged_dir, "*_merged_*.json"))):
+        match = MERGED_FILE_PATTERN.search(os.path.basename(path))
+        if not match:
+            continue
+        level, year = match.group(1), int(match.group(2))
+        with open(path, "r", encoding="utf-8") as f:
+            questions = json.load(f)
+        for q in questions:
+            q_skip = q.get("skip") is True
+            if q_skip and not include_skipped:
+                continue
+            context = q.get("context") or ""
+            for part in q.get("parts", []) or []:
+                part_skip = q_skip or part.get("skip") is True
+                if part_skip and not include_skipped:
+                    continue
+                subparts = [s for s in part.get("subparts", []) or [] if include_skipped or s.get("skip") is not True]
+                if not subparts:
+                    yield {
+                        "level": level, "year": year,
+                        "question_num": str(q.get("question_num", "")),
+                        "part_id": str(part.get("id", "")), "subpart_id": "",
+                        "context": context, "text": part.get("text") or "",
+                        "solution": part.get("solution") or [],
+                        "skip": part_skip,
+                    }
+                    continue
+                for sub in subparts:
+                    yield {
+                        "level": level, "year": year,
+                        "question_num": str(q.get("question_num", "")),
+                        "part_id": str(part.get("id", "")), "subpart_id": str(sub.get("id", "")),
+                        "context": part.get("text") or "",
+                        "text": sub.get("text") or "",
+                        "solution": sub.get("solution") or [],
+                        "skip": part_skip or sub.get("skip") is True,
+                    }
+
+
+def source_fingerprint(merged_dir: str = MERGED_DIR) -> List[List]:
+    """(name, mtime, size) for every merged file - a changed bank means a stale index"""
+    fingerprint = []
+    for path in sorted(glob.glob(os.path.join(merged_dir, "*_merged_*.json"))):
+        stat = os.stat(path)
+        fingerprint.append([os.path.basename(path), stat.st_mtime, stat.st_size])
+    return fingerprint
+
+
+@dataclass
+class SearchHit:
+    score: float
+    passage: Dict
+
+    def label(self) -> str:
+        p = self.passage
+        ref = f"{p['year']} Q{p['question_num']}({p['part_id']})"
+        if p["subpart_id"]:
+            ref += f"({p['subpart_id']})"
+        return ref
+
+
+class RetrievalIndex:
+    """
+    BM25 index over past exam parts.
+
+    Postings are stored as flat NumPy arrays (CSR layout: `offsets[t]:offsets[t+1]`
+    slices `doc_ids`/`weights` for term t) with the BM25 term weight precomputed,
+    so a query is a handful of array gathers plus one `np.add.at`.
+    """
+
+    def __init__(self, passages: List[Dict], vocab: Dict[str, int], offsets: np.ndarray,
+                 doc_ids: np.ndarray, weights: np.ndarray, fingerprint: Optional[List] = None):
+        self.passages = passages
+        self.vocab = vocab
+        self.offsets = offsets
+        self.doc_ids = doc_ids
+        self.weights = weights
+        self.fingerprint = fingerprint or []
+        self.levels = np.array([LEVELS.index(p["level"]) for p in passages], dtype=np.int8)
+
+    @classmethod
+    def build(cls, passages: List[Dict], k1: float = 1.5, b: float = 0.75,
+              fingerprint: Optional[List] = None) -> "RetrievalIndex":
+        postings: Dict[str, Dict[int, int]] = {}
+        lengths = np.zeros(len(passages), dtype=np.float32)
+        for doc_id, p in enumerate(passages):
+            # Solutions are indexed too - they often name the topic the question only implies.
+            # Shared context is left out: in the bank it often repeats the whole question.
+            tokens = tokenize(" ".join([p["text"], " ".join(p["solution"])]))
+            lengths[doc_id] = len(tokens)
+            for token in tokens:
+                term_docs = postings.setdefault(token, {})
+                term_docs[doc_id] = term_docs.get(doc_id, 0) + 1
+
+        n_docs = max(len(passages), 1)
+        avg_len = float(lengths.mean()) if len(passages) else 1.0
+        vocab = {term: i for i, term in enumerate(sorted(postings))}
+        offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        doc_chunks, weight_chunks = [], []
+        for term, i in vocab.items():
+            docs = np.fromiter(postings[term].keys(), dtype=np.int32)
+            tf = np.fromiter(postings[term].values(), dtype=np.float32)
+            idf = np.log(1.0 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            norm = k1 * (1.0 - b + b * lengths[docs] / avg_len)
+            doc_chunks.append(docs)
+            weight_chunks.append((idf * tf * (k1 + 1.0) / (tf + norm)).astype(np.float32))
+            offsets[i + 1] = offsets[i] + len(docs)
+
+        doc_ids = np.concatenate(doc_chunks) if doc_chunks else np.zeros(0, dtype=np.int32)
+        weights = np.concatenate(weight_chunks) if weight_chunks else np.zeros(0, dtype=np.float32)
+        return cls(passages, vocab, offsets, doc_ids, weights, fingerprint)
+
+    def search(self, query: str, level: Optional[str] = None, k: int = 5) -> List[SearchHit]:
+        scores = np.zeros(len(self.passages), dtype=np.float32)
+        for term in set(tokenize(query)):
+            i = self.vocab.get(term)
+            if i is None:
+                continue
+            start, end = self.offsets[i], self.offsets[i + 1]
+            np.add.at(scores, self.doc_ids[start:end], self.weights[start:end])
+
+        if level in LEVELS:
+            scores[self.levels != LEVELS.index(level)] = 0.0
+        candidates = np.flatnonzero(scores > 0)
+        if len(candidates) == 0:
+            return []
+        k = min(k, len(candidates))
+        top = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [SearchHit(float(scores[i]), self.passages[i]) for i in top]
+
+    def save(self, index_dir: str = INDEX_DIR):
+        os.makedirs(index_dir, exist_ok=True)
+        np.savez(os.path.join(index_dir, "retrieval_index.npz"),
+                 offsets=self.offsets, doc_ids=self.doc_ids, weights=self.weights)
+        with open(os.path.join(index_dir, "retrieval_index.json"), "w", encoding="utf-8") as f:
+            json.dump({"fingerprint": self.fingerprint, "vocab": self.vocab, "passages": self.passages},
+                      f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, index_dir: str = INDEX_DIR) -> "RetrievalIndex":
+        with open(os.path.join(index_dir, "retrieval_index.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        arrays = np.load(os.path.join(index_dir, "retrieval_index.npz"))
+        return cls(meta["passages"], meta["vocab"], arrays["offsets"], arrays["doc_ids"],
+                   arrays["weights"], meta["fingerprint"])
+
+
+def load_or_build_index(merged_dir: str = MERGED_DIR, index_dir: str = INDEX_DIR) -> RetrievalIndex:
+    """Load the persisted index, rebuilding it only when the merged bank has changed"""
+    fingerprint = source_fingerprint(merged_dir)
+    try:
+        index = RetrievalIndex.load(index_dir)
+        if index.fingerprint == fingerprint:
+            logger.info(f"Loaded retrieval index with {len(index.passages)} parts from {index_dir}")
+            return index
+    except (OSError, ValueError, KeyError):
+        pass
+
+    passages = list(iter_merged_parts(merged_dir))
+    index = RetrievalIndex.build(passages, fingerprint=fingerprint)
+    index.save(index_dir)
+    logger.info(f"Built retrieval index with {len(passages)} parts and {len(index.vocab)} terms")
+    return index
+
+
+def format_hits(hits: List[SearchHit], max_context_chars: int = 200) -> str:
+    """Render retrieved parts as compact prompt context"""
+    lines = []
+    for hit in hits:
+        p = hit.passage
+        context = p["context"] if len(p["context"]) <= max_context_chars else ""
+        text = " ".join(filter(None, [context, p["text"]]))
+        lines.append(f"- [{hit.label()}] {text}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    index = load_or_build_index()
+    query = " ".join(sys.argv[1:]) or "liver fluke"
+    start = time.perf_counter()
+    hits = index.search(query, level="higher", k=5)
+    print(f"{len(hits)} hit(s) for '{query}' in {(time.perf_counter() - start) * 1000:.2f}ms")
+    print(format_hits(hits))
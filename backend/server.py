@@ -1,26 +1,86 @@
-import openai
 from fastapi import FastAPI, HTTPException
 from fastapi.exceptions import RequestValidationError
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from starlette.requests import Request
 from pydantic import BaseModel
 from dotenv import load_dotenv
 import os
+import asyncio
+import time
+from typing import List, Optional
+from concurrent.futures import ThreadPoolExecutor
 from fastapi.middleware.cors import CORSMiddleware
-import PyPDF2
+
+from pdf_cache import PdfTextCache
+from streaming import QUESTION_HEADER, QuestionStreamSplitter, ndjson
+from retrieval import SearchHit, load_or_build_index, format_hits
+from generation_cache import GenerationCache, normalize_key, normalize_topic
+from question_bank import load_or_compile_bank
+from topic_index import load_or_build_topic_index
+from coalescing import Coalescer, SharedGeneration
+from near_duplicates import NearDuplicateIndex, dedupe_texts
+from question_pool import PoolFiller, QuestionPool, make_generator, syllabus_topics
+from llm_backends import BackendRouter, OllamaBackend, OpenAIBackend, StubBackend, parse_routes
+from token_budget import TokenAccounting, completion_budget, count_tokens, fit_to_budget, truncate_to_tokens
+from metrics import REGISTRY, SamplingProfiler, observe_llm_call, observe_stage, stage, trace
 
 
 load_dotenv(os.path.join(os.path.dirname(__file__), ".env"))
 
-# Initialize OpenAI client
+# OpenAI settings. The client is created during warm-up (or on first use), so importing the
+# app needs neither OPEN_AI_KEY nor the openai package
 open_ai_key = os.getenv("OPEN_AI_KEY")
-if not open_ai_key:
-    raise ValueError("OPEN_AI_KEY environment variable is not set. Please set it in your .env file.")
-client = openai.OpenAI(api_key=open_ai_key)
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+
+def make_openai_client():
+    """
+    One AsyncOpenAI client shared by every request so completions reuse a pooled HTTP connection
+    instead of blocking the event loop while waiting on OpenAI
+    """
+    if not open_ai_key:
+        raise ValueError("OPEN_AI_KEY environment variable is not set. Please set it in your .env file.")
+    import httpx
+    import openai
+
+    return openai.AsyncOpenAI(
+        api_key=open_ai_key,
+        http_client=httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=OPENAI_MAX_CONNECTIONS, max_keepalive_connections=20),
+            timeout=httpx.Timeout(60.0, connect=5.0),
+        ),
+    )
+
+# PDF extraction is CPU-bound, so it runs in a worker pool rather than on the event loop
+EXTRACTION_WORKERS = int(os.getenv("EXTRACTION_WORKERS", str(min(4, os.cpu_count() or 1))))
+extraction_executor = ThreadPoolExecutor(max_workers=EXTRACTION_WORKERS, thread_name_prefix="pdf-extract")
 
 # Create FastAPI app
 app = FastAPI()
 
+# Every request is traced stage by stage into the histograms served at /metrics; with
+# PROFILE_EVERY_N=n every nth request is also run under cProfile into PROFILE_DIR
+REQUEST_SECONDS = REGISTRY.histogram("http_request_seconds", "Time until the response starts, by route",
+                                     labelnames=["route", "method", "status"])
+GENERATION_SOURCE = REGISTRY.counter("generation_source_total", "Question sets served, by where they came from",
+                                     ["source"])
+profiler = SamplingProfiler(
+    every_n=int(os.getenv("PROFILE_EVERY_N", "0")),
+    out_dir=os.getenv("PROFILE_DIR", os.path.join(os.path.dirname(__file__), "..", "data", "cache", "profiles")),
+)
+
+@app.middleware("http")
+async def instrument_requests(request: Request, call_next):
+    start = time.perf_counter()
+    with trace(request.url.path) as current, profiler.profile(request.url.path):
+        response = await call_next(request)
+    elapsed = time.perf_counter() - start
+    # The route template, not the raw path, so unknown URLs cannot blow up label cardinality
+    route = getattr(request.scope.get("route"), "path", "unmatched")
+    REQUEST_SECONDS.observe(elapsed, route=route, method=request.method, status=str(response.status_code))
+    # Streaming responses start before generation ends, so they only carry the stages done by then
+    response.headers["Server-Timing"] = ", ".join(filter(None, [current.server_timing(), f"total;dur={elapsed * 1000:.1f}"]))
+    return response
+
 
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
@@ -52,7 +112,17 @@ app.add_middleware(
 class TopicRequest(BaseModel):
     topic_name: str
     level: str
-    paper: str = None 
+    paper: Optional[str] = None
+
+# One section of a mock exam paper: `count` questions on one topic
+class PaperSection(BaseModel):
+    topic_name: str
+    count: int = 3
+
+class PaperRequest(BaseModel):
+    level: str
+    sections: List[PaperSection]
+    paper: Optional[str] = None
 
 # PDF processing functions
 def get_pdf_path( level, paper=None):
@@ -65,6 +135,8 @@ def get_pdf_path( level, paper=None):
 
 def extract_text_by_rules(pdf_path, start_page=0, skip_first_page=False, stop_word=None):
     """Extract text from PDF with specific rules"""
+    import PyPDF2  # only needed on a PDF text cache miss
+
     with open(pdf_path, "rb") as f:
         reader = PyPDF2.PdfReader(f)
         text = ""
@@ -80,49 +152,578 @@ def extract_text_by_rules(pdf_path, start_page=0, skip_first_page=False, stop_wo
             text += page_text
         return text
 
-# Root endpoint - returns server status
+def extract_past_paper_text(pdf_path):
+    """Rules used for every past paper fed into the prompt"""
+    return extract_text_by_rules(pdf_path, skip_first_page=True, stop_word="Do not write on this page")
+
+# Extracted past-paper text is cached per (level, paper) so PyPDF2 never runs on the hot path
+pdf_text_cache = PdfTextCache(get_pdf_path, extract_past_paper_text)
+
+async def run_in_worker(func, *args):
+    """Run a blocking function in the extraction pool without stalling the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(extraction_executor, func, *args)
+
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
+
+# LLM backends behind one router: LLM_BACKENDS picks which are enabled, LLM_ROUTES the
+# preference order per level, e.g. "higher=openai,ollama;ordinary=ollama,openai"
+def build_backends(names):
+    backends = []
+    for name in names:
+        if name == "openai":
+            backends.append(OpenAIBackend(model=OPENAI_MODEL, client_factory=make_openai_client))
+        elif name == "ollama":
+            backends.append(OllamaBackend(
+                model=os.getenv("OLLAMA_MODEL", "llama3.1:8b"),
+                base_url=os.getenv("OLLAMA_BASE_URL", "http://localhost:11434/v1"),
+            ))
+        elif name == "stub":
+            backends.append(StubBackend())
+        else:
+            raise ValueError(f"Unknown LLM backend: {name}")
+    return backends
+
+router = BackendRouter(
+    build_backends([n.strip() for n in os.getenv("LLM_BACKENDS", "openai").split(",") if n.strip()]),
+    routes=parse_routes(os.getenv("LLM_ROUTES", "")),
+    slo_s=float(os.getenv("LLM_SLO_S")) if os.getenv("LLM_SLO_S") else None,
+    first_token_timeout_s=float(os.getenv("LLM_FIRST_TOKEN_TIMEOUT_S", "15")),
+    idle_timeout_s=float(os.getenv("LLM_IDLE_TIMEOUT_S", "30")),
+    hedge=os.getenv("LLM_HEDGE", "1") == "1",
+)
+
+# Input budget per prompt: retrieved parts are dropped lowest-priority first, a whole paper is cut short
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "3000"))
+# Every prompt asks for 3 questions of "two or more parts"; max_tokens is sized to that structure
+QUESTIONS_PER_REQUEST = 3
+PARTS_PER_QUESTION = int(os.getenv("PARTS_PER_QUESTION", "3"))
+COMPLETION_TOKEN_LIMIT = completion_budget(QUESTIONS_PER_REQUEST, PARTS_PER_QUESTION)
+token_accounting = TokenAccounting()
+
+# Pre-generated questions per syllabus topic and level, served before any live generation.
+# With QUESTION_POOL_PREGENERATE=1 a background filler tops pools up to QUESTION_POOL_DEPTH
+# whenever no live generation is running.
+QUESTION_POOL_DB = os.getenv("QUESTION_POOL_DB", os.path.join(os.path.dirname(__file__), "..", "data", "cache", "question_pool.sqlite3"))
+QUESTION_POOL_DEPTH = int(os.getenv("QUESTION_POOL_DEPTH", "6"))
+# A free-text topic is served from a syllabus section's pool only when it matches that section this closely
+POOL_MATCH_SCORE = float(os.getenv("QUESTION_POOL_MATCH_SCORE", "0.5"))
+
+# MinHash/LSH index over the question bank, the pool and every generated question. A generated
+# question this similar (estimated Jaccard of word 3-shingles) to an indexed one is a repeat.
+# Only the DUPLICATE_MAX_GENERATED most recent generated questions are kept indexed.
+duplicate_index = NearDuplicateIndex(threshold=float(os.getenv("DUPLICATE_THRESHOLD", "0.6")),
+                                     max_added=int(os.getenv("DUPLICATE_MAX_GENERATED", "5000")))
+question_pool = QuestionPool(QUESTION_POOL_DB, duplicates=duplicate_index)
+pool_filler = None
+
+# Single-flight: concurrent identical requests (same normalized cache key) share one generation
+coalescer = Coalescer()
+
+# Mock exam papers fan their sections out concurrently; this caps live section generations
+# across every paper request so one large paper cannot monopolise the LLM backends
+PAPER_CONCURRENCY = int(os.getenv("PAPER_CONCURRENCY", "4"))
+MAX_PAPER_SECTIONS = int(os.getenv("MAX_PAPER_SECTIONS", "20"))
+MAX_SECTION_QUESTIONS = int(os.getenv("MAX_SECTION_QUESTIONS", "10"))
+paper_semaphore = asyncio.Semaphore(PAPER_CONCURRENCY)
+
+# Generated questions are cached per normalized (topic, level, paper, model, temperature).
+# Each key keeps a pool of variants so repeat requests rotate through different questions.
+generation_cache = GenerationCache(
+    max_entries=int(os.getenv("GENERATION_CACHE_SIZE", "512")),
+    ttl_s=float(os.getenv("GENERATION_CACHE_TTL", str(24 * 3600))),
+    pool_size=int(os.getenv("GENERATION_CACHE_VARIANTS", "3")),
+    db_path=os.getenv("GENERATION_CACHE_DB") or None,
+)
+
+# Number of retrieved past parts injected into each prompt
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "8"))
+retrieval_index = None
+topic_index = None
+question_bank = None
+
+# Warm-up (indexes, PDF text cache, LLM clients, pool filler) runs in the background after
+# startup, so the app accepts connections right away; /ready turns 200 once it has finished.
+# WARM_UP=blocking instead holds startup until warm-up is done.
+WARM_UP_MODE = os.getenv("WARM_UP", "background")
+warm_up_state = {"ready": False, "started": time.time(), "warm_up_s": None, "steps": {}, "errors": {}}
+warm_up_task = None
+
+async def warm_up_step(name: str, step):
+    start = time.perf_counter()
+    try:
+        await step()
+    except Exception as e:
+        print(f"Warm-up step {name} failed: {e}")
+        warm_up_state["errors"][name] = str(e)
+    warm_up_state["steps"][name] = round(time.perf_counter() - start, 3)
+
+async def warm_up():
+    start = time.perf_counter()
+    await asyncio.gather(
+        warm_up_step("pdf_text_cache", warm_up_pdf_cache),
+        warm_up_step("retrieval_index", load_retrieval_index),
+        warm_up_step("question_bank", load_question_bank),
+        warm_up_step("llm_clients", warm_up_backends),
+    )
+    await warm_up_step("pool_filler", start_pool_filler)
+    warm_up_state["warm_up_s"] = round(time.perf_counter() - start, 3)
+    warm_up_state["ready"] = not warm_up_state["errors"]
+    print(f"Warm-up finished in {warm_up_state['warm_up_s']:.2f}s"
+          + (f" with errors in {', '.join(warm_up_state['errors'])}" if warm_up_state["errors"] else ""))
+
+@app.on_event("startup")
+async def start_warm_up():
+    global warm_up_task
+    if WARM_UP_MODE == "blocking":
+        await warm_up()
+    else:
+        warm_up_task = asyncio.create_task(warm_up())
+
+async def warm_up_backends():
+    errors = await router.warm_up()
+    if errors:
+        raise RuntimeError("; ".join(f"{name}: {error}" for name, error in errors.items()))
+
+async def warm_up_pdf_cache():
+    loaded = await run_in_worker(pdf_text_cache.warm_up)
+    print(f"Preloaded {loaded} past paper(s) into the PDF text cache")
+
+async def load_retrieval_index():
+    global retrieval_index
+    retrieval_index = await run_in_worker(load_or_build_index)
+    print(f"Loaded retrieval index with {len(retrieval_index.passages)} past question parts")
+
+async def load_question_bank():
+    global question_bank, topic_index
+    start = time.perf_counter()
+    topic_index = await run_in_worker(load_or_build_topic_index)
+    question_bank = await run_in_worker(lambda: load_or_compile_bank(topic_index=topic_index))
+    print(f"Mapped question bank with {len(question_bank)} parts in {(time.perf_counter() - start) * 1000:.1f}ms")
+    indexed = await run_in_worker(index_bank_duplicates, question_bank)
+    print(f"Indexed {indexed} past parts for near-duplicate checks")
+
+def index_bank_duplicates(bank) -> int:
+    for i in range(len(bank)):
+        record = bank.record(i)
+        duplicate_index.add(record.text, source="bank", topic=(record.tags or [""])[0])
+    return len(bank)
+
+async def start_pool_filler():
+    global pool_filler
+    if os.getenv("QUESTION_POOL_PREGENERATE", "0") != "1":
+        return
+    pool_filler = PoolFiller(
+        question_pool, await run_in_worker(syllabus_topics),
+        target_depth=QUESTION_POOL_DEPTH,
+        workers=int(os.getenv("QUESTION_POOL_WORKERS", "2")),
+        # Through the router, so pre-generation uses the same backends and fallbacks as live requests
+        generator_factory=lambda topic, level, n, loop=asyncio.get_running_loop(): make_generator(
+            topic, level, n, backend=router, loop=loop),
+    )
+    pool_filler.start(is_idle=lambda: coalescer.stats()["in_flight"] == 0)
+    print(f"Started question pool filler for {len(pool_filler.topics)} topics")
+
+@app.on_event("shutdown")
+async def close_clients():
+    if warm_up_task is not None:
+        warm_up_task.cancel()
+    await coalescer.close()
+    if pool_filler is not None:
+        pool_filler.stop()
+    await router.close()
+    extraction_executor.shutdown(wait=False)
+    if question_bank is not None:
+        question_bank.close()
+
+# Root endpoint - returns server status (liveness: answers as soon as the app is up)
 @app.get("/")
 async def root():
     return {"status": "Server is running"}
 
+# Readiness - 503 until warm-up has finished without errors, then 200
+@app.get("/ready")
+async def ready():
+    state = dict(warm_up_state, uptime_s=round(time.time() - warm_up_state["started"], 3))
+    return JSONResponse(status_code=200 if state["ready"] else 503, content=state)
+
+# PDF text cache counters - misses should only grow at startup or when a PDF changes
+@app.get("/api/cache/pdf_text")
+async def pdf_text_cache_stats():
+    return pdf_text_cache.stats()
+
+# Generation cache hit ratio and memory footprint
+@app.get("/api/cache/generation")
+async def generation_cache_stats():
+    return generation_cache.stats()
+
+# Past question parts by level / year / question number / topic tag
+@app.get("/api/bank/questions")
+async def bank_questions(level: str = None, year: int = None, question: str = None, tag: str = None,
+                         include_skipped: bool = False):
+    if question_bank is None:
+        raise HTTPException(status_code=503, detail="Question bank is still loading")
+    records = question_bank.find(level=level, year=year, question=question, tag=tag, include_skipped=include_skipped)
+    return {"count": len(records), "parts": [r.to_dict() for r in records]}
+
+# Syllabus sections and tagged past parts for a free-text topic (or a section code such as "2.2")
+@app.get("/api/topics/resolve")
+async def resolve_topic(topic: str, level: str = None, k: int = RETRIEVAL_TOP_K):
+    if topic_index is None or question_bank is None:
+        raise HTTPException(status_code=503, detail="Topic index is still loading")
+    sections = [{"code": s.code, "title": s.title, "strand": s.strand, "score": round(score, 3)}
+                for score, s in topic_index.match_sections(topic)]
+    return {"sections": sections, "parts": [hit.passage for hit in topic_hits(topic, level, k)]}
+
+def topic_hits(topic: str, level: str, k: int):
+    """Past parts tagged with the syllabus sections the topic resolves to, via the inverted index"""
+    if topic_index is None or question_bank is None:
+        return []
+    return [SearchHit(score, question_bank.record(part).to_dict()) for score, part in topic_index.resolve(topic, level, k)]
+
+# Prompt/completion token histograms and how often the input budget trimmed context
+@app.get("/api/tokens")
+async def token_stats():
+    stats = token_accounting.stats()
+    stats.update({"prompt_budget": PROMPT_TOKEN_BUDGET, "completion_limit": COMPLETION_TOKEN_LIMIT})
+    return stats
+
+# Per-backend wins, errors, hedges and time-to-first-token percentiles
+@app.get("/api/llm/backends")
+async def llm_backend_stats():
+    return router.stats()
+
+# How many requests joined an identical in-flight generation instead of starting their own
+@app.get("/api/coalescing")
+async def coalescing_stats():
+    return coalescer.stats()
+
+# Pre-generated pool depth, hit ratio and filler progress
+@app.get("/api/pool")
+async def pool_stats():
+    stats = question_pool.stats()
+    stats["filler"] = pool_filler.stats() if pool_filler is not None else None
+    return stats
+
+# Per-topic share of generated questions rejected as repeats of the bank, the pool or earlier output
+@app.get("/api/duplicates")
+async def duplicate_stats():
+    return duplicate_index.stats()
+
+# Prometheus text format: per-stage latency, request latency, token and prompt size histograms
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+REGISTRY.gauge("generations_in_flight", "Distinct generations currently running", lambda: coalescer.stats()["in_flight"])
+REGISTRY.gauge("question_pool_available", "Pre-generated questions not yet served", lambda: question_pool.stats()["available"])
+REGISTRY.gauge("generation_cache_hit_ratio", "Generation cache hit ratio", lambda: generation_cache.stats().get("hit_ratio", 0.0))
+
+def pool_topic(data: TopicRequest) -> str:
+    """The syllabus pool a request maps to, or its own topic when no section matches closely"""
+    if topic_index is not None:
+        sections = topic_index.match_sections(data.topic_name)
+        if sections and sections[0][0] >= POOL_MATCH_SCORE:
+            section = sections[0][1]
+            return f"{section.strand}: {section.title}"
+    return data.topic_name
+
+def take_from_pool(data: TopicRequest, num_questions: int = QUESTIONS_PER_REQUEST):
+    """A full question set from the pre-generated pool, or None to generate live"""
+    if data.paper:
+        # Pools are not built from a specific paper
+        return None
+    questions = question_pool.take(pool_topic(data), data.level, num_questions)
+    if questions is None:
+        return None
+    if pool_filler is not None:
+        pool_filler.notify_drawn()
+    return "\n\n".join(f"{i}. {q}" for i, q in enumerate(questions, 1))
+
+def cache_key(data: TopicRequest, num_questions: int = QUESTIONS_PER_REQUEST, backend: Optional[str] = None) -> str:
+    """
+    Keyed on the backend and model that answer `data` - by default the level's preferred
+    route - so answers from different models are never served under one key.
+    """
+    llm = router.backends[backend] if backend else router.preferred(data.level)
+    key = normalize_key(data.topic_name, data.level, data.paper, f"{llm.name}:{llm.model}", None)
+    return key if num_questions == QUESTIONS_PER_REQUEST else f"{key}|n={num_questions}"
+
+ORDINALS = ["First", "Second", "Third", "Fourth", "Fifth", "Sixth", "Seventh", "Eighth", "Ninth", "Tenth"]
+
+def build_prompt(data: TopicRequest, past_material: str, retrieved: bool = True,
+                 num_questions: int = QUESTIONS_PER_REQUEST) -> str:
+    if retrieved:
+        intro = f"Here are past exam questions for agriculture science ({data.level}) related to this topic:\n\n"
+    else:
+        intro = f"Here is past exam paper for agriculture science ({data.level}):\n\n"
+    return (
+        f"You are an experienced Leaving Certificate teacher. "
+        f"{intro}"
+        f"{past_material}\n\n"
+        f"Write {num_questions} structured exam-style open-ended questions about the topic: '{data.topic_name}'.\n"
+        f"Each question should have two or more parts. Format them as follows:\n\n"
+        + "".join(f"{i}. [{ORDINALS[i - 1] if i <= len(ORDINALS) else f'Question {i}'} question with parts]\n\n"
+                  for i in range(1, num_questions + 1))
+        + "Make sure each question is numbered and has a blank line between questions."
+    )
+
+async def load_past_paper(data: TopicRequest) -> str:
+    # Determine the correct PDF path using the requested level and optional paper
+    with stage("pdf_path"):
+        pdf_path = get_pdf_path(data.level, data.paper)
+    if not pdf_path:
+        raise HTTPException(status_code=404, detail="Missing path for agriculture paper")
+    with stage("pdf_extract"):
+        return await run_in_worker(pdf_text_cache.get_text, data.level, data.paper)
+
+def retrieve_context(data: TopicRequest):
+    """
+    Past parts for the topic in priority order: up to half from its syllabus sections,
+    the rest from keyword search, without repeats.
+    """
+    with stage("retrieval"):
+        return _retrieve_context(data)
+
+def _retrieve_context(data: TopicRequest):
+    hits = topic_hits(data.topic_name, data.level, RETRIEVAL_TOP_K // 2)
+    if retrieval_index is not None:
+        hits += retrieval_index.search(data.topic_name, level=data.level, k=RETRIEVAL_TOP_K)
+    unique, seen = [], set()
+    for hit in hits:
+        if hit.label() not in seen:
+            seen.add(hit.label())
+            unique.append(hit)
+    # "OR" alternatives and parts repeated across years say the same thing twice
+    return [unique[i] for i in dedupe_texts([hit.passage["text"] for hit in unique])][:RETRIEVAL_TOP_K]
+
+async def prepare_prompt(data: TopicRequest, num_questions: int = QUESTIONS_PER_REQUEST, hits=None):
+    """
+    Prefer retrieved past parts (`hits`, or retrieve_context when not given). Fall back to
+    the whole paper if nothing matches.
+
+    Returns (prompt, prompt tokens, trimmed) with the prompt held to PROMPT_TOKEN_BUDGET.
+    """
+    if hits is None:
+        hits = retrieve_context(data)
+    render = lambda material, retrieved=True: build_prompt(data, material, retrieved, num_questions)
+    if hits:
+        with stage("prompt_build"):
+            # Hits are already in priority order, so the budget drops the weakest first
+            prompt, kept, tokens = fit_to_budget(lambda kept_hits: render(format_hits(kept_hits)),
+                                                 hits, PROMPT_TOKEN_BUDGET, OPENAI_MODEL)
+        return prompt, tokens, kept < len(hits)
+    past_exam_text = await load_past_paper(data)
+    with stage("prompt_build"):
+        available = PROMPT_TOKEN_BUDGET - count_tokens(render("", retrieved=False), OPENAI_MODEL)
+        trimmed_text = truncate_to_tokens(past_exam_text, available, OPENAI_MODEL)
+        prompt = render(trimmed_text, retrieved=False)
+        return prompt, count_tokens(prompt, OPENAI_MODEL), len(trimmed_text) < len(past_exam_text)
+
+async def produce_questions(data: TopicRequest, key: str, generation: SharedGeneration,
+                            num_questions: int = QUESTIONS_PER_REQUEST, hits=None):
+    """Run one generation for `data`, publishing its stream events to every request that joined it"""
+    prompt, prompt_tokens, trimmed = await prepare_prompt(data, num_questions, hits)
+    generation.mark_ready()
+
+    splitter = QuestionStreamSplitter()
+    usage, served_by = None, None
+    stream = router.stream(
+        [{"role": "user", "content": prompt}],
+        level=data.level,
+        max_tokens=completion_budget(num_questions, PARTS_PER_QUESTION),
+    )
+    start = time.perf_counter()
+    try:
+        async for chunk in stream:
+            if served_by is None:
+                observe_stage("llm_first_token", time.perf_counter() - start)
+            served_by = chunk.backend
+            if chunk.prompt_tokens is not None:
+                usage = chunk
+            for event in splitter.feed(chunk.text):
+                await generation.publish(event)
+    except Exception:
+        observe_llm_call(served_by or "none", 0, 0, ok=False)
+        raise
+    observe_stage("llm", time.perf_counter() - start)
+    for event in splitter.close():
+        await generation.publish(event)
+    with stage("postprocess"):
+        questions, duplicates = drop_duplicate_questions(data, splitter.text, generation.events)
+        if usage is not None:
+            prompt_tokens, completion_tokens = usage.prompt_tokens, usage.completion_tokens or 0
+            token_accounting.record(prompt_tokens, completion_tokens, trimmed)
+        else:
+            completion_tokens = count_tokens(splitter.text, OPENAI_MODEL)
+            token_accounting.record(prompt_tokens, completion_tokens, trimmed, estimated=True)
+        observe_llm_call(served_by or "none", prompt_tokens, completion_tokens, prompt_chars=len(prompt))
+        # A fallback backend's answer is cached under its own model, not the preferred route's key
+        if served_by and served_by != router.preferred(data.level).name:
+            key = cache_key(data, num_questions, served_by)
+        generation_cache.put(key, questions)
+    await generation.publish({"event": "done", "questions": questions, "backend": served_by, "duplicates": duplicates})
+    await generation.finish(result=questions)
+
+def drop_duplicate_questions(data: TopicRequest, text: str, events):
+    """
+    Check each finished question against the duplicate index and drop repeats, renumbering the
+    rest. Streamed tokens are already out, so stream clients only learn which questions were
+    repeats from the "done" event; the returned (and cached) text never contains them.
+    Returns (questions text, numbers of the dropped questions).
+    """
+    topic = normalize_topic(data.topic_name)
+    finished = [e for e in events if e["event"] == "question_end"]
+    kept, duplicates = [], []
+    for event in finished:
+        match = duplicate_index.check(event["text"], topic=topic, add_as="generated")
+        if match is None:
+            kept.append(event["text"])
+        else:
+            print(f"Question {event['question']} repeats a {match.source} question ({match.similarity:.2f} similar)")
+            duplicates.append(event["question"])
+    if not duplicates or not kept:
+        # Nothing dropped, or nothing left to serve: returning the repeats beats returning nothing
+        return text, []
+    return "\n\n".join(f"{i}. {QUESTION_HEADER.sub('', q, count=1).strip()}" for i, q in enumerate(kept, 1)), duplicates
+
+def join_generation(data: TopicRequest, key: str, num_questions: int = QUESTIONS_PER_REQUEST,
+                    hits=None) -> SharedGeneration:
+    """Identical requests already in flight share one generation instead of each calling the LLM"""
+    return coalescer.join(key, lambda generation: produce_questions(data, key, generation, num_questions, hits))
+
 # AI questions endpoint - POST only
 @app.post("/api/ai/generate_questions")
 async def generate_questions(data: TopicRequest):
     print(f"Received request: topic={data.topic_name}, level={data.level}")
     
     try:
-        # Determine the correct PDF path using the requested level and optional paper
-        pdf_path = get_pdf_path(data.level, data.paper)
-        if not pdf_path:
-            raise HTTPException(status_code=404, detail="Missing path for agriculture paper")
-        else:
-            past_exam_text = extract_text_by_rules(pdf_path, skip_first_page=True, stop_word="Do not write on this page")
-            combined_text = past_exam_text
-        
-        # Generate AI questions
-        prompt = (
-            f"You are an experienced Leaving Certificate teacher. "
-            f"Here is past exam paper for agriculture science ({data.level}):\n\n"
-            f"{combined_text}\n\n"
-            f"Write 3 structured exam-style open-ended questions about the topic: '{data.topic_name}'.\n"
-            f"Each question should have two or more parts. Format them as follows:\n\n"
-            f"1. [First question with parts]\n\n"
-            f"2. [Second question with parts]\n\n"
-            f"3. [Third question with parts]\n\n"
-            f"Make sure each question is numbered and has a blank line between questions."
-        )
-        
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[{"role": "user", "content": prompt}]
-        )
-        
-        return {"questions": response.choices[0].message.content}
+        key = cache_key(data)
+        with stage("cache_lookup"):
+            cached = generation_cache.get(key)
+            pooled = take_from_pool(data) if cached is None else None
+        if cached is not None:
+            GENERATION_SOURCE.inc(source="cached")
+            return {"questions": cached}
+        if pooled is not None:
+            GENERATION_SOURCE.inc(source="pooled")
+            return {"questions": pooled}
+
+        GENERATION_SOURCE.inc(source="generated")
+        questions = await join_generation(data, key).wait()
+        return {"questions": questions}
         
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error generating questions: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# Streaming variant - forwards tokens as NDJSON lines while the model is still writing.
+# Besides "token" events it emits "question_start" / "question_end" so the client can
+# render question 1 while question 3 is still generating, then a final "done" event.
+@app.post("/api/ai/generate_questions/stream")
+async def generate_questions_stream(data: TopicRequest):
+    print(f"Received streaming request: topic={data.topic_name}, level={data.level}")
+
+    key = cache_key(data)
+    with stage("cache_lookup"):
+        cached = generation_cache.get(key)
+        source = "cached"
+        if cached is None:
+            cached, source = take_from_pool(data), "pooled"
+    GENERATION_SOURCE.inc(source=source if cached is not None else "generated")
+    if cached is not None:
+        async def cached_stream():
+            # Replay the cached or pooled text so clients still get question boundary events
+            splitter = QuestionStreamSplitter()
+            for event in splitter.feed(cached) + splitter.close():
+                yield ndjson(event)
+            yield ndjson({"event": "done", "questions": cached, source: True})
+        return StreamingResponse(cached_stream(), media_type="application/x-ndjson")
+
+    # Errors before the first byte still surface as normal HTTP errors
+    generation = join_generation(data, key)
+    try:
+        # Shielded so one client disconnecting does not cancel the shared future
+        await asyncio.shield(generation.ready)
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error preparing prompt: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    async def event_stream():
+        # Followers that join late replay the events they missed, then follow live
+        async for event in generation.subscribe():
+            yield ndjson(event)
+        if generation.error is not None:
+            print(f"Error streaming questions: {generation.error}")
+            yield ndjson({"event": "error", "detail": str(generation.error)})
+
+    return StreamingResponse(event_stream(), media_type="application/x-ndjson")
+
+async def generate_section(index: int, data: TopicRequest, count: int, hits):
+    """One paper section through the same cache -> pool -> coalesced generation path as single requests"""
+    start = time.perf_counter()
+    key = cache_key(data, count)
+    questions, source = generation_cache.get(key), "cached"
+    if questions is None:
+        questions, source = take_from_pool(data, count), "pooled"
+    if questions is None:
+        async with paper_semaphore:
+            questions, source = await join_generation(data, key, count, hits).wait(), "generated"
+    GENERATION_SOURCE.inc(source=source)
+    return {"event": "section", "section": index, "topic_name": data.topic_name, "count": count,
+            "questions": questions, "source": source, "latency_s": round(time.perf_counter() - start, 3)}
+
+# Mock exam paper - every section is generated concurrently (at most PAPER_CONCURRENCY live
+# generations at once) and streamed back as an NDJSON "section" event as soon as it completes,
+# so the paper takes about as long as its slowest section. Sections on the same topic share
+# one retrieval. Ends with a "done" event.
+@app.post("/api/ai/generate_paper")
+async def generate_paper(data: PaperRequest):
+    print(f"Received paper request: {len(data.sections)} section(s), level={data.level}")
+    if not data.sections or len(data.sections) > MAX_PAPER_SECTIONS:
+        raise HTTPException(status_code=400, detail=f"A paper needs 1 to {MAX_PAPER_SECTIONS} sections")
+    if any(not 1 <= s.count <= MAX_SECTION_QUESTIONS for s in data.sections):
+        raise HTTPException(status_code=400, detail=f"Each section asks for 1 to {MAX_SECTION_QUESTIONS} questions")
+
+    start = time.perf_counter()
+    requests = [TopicRequest(topic_name=s.topic_name, level=data.level, paper=data.paper) for s in data.sections]
+    context = {}
+    for request in requests:
+        topic = normalize_topic(request.topic_name)
+        if topic not in context:
+            context[topic] = retrieve_context(request)
+
+    async def section(index: int, request: TopicRequest, count: int):
+        try:
+            return await generate_section(index, request, count, context[normalize_topic(request.topic_name)])
+        except Exception as e:
+            print(f"Error generating paper section {index}: {e}")
+            detail = e.detail if isinstance(e, HTTPException) else str(e)
+            return {"event": "section_error", "section": index, "topic_name": request.topic_name, "detail": detail}
+
+    tasks = [asyncio.ensure_future(section(i, request, s.count))
+             for i, (request, s) in enumerate(zip(requests, data.sections), 1)]
+
+    async def paper_stream():
+        failed = 0
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                event = await next_done
+                failed += event["event"] == "section_error"
+                yield ndjson(event)
+        finally:
+            # Client went away: stop any section that is still waiting
+            for task in tasks:
+                task.cancel()
+        yield ndjson({"event": "done", "sections": len(tasks), "failed": failed,
+                      "elapsed_s": round(time.perf_counter() - start, 3)})
+
+    return StreamingResponse(paper_stream(), media_type="application/x-ndjson")
+
 # Run the app
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,107 @@
+import json
+import re
+from typing import Dict, Iterable, List, Optional
+
+# A numbered question starts a new line: "1. ", "2) ", "Question 3:" ...
+QUESTION_HEADER = re.compile(r"^\s*(?:\*\*)?(?:question\s+)?(\d+)\s*[.):](?:\*\*)?\s", re.IGNORECASE)
+# Prefixes that could still turn into a header once more tokens arrive
+PARTIAL_HEADER = re.compile(r"^\s*\*{0,2}(?:q(?:u(?:e(?:s(?:t(?:i(?:o(?:n)?)?)?)?)?)?)?\s*)?\d*\s*(?:[.):]\**)?$", re.IGNORECASE)
+
+
+def ndjson(event: Dict) -> str:
+    """Serialise one stream event as a newline-delimited JSON line"""
+    return json.dumps(event, ensure_ascii=False) + "\n"
+
+
+class QuestionStreamSplitter:
+    """
+    Turns a stream of model tokens into question-aware events.
+
+    Tokens are forwarded as soon as it is certain which question they belong to.
+    Only the start of a line is held back, until it is clear whether it begins a
+    new numbered question, so `question_end` for question 1 is emitted while
+    question 2 is still being generated.
+
+    Events:
+        {"event": "question_start", "question": n}
+        {"event": "token", "question": n | None, "text": "..."}
+        {"event": "question_end", "question": n, "text": "<full question>"}
+    """
+
+    def __init__(self):
+        self.current: Optional[int] = None
+        self._line = ""          # held back start of the current line
+        self._line_open = True   # still deciding whether this line is a header
+        self._question_text: List[str] = []
+        self._all_text: List[str] = []
+
+    def _emit_token(self, text: str, events: List[Dict]):
+        if not text:
+            return
+        self._all_text.append(text)
+        if self.current is not None:
+            self._question_text.append(text)
+        events.append({"event": "token", "question": self.current, "text": text})
+
+    def _close_question(self, events: List[Dict]):
+        if self.current is not None:
+            events.append({
+                "event": "question_end",
+                "question": self.current,
+                "text": "".join(self._question_text).strip(),
+            })
+        self._question_text = []
+
+    def _resolve_line(self, events: List[Dict], final: bool = False):
+        """Decide whether the held back line starts a new question, then flush it."""
+        match = QUESTION_HEADER.match(self._line)
+        if match:
+            number = int(match.group(1))
+            if self.current is None or number > self.current:
+                self._close_question(events)
+                self.current = number
+                events.append({"event": "question_start", "question": number})
+            self._line_open = False
+            self._emit_token(self._line, events)
+            self._line = ""
+        elif final or not PARTIAL_HEADER.match(self._line):
+            self._line_open = False
+            self._emit_token(self._line, events)
+            self._line = ""
+
+    def feed(self, delta: str) -> List[Dict]:
+        events: List[Dict] = []
+        for piece in re.split(r"(\n)", delta or ""):
+            if not piece:
+                continue
+            if piece == "\n":
+                if self._line_open:
+                    self._resolve_line(events, final=True)
+                self._emit_token("\n", events)
+                self._line_open = True
+                continue
+            if self._line_open:
+                self._line += piece
+                self._resolve_line(events)
+            else:
+                self._emit_token(piece, events)
+        return events
+
+    def close(self) -> List[Dict]:
+        events: List[Dict] = []
+        if self._line_open and self._line:
+            self._resolve_line(events, final=True)
+        self._close_question(events)
+        return events
+
+    @property
+    def text(self) -> str:
+        return "".join(self._all_text)
+
+
+def split_stream(deltas: Iterable[str]) -> Iterable[Dict]:
+    """Convenience wrapper to run a whole token iterable through a splitter"""
+    splitter = QuestionStreamSplitter()
+    for delta in deltas:
+        yield from splitter.feed(delta)
+    yield from splitter.close()
@@ -0,0 +1,27 @@
+import os
+import json
+import tempfile
+
+# The server reads its configuration at import time: no real LLM, no shared pool or cache
+_workdir = tempfile.mkdtemp(prefix="server-test-")
+os.environ.setdefault("LLM_BACKENDS", "stub")
+os.environ.setdefault("LLM_HEDGE", "0")
+os.environ.setdefault("QUESTION_POOL_DB", os.path.join(_workdir, "pool.sqlite3"))
+os.environ.setdefault("QUESTION_POOL_PREGENERATE", "0")
+
+from fastapi.testclient import TestClient
+
+import server
+
+client = TestClient(server.app)
+
+
+def test_generate_paper_without_paper_field():
+    response = client.post("/api/ai/generate_paper", json={
+        "level": "higher",
+        "sections": [{"topic_name": "soil pH", "count": 2}],
+    })
+    assert response.status_code == 200
+    events = [json.loads(line) for line in response.text.splitlines() if line]
+    assert events[-1]["event"] == "done"
+    assert events[-1]["sections"] == 1
@@ -0,0 +1,189 @@
+import re
+import bisect
+import threading
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, TypeVar
+
+T = TypeVar("T")
+
+FALLBACK_ENCODING = "cl100k_base"
+# Approximation used without tiktoken: BPE vocabularies average ~4 characters per
+# token for English words, and punctuation is almost always a token of its own
+PIECE_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+# Completion sizing: one exam part is a sentence or two; each question adds a header and spacing
+TOKENS_PER_PART = 60
+TOKENS_PER_QUESTION = 20
+
+HISTOGRAM_BUCKETS = (32, 64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384)
+
+
+@lru_cache(maxsize=1)
+def _tiktoken():
+    """tiktoken, imported on first use since it is slow to import; None when not installed"""
+    try:
+        import tiktoken
+    except ImportError:  # optional - counts fall back to a local approximation
+        return None
+    return tiktoken
+
+
+@lru_cache(maxsize=16)
+def _encoding(model: Optional[str]):
+    tiktoken = _tiktoken()
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model) if model else tiktoken.get_encoding(FALLBACK_ENCODING)
+    except (KeyError, ValueError):
+        # Local models (llama, qwen) are unknown to tiktoken; cl100k is a close enough proxy
+        return tiktoken.get_encoding(FALLBACK_ENCODING)
+
+
+def _piece_cost(piece: str) -> int:
+    return (len(piece) + 3) // 4 if piece[0].isalnum() or piece[0] == "_" else 1
+
+
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+    """Tokens in `text` - exact with tiktoken installed, otherwise a local estimate"""
+    if not text:
+        return 0
+    encoding = _encoding(model)
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return sum(_piece_cost(m.group()) for m in PIECE_PATTERN.finditer(text))
+
+
+def count_message_tokens(messages: List[Dict], model: Optional[str] = None) -> int:
+    """Chat prompt size, including the few tokens of framing each message adds"""
+    return sum(4 + count_tokens(m.get("content") or "", model) for m in messages) + 2
+
+
+def truncate_to_tokens(text: str, max_tokens: int, model: Optional[str] = None) -> str:
+    """Longest prefix of `text` within `max_tokens`"""
+    if max_tokens <= 0:
+        return ""
+    encoding = _encoding(model)
+    if encoding is not None:
+        tokens = encoding.encode(text, disallowed_special=())
+        return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
+    used = 0
+    for m in PIECE_PATTERN.finditer(text):
+        used += _piece_cost(m.group())
+        if used > max_tokens:
+            return text[:m.start()].rstrip()
+    return text
+
+
+def fit_to_budget(render: Callable[[Sequence[T]], str], items: Sequence[T], budget: int,
+                  model: Optional[str] = None) -> Tuple[str, int, int]:
+    """
+    Render a prompt from as many of `items` as fit in `budget` tokens.
+
+    Items are in priority order, so trimming drops from the end. A binary search
+    over the kept count keeps this to O(log n) renders. Returns
+    (prompt, items kept, prompt tokens); with nothing fitting, the prompt is rendered
+    from no items and may still exceed the budget.
+    """
+    prompt = render(items)
+    tokens = count_tokens(prompt, model)
+    if tokens <= budget:
+        return prompt, len(items), tokens
+    lo, hi, best = 0, len(items) - 1, None
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        candidate = render(items[:mid])
+        candidate_tokens = count_tokens(candidate, model)
+        if candidate_tokens <= budget:
+            lo, best = mid, (candidate, mid, candidate_tokens)
+        else:
+            hi = mid - 1
+    if best is None:
+        prompt = render(items[:0])
+        return prompt, 0, count_tokens(prompt, model)
+    return best
+
+
+def completion_budget(num_questions: int, parts_per_question: int,
+                      tokens_per_part: int = TOKENS_PER_PART,
+                      tokens_per_question: int = TOKENS_PER_QUESTION) -> int:
+    """`max_tokens` for a reply of `num_questions` questions of `parts_per_question` parts each"""
+    return num_questions * (tokens_per_question + parts_per_question * tokens_per_part)
+
+
+class TokenHistogram:
+    """Cumulative-bucket histogram of token counts (the Prometheus layout)"""
+
+    def __init__(self, buckets: Sequence[int] = HISTOGRAM_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+    def observe(self, value: int):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimate by linear interpolation inside the bucket holding the q-th observation"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0
+                upper = min(self.buckets[i], self.max) if i < len(self.buckets) else self.max
+                return round(lower + (upper - lower) * (rank - seen) / n, 1)
+            seen += n
+        return float(self.max)
+
+    def stats(self) -> Dict:
+        cumulative, running = {}, 0
+        for bound, n in zip(list(self.buckets) + ["+Inf"], self.counts):
+            running += n
+            cumulative[str(bound)] = running
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": round(self.sum / self.count, 1) if self.count else None,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "max": self.max,
+            "buckets": cumulative,
+        }
+
+
+class TokenAccounting:
+    """Per-request prompt/completion token histograms, plus how often the input budget trimmed context"""
+
+    def __init__(self):
+        self.prompt = TokenHistogram()
+        self.completion = TokenHistogram()
+        self.requests = 0
+        self.trimmed = 0
+        self.estimated = 0
+        self._lock = threading.Lock()
+
+    def record(self, prompt_tokens: int, completion_tokens: int, trimmed: bool = False, estimated: bool = False):
+        """`estimated` marks counts from the local tokenizer rather than the API's usage report"""
+        with self._lock:
+            self.requests += 1
+            self.trimmed += int(trimmed)
+            self.estimated += int(estimated)
+            self.prompt.observe(prompt_tokens)
+            self.completion.observe(completion_tokens)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "trimmed": self.trimmed,
+                "estimated": self.estimated,
+                "tokenizer": "tiktoken" if _tiktoken() is not None else "approximate",
+                "prompt_tokens": self.prompt.stats(),
+                "completion_tokens": self.completion.stats(),
+            }
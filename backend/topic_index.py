@@ -0,0 +1,292 @@
+import os
+import re
+import json
+import logging
+from dataclasses import dataclass, asdict
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from retrieval import PROJECT_DIR, MERGED_DIR, INDEX_DIR, LEVELS, tokenize, iter_merged_parts, source_fingerprint
+
+logger = logging.getLogger(__name__)
+
+SYLLABUS_PATH = os.path.join(PROJECT_DIR, "data", "syllabus.txt")
+
+SECTION_LINE = re.compile(r"^(\d+(?:\.\d+)+)\s*(.*)$")
+STRAND_LINE = re.compile(r"^Strand (\d+):\s*(.+)$")
+PAGE_FOOTER = re.compile(r"^\d+ Agricultural Science Curriculum Specification$")
+# The syllabus text starts part-way through strand 1, before its heading
+DEFAULT_STRANDS = {"1": "Scientific practices"}
+# First word of every learning outcome - anything before it on a section line is the section title
+OUTCOME_VERBS = {
+    "apply", "appreciate", "calculate", "collect", "communicate", "compare", "compile", "conduct",
+    "critically", "describe", "design", "determine", "discuss", "distinguish", "evaluate", "examine",
+    "explain", "identify", "interpret", "investigate", "isolate", "make", "measure", "read", "recognise",
+    "relate", "show", "understand", "use",
+}
+
+# A part is tagged with its best section, plus any other section scoring within TAG_RATIO of it
+TAG_MIN_SCORE = 0.08
+TAG_RATIO = 0.7
+TAGS_PER_PART = 2
+# A topic query resolves to every section above this cosine similarity
+RESOLVE_MIN_SCORE = 0.15
+
+
+def stem(token: str) -> str:
+    """Crude plural folding so "soils"/"soil" and "crops"/"crop" share a term"""
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+
+def terms(text: str) -> List[str]:
+    return [stem(t) for t in tokenize(text)]
+
+
+@dataclass
+class SyllabusSection:
+    code: str
+    title: str
+    strand: str
+    text: str = ""
+
+
+def _split_title(words: List[str]) -> Tuple[List[str], List[str]]:
+    for i, word in enumerate(words):
+        if word.lower().strip(",.") in OUTCOME_VERBS:
+            return words[:i], words[i:]
+    return words, []
+
+
+def parse_syllabus(path: str = SYLLABUS_PATH) -> List[SyllabusSection]:
+    """
+    Parse the curriculum spec into its numbered sections (1.1, 2.2.1, ...).
+
+    Only sections with learning outcomes are returned. Heading-only sections such
+    as "2.2 Properties" fold their title into their children's text instead.
+    """
+    sections: List[SyllabusSection] = []
+    strand, title_open = "", False
+    with open(path, "r", encoding="utf-8") as f:
+        lines = [line.strip() for line in f]
+
+    for line in lines:
+        if not line or PAGE_FOOTER.match(line) or line.startswith("STUDENTS LEARN ABOUT"):
+            continue
+        if match := STRAND_LINE.match(line):
+            strand = match.group(2).strip()
+            # Strand introductions are prose about the strand, not outcomes of the last section
+            sections.append(None)
+            continue
+        if match := SECTION_LINE.match(line):
+            code = match.group(1)
+            title, body = _split_title(match.group(2).split())
+            sections.append(SyllabusSection(code, " ".join(title), strand or DEFAULT_STRANDS.get(code.split(".")[0], ""),
+                                            " ".join(body)))
+            title_open = not body
+            continue
+        current = sections[-1] if sections else None
+        if current is None:
+            continue
+        if title_open:
+            # Long titles wrap ("2.1 Formation and" / "classification")
+            title, body = _split_title(line.split())
+            current.title = " ".join([current.title, *title]).replace("/ ", "/").strip()
+            current.text = " ".join(body)
+            title_open = not body
+            continue
+        current.text = f"{current.text} {line}".strip()
+
+    sections = [s for s in sections if s is not None]
+    titles = {s.code: s.title for s in sections}
+    leaves = []
+    for s in sections:
+        if not s.text:
+            continue
+        parts = s.code.split(".")
+        parents = [titles.get(".".join(parts[:i]), "") for i in range(2, len(parts))]
+        s.text = " ".join(filter(None, [s.strand, *parents, s.title, s.text]))
+        leaves.append(s)
+    return leaves
+
+
+def _syllabus_fingerprint(merged_dir: str, syllabus_path: str) -> List[List]:
+    stat = os.stat(syllabus_path)
+    return source_fingerprint(merged_dir) + [[os.path.basename(syllabus_path), stat.st_mtime, stat.st_size]]
+
+
+class TopicIndex:
+    """
+    Syllabus sections matched against every past question part.
+
+    Sections and parts are embedded as L2-normalised TF-IDF vectors over the
+    syllabus vocabulary; one matrix product tags the whole bank. The inverted
+    index (section -> parts, best first) is stored CSR-style like the retrieval
+    postings, with part ids indexing the records of
+    `iter_merged_parts(include_skipped=True)` - the same order the question bank
+    is compiled in.
+    """
+
+    def __init__(self, sections: List[SyllabusSection], vocab: Dict[str, int], idf: np.ndarray,
+                 section_matrix: np.ndarray, offsets: np.ndarray, part_ids: np.ndarray, scores: np.ndarray,
+                 part_levels: np.ndarray, part_skip: np.ndarray, fingerprint: Optional[List] = None):
+        self.sections = sections
+        self.vocab = vocab
+        self.idf = idf
+        self.section_matrix = section_matrix
+        self.offsets = offsets
+        self.part_ids = part_ids
+        self.scores = scores
+        self.part_levels = part_levels
+        self.part_skip = part_skip
+        self.fingerprint = fingerprint or []
+        self.codes = {s.code: i for i, s in enumerate(sections)}
+        self.resolve = lru_cache(maxsize=1024)(self._resolve)
+
+    @staticmethod
+    def _vectorize(docs: List[List[str]], vocab: Dict[str, int], idf: np.ndarray) -> np.ndarray:
+        matrix = np.zeros((len(docs), len(vocab)), dtype=np.float32)
+        for row, doc in enumerate(docs):
+            for term in doc:
+                col = vocab.get(term)
+                if col is not None:
+                    matrix[row, col] += 1.0
+        matrix *= idf
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.maximum(norms, 1e-9)
+
+    @classmethod
+    def build(cls, sections: List[SyllabusSection], records: List[Dict],
+              fingerprint: Optional[List] = None) -> "TopicIndex":
+        section_terms = [terms(s.text) for s in sections]
+        vocab = {t: i for i, t in enumerate(sorted({t for doc in section_terms for t in doc}))}
+        df = np.zeros(len(vocab), dtype=np.float32)
+        for doc in section_terms:
+            df[[vocab[t] for t in set(doc)]] += 1
+        idf = (np.log((1 + len(sections)) / (1 + df)) + 1).astype(np.float32)
+
+        section_matrix = cls._vectorize(section_terms, vocab, idf)
+        part_matrix = cls._vectorize([terms(" ".join([r["text"], *map(str, r["solution"])])) for r in records],
+                                     vocab, idf)
+        similarity = part_matrix @ section_matrix.T  # (parts, sections)
+
+        postings: List[List[Tuple[float, int]]] = [[] for _ in sections]
+        top = np.argsort(-similarity, axis=1)[:, :TAGS_PER_PART]
+        for part, candidates in enumerate(top):
+            best = similarity[part, candidates[0]]
+            if best < TAG_MIN_SCORE:
+                continue
+            for s in candidates:
+                if similarity[part, s] >= best * TAG_RATIO:
+                    postings[s].append((float(similarity[part, s]), part))
+
+        offsets = np.zeros(len(sections) + 1, dtype=np.int64)
+        part_ids, scores = [], []
+        for s, plist in enumerate(postings):
+            plist.sort(key=lambda item: -item[0])
+            part_ids.extend(p for _, p in plist)
+            scores.extend(score for score, _ in plist)
+            offsets[s + 1] = offsets[s] + len(plist)
+
+        return cls(sections, vocab, idf, section_matrix, offsets, np.array(part_ids, dtype=np.int32),
+                   np.array(scores, dtype=np.float32),
+                   np.array([LEVELS.index(r["level"]) for r in records], dtype=np.int8),
+                   np.array([bool(r.get("skip")) for r in records], dtype=bool), fingerprint)
+
+    def record_tags(self) -> List[List[str]]:
+        """Section codes per part, in record order - the tag column of the question bank"""
+        tags: List[List[str]] = [[] for _ in range(len(self.part_levels))]
+        for s, section in enumerate(self.sections):
+            for part in self.part_ids[self.offsets[s]:self.offsets[s + 1]]:
+                tags[part].append(section.code)
+        return tags
+
+    def match_sections(self, topic: str) -> List[Tuple[float, SyllabusSection]]:
+        """Syllabus sections for a free-text topic, best first. A section code ("2.2") selects it and its children"""
+        code = topic.strip()
+        if SECTION_LINE.match(code + " "):
+            return [(1.0, s) for s in self.sections if s.code == code or s.code.startswith(code + ".")]
+        cols = [self.vocab[t] for t in terms(topic) if t in self.vocab]
+        if not cols:
+            return []
+        query = np.zeros(len(self.vocab), dtype=np.float32)
+        np.add.at(query, cols, 1.0)
+        query *= self.idf
+        similarity = self.section_matrix @ (query / np.linalg.norm(query))
+        order = np.argsort(-similarity)
+        return [(float(similarity[i]), self.sections[i]) for i in order if similarity[i] >= RESOLVE_MIN_SCORE]
+
+    def _resolve(self, topic: str, level: Optional[str] = None, k: int = 8) -> Tuple[Tuple[float, int], ...]:
+        """(score, part id) of the best past parts for a topic, skipped parts excluded. Cached per query"""
+        best: Dict[int, float] = {}
+        for section_score, section in self.match_sections(topic):
+            s = self.codes[section.code]
+            start, end = self.offsets[s], self.offsets[s + 1]
+            for part, part_score in zip(self.part_ids[start:end], self.scores[start:end]):
+                if self.part_skip[part] or (level in LEVELS and self.part_levels[part] != LEVELS.index(level)):
+                    continue
+                score = section_score * float(part_score)
+                if score > best.get(int(part), 0.0):
+                    best[int(part)] = score
+        ranked = sorted(best.items(), key=lambda item: -item[1])[:k]
+        return tuple((score, part) for part, score in ranked)
+
+    def save(self, index_dir: str = INDEX_DIR):
+        os.makedirs(index_dir, exist_ok=True)
+        np.savez(os.path.join(index_dir, "topic_index.npz"), idf=self.idf, section_matrix=self.section_matrix,
+                 offsets=self.offsets, part_ids=self.part_ids, scores=self.scores,
+                 part_levels=self.part_levels, part_skip=self.part_skip)
+        with open(os.path.join(index_dir, "topic_index.json"), "w", encoding="utf-8") as f:
+            json.dump({"fingerprint": self.fingerprint, "vocab": self.vocab,
+                       "sections": [asdict(s) for s in self.sections]}, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, index_dir: str = INDEX_DIR) -> "TopicIndex":
+        with open(os.path.join(index_dir, "topic_index.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        arrays = np.load(os.path.join(index_dir, "topic_index.npz"))
+        return cls([SyllabusSection(**s) for s in meta["sections"]], meta["vocab"], arrays["idf"],
+                   arrays["section_matrix"], arrays["offsets"], arrays["part_ids"], arrays["scores"],
+                   arrays["part_levels"], arrays["part_skip"], meta["fingerprint"])
+
+
+def load_or_build_topic_index(merged_dir: str = MERGED_DIR, index_dir: str = INDEX_DIR,
+                              syllabus_path: str = SYLLABUS_PATH) -> TopicIndex:
+    """Load the persisted topic index, re-tagging only when the merged bank or the syllabus changed"""
+    fingerprint = _syllabus_fingerprint(merged_dir, syllabus_path)
+    try:
+        index = TopicIndex.load(index_dir)
+        if index.fingerprint == fingerprint:
+            return index
+    except (OSError, ValueError, KeyError):
+        pass
+
+    records = list(iter_merged_parts(merged_dir, include_skipped=True))
+    index = TopicIndex.build(parse_syllabus(syllabus_path), records, fingerprint)
+    index.save(index_dir)
+    tagged = int(sum(1 for tags in index.record_tags() if tags))
+    logger.info(f"Tagged {tagged}/{len(records)} parts against {len(index.sections)} syllabus sections")
+    return index
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    index = load_or_build_topic_index()
+    for section in index.sections:
+        count = index.offsets[index.codes[section.code] + 1] - index.offsets[index.codes[section.code]]
+        print(f"{section.code:<8} {section.title[:40]:<40} {count:>4} part(s)")
+
+    topic = " ".join(sys.argv[1:]) or "soil pH and liming"
+    start = time.perf_counter()
+    index.resolve(topic, "higher")
+    cold = time.perf_counter() - start
+    start = time.perf_counter()
+    parts = index.resolve(topic, "higher")
+    warm = time.perf_counter() - start
+    print(f"'{topic}' -> {[s.code for _, s in index.match_sections(topic)]}, {len(parts)} part(s); "
+          f"{cold * 1e6:.0f}us cold, {warm * 1e6:.1f}us cached")
@@ -37,7 +37,7 @@ export default function Home() {
     setQuestions("");
 
     try {
-      const response = await fetch("http://localhost:8000/api/ai/generate_questions", {
+      const response = await fetch("http://localhost:8000/api/ai/generate_questions/stream", {
         method: "POST",
         headers: {
           "Content-Type": "application/json",
@@ -49,16 +49,43 @@ export default function Home() {
         }),
       });
 
-      if (!response.ok) {
+      if (!response.ok || !response.body) {
         throw new Error("Failed to generate questions");
       }
 
-      const data = await response.json();
-      setQuestions(data.questions);
-
-      setTimeout(() => {
-        resultRef.current?.scrollIntoView({ behavior: "smooth" });
-      }, 200);
+      // Read NDJSON events and render tokens as soon as they arrive
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = "";
+      let scrolled = false;
+
+      const handleEvent = (event) => {
+        if (event.event === "token") {
+          setQuestions((prev) => prev + event.text);
+          if (!scrolled) {
+            scrolled = true;
+            setTimeout(() => {
+              resultRef.current?.scrollIntoView({ behavior: "smooth" });
+            }, 200);
+          }
+        } else if (event.event === "done") {
+          setQuestions(event.questions);
+        } else if (event.event === "error") {
+          throw new Error(event.detail);
+        }
+      };
+
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split("\n");
+        buffer = lines.pop();
+        for (const line of lines) {
+          if (line.trim()) handleEvent(JSON.parse(line));
+        }
+      }
+      if (buffer.trim()) handleEvent(JSON.parse(buffer));
     } catch (err) {
       setError("Unable to generate questions. Please ensure the backend is running.");
     } finally {
@@ -0,0 +1,145 @@
+import os
+import re
+import glob
+import argparse
+import logging
+import concurrent.futures
+from dataclasses import dataclass
+from typing import Dict, Iterator, List
+
+from extract import (
+    project_dir,
+    extract_text_from_pdf,
+    write_questions_to_json,
+)
+from records import end_record, make_record
+
+logger = logging.getLogger(__name__)
+
+INITIAL_DIR = os.path.join(project_dir, "data", "initial")
+UNSTRUCTURED_DIR = os.path.join(project_dir, "data", "unstructured")
+LEVELS = ["higher", "ordinary"]
+
+# Exam papers are named "paper_<year>.pdf", marking schemes "<year>.pdf"
+PAPER_PATTERN = re.compile(r"^paper_(\d{4})\.pdf$")
+SOLUTION_PATTERN = re.compile(r"^(\d{4})\.pdf$")
+
+
+@dataclass
+class PdfPair:
+    level: str
+    year: int
+    question_pdf: str
+    solution_pdf: str
+
+    @property
+    def questions_out(self) -> str:
+        return os.path.join(UNSTRUCTURED_DIR, f"questions_{self.year}_{self.level}.json")
+
+    @property
+    def solutions_out(self) -> str:
+        return os.path.join(UNSTRUCTURED_DIR, f"solutions_{self.year}_{self.level}.json")
+
+    def is_up_to_date(self) -> bool:
+        """Outputs exist and are newer than both input PDFs"""
+        outputs = [self.questions_out, self.solutions_out]
+        if not all(os.path.exists(p) for p in outputs):
+            return False
+        newest_input = max(os.path.getmtime(self.question_pdf), os.path.getmtime(self.solution_pdf))
+        return min(os.path.getmtime(p) for p in outputs) >= newest_input
+
+
+def discover_pairs(levels: List[str] = LEVELS, years: List[int] = None) -> List[PdfPair]:
+    """Find every level/year with a marking scheme, paired with its exam paper where there is one."""
+    pairs = []
+    for level in levels:
+        papers, solutions = {}, {}
+        for path in glob.glob(os.path.join(INITIAL_DIR, level, "*.pdf")):
+            name = os.path.basename(path)
+            if m := PAPER_PATTERN.match(name):
+                papers[int(m.group(1))] = path
+            elif m := SOLUTION_PATTERN.match(name):
+                solutions[int(m.group(1))] = path
+        for year in sorted(set(papers) | set(solutions)):
+            if years and year not in years:
+                continue
+            if year not in solutions:
+                logger.info(f"Skipping {level} {year}: no marking scheme")
+                continue
+            if year not in papers:
+                # Newer marking schemes reprint the full question text, so they double as the paper
+                logger.info(f"{level} {year}: no exam paper, reading questions from the marking scheme")
+            pairs.append(PdfPair(level, year, papers.get(year, solutions[year]), solutions[year]))
+    return pairs
+
+
+def answered_solutions(solutions: List[Dict], questions: List[Dict]) -> List[Dict]:
+    """Only the solutions whose question survived the skip filters"""
+    question_numbers = {q["question_number"] for q in questions}
+    return [s for s in solutions if s["question_number"] in question_numbers]
+
+
+def write_json_atomic(items: List[Dict], out_path: str):
+    """Write to a temp file and rename it into place, so a killed run never leaves a partial file"""
+    tmp_path = out_path + ".tmp"
+    write_questions_to_json(items, tmp_path)
+    os.replace(tmp_path, out_path)
+
+
+def extract_pair(pair: PdfPair) -> str:
+    """
+    Extract one question/solution pair. Runs in a worker process.
+
+    Nothing is written until both PDFs are extracted and filtered, and the questions
+    file goes last: is_up_to_date() needs both outputs newer than the PDFs, so a run
+    killed part way through is redone rather than mistaken for a finished one.
+    """
+    solutions = extract_text_from_pdf(pair.solution_pdf, is_solution=True)
+    questions = extract_text_from_pdf(pair.question_pdf, is_solution=False)
+    solutions = answered_solutions(solutions, questions)
+    write_json_atomic(solutions, pair.solutions_out)
+    write_json_atomic(questions, pair.questions_out)
+    return f"{pair.level} {pair.year}: {len(questions)} questions, {len(solutions)} solutions"
+
+
+def extract_records(pair: PdfPair) -> Iterator[Dict]:
+    """
+    The same extraction as extract_pair, as pipeline records instead of files:
+    the paper's questions, then the solutions whose question survived the skip filters.
+    """
+    questions = extract_text_from_pdf(pair.question_pdf, is_solution=False)
+    for question in questions:
+        yield make_record(pair.level, pair.year, "questions", question)
+    yield end_record(pair.level, pair.year, "questions", len(questions))
+
+    solutions = answered_solutions(extract_text_from_pdf(pair.solution_pdf, is_solution=True), questions)
+    for solution in solutions:
+        yield make_record(pair.level, pair.year, "solutions", solution)
+    yield end_record(pair.level, pair.year, "solutions", len(solutions))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract every question/solution PDF pair in data/initial")
+    parser.add_argument("--level", choices=LEVELS, action="append", help="restrict to one level (repeatable)")
+    parser.add_argument("--year", type=int, action="append", help="restrict to one year (repeatable)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes (default: all cores)")
+    parser.add_argument("--force", action="store_true", help="re-extract pairs whose outputs are up to date")
+    args = parser.parse_args()
+
+    os.makedirs(UNSTRUCTURED_DIR, exist_ok=True)
+    pairs = discover_pairs(args.level or LEVELS, args.year)
+    todo = [p for p in pairs if args.force or not p.is_up_to_date()]
+    logger.info(f"{len(pairs)} pair(s) found, {len(pairs) - len(todo)} up to date, {len(todo)} to extract")
+
+    failed = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max(1, min(args.workers, len(todo) or 1))) as executor:
+        futures = {executor.submit(extract_pair, pair): pair for pair in todo}
+        for future in concurrent.futures.as_completed(futures):
+            pair = futures[future]
+            try:
+                logger.info(f"Finished {future.result()}")
+            except Exception as e:
+                failed += 1
+                logger.error(f"Error extracting {pair.level} {pair.year}: {e}")
+
+    logger.info(f"Done: {len(todo) - failed} extracted, {failed} failed")
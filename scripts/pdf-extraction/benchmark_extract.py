@@ -0,0 +1,142 @@
+import os
+import re
+import sys
+import glob
+import json
+import time
+import logging
+import argparse
+
+import pdfplumber
+
+import extract
+
+# Benchmarks the page-text stage of extract.py over the data/initial corpus.
+#
+#   python benchmark_extract.py                # every PDF in data/initial
+#   python benchmark_extract.py --limit 4      # quick run
+#   python benchmark_extract.py --micro        # per-page line cleaning / skip matching cost
+#
+# "single_pass" is the current pipeline: each page is parsed once and shared by
+# get_page_range and extract_text_from_pdf. "legacy" replays the page parses the
+# previous implementation made (forward scan, backward scan, then the content
+# range again) so the two can be compared on the same machine.
+
+
+def corpus_pdfs(limit=None):
+    pdfs = sorted(glob.glob(os.path.join(extract.project_dir, "data", "initial", "*", "*.pdf")))
+    return pdfs[:limit] if limit else pdfs
+
+
+def is_solution_pdf(pdf_path):
+    # Marking schemes are named "<year>.pdf", exam papers "paper_<year>.pdf"
+    return not os.path.basename(pdf_path).startswith("paper_")
+
+
+def run_single_pass(pdfs):
+    extract.clear_page_text_cache()
+    for pdf_path in pdfs:
+        extract.extract_text_from_pdf(pdf_path, is_solution=is_solution_pdf(pdf_path))
+
+
+def run_legacy(pdfs):
+    for pdf_path in pdfs:
+        with pdfplumber.open(pdf_path) as pdf:
+            start_page, end_page = 0, None
+            for i, page in enumerate(pdf.pages):
+                text = page.extract_text()
+                if text and (re.search(r"question\s+1", text, re.IGNORECASE) or
+                             re.search(r"^\s*1\s*\.", text, re.IGNORECASE | re.MULTILINE) or
+                             re.search(r"q\s?1", text, re.IGNORECASE)):
+                    start_page = i
+                    break
+            for i, page in enumerate(reversed(pdf.pages)):
+                text = page.extract_text()
+                if text and re.search(r"(blank page|acknowledgements)", text, re.IGNORECASE):
+                    end_page = len(pdf.pages) - i
+                    break
+            if end_page is not None and end_page <= start_page:
+                end_page = None
+        with pdfplumber.open(pdf_path) as pdf:
+            for page in pdf.pages[start_page:end_page]:
+                page.extract_text()
+
+
+def legacy_clean_lines(text):
+    """Line cleaning as it was before LineCleaner: one lower()/re.sub per keyword per line"""
+    cleaned_lines = []
+    for line in text.split('\n'):
+        if any(h.lower() in line.lower() for h in extract.HARD_SKIP):
+            continue
+        for skip in extract.SOFT_SKIP:
+            line = re.sub(re.escape(skip), '', line, flags=re.IGNORECASE)
+        line = " ".join(line.split())
+        if line:
+            cleaned_lines.append(line)
+    return list(dict.fromkeys(cleaned_lines))
+
+
+def legacy_present_keywords(text):
+    text_lower = text.lower()
+    return [kw.strip() for kw in extract.SKIP_WORDS if kw.strip() and kw.strip() in text_lower]
+
+
+def per_item_us(fn, items, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for item in items:
+            fn(item)
+    elapsed = time.perf_counter() - start
+    return round(elapsed / (repeat * len(items)) * 1e6, 2)
+
+
+def run_micro(pdfs, repeat=20):
+    """Time the per-page cleaning and per-block skip matching on real page text"""
+    page_texts = [t for p in pdfs for t in extract.get_page_texts(p) if t]
+    blocks = [b for t in page_texts for b in re.split(r'(?=(?:Question\s+\d+|Q\s?\d+))', t) if b.strip()]
+    cleaner, matcher = extract.DEFAULT_CLEANER, extract.DEFAULT_SKIP_MATCHER
+    return {
+        "pages": len(page_texts),
+        "blocks": len(blocks),
+        "clean_us_per_page": {
+            "legacy": per_item_us(legacy_clean_lines, page_texts, repeat),
+            "compiled": per_item_us(cleaner.clean_lines, page_texts, repeat),
+        },
+        "skip_match_us_per_block": {
+            "legacy": per_item_us(legacy_present_keywords, blocks, repeat),
+            "compiled": per_item_us(matcher.present, blocks, repeat),
+        },
+    }
+
+
+def timed(fn, pdfs, pages):
+    start = time.perf_counter()
+    fn(pdfs)
+    elapsed = time.perf_counter() - start
+    return {"seconds": round(elapsed, 3), "pages_per_sec": round(pages / elapsed, 2) if elapsed else None}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark PDF page extraction on data/initial")
+    parser.add_argument("--limit", type=int, default=None, help="only use the first N PDFs")
+    parser.add_argument("--skip-legacy", action="store_true", help="only time the single-pass pipeline")
+    parser.add_argument("--micro", action="store_true", help="run the line cleaning / skip matching micro-benchmarks")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    pdfs = corpus_pdfs(args.limit)
+    if not pdfs:
+        sys.exit("No PDFs found under data/initial")
+
+    if args.micro:
+        print(json.dumps(run_micro(pdfs), indent=2))
+        sys.exit(0)
+
+    pages = 0
+    for pdf_path in pdfs:
+        with pdfplumber.open(pdf_path) as pdf:
+            pages += len(pdf.pages)
+    results = {"pdfs": len(pdfs), "pages": pages, "single_pass": timed(run_single_pass, pdfs, pages)}
+    if not args.skip_legacy:
+        results["legacy"] = timed(run_legacy, pdfs, pages)
+    print(json.dumps(results, indent=2))
@@ -3,7 +3,8 @@ import re
 import os
 import json
 import logging
-from typing import List, Dict, Tuple
+import functools
+from typing import List, Dict, Optional
 
 for handler in logging.root.handlers[:]:
     logging.root.removeHandler(handler)
@@ -29,43 +30,124 @@ SKIP_WORDS = ["image", "picture","diagram", " graph ","photograph",  "figure", "
 SOFT_SKIP= ["other valid responses", "Answer", "**Accept other valid answers", "Any three valid points"]
 HARD_SKIP= ["BLANK PAGE", "Question 1 carries 60 marks", "Leaving Certificate Examination", "Agricultural Science – Ordinary Level", "Agricultural Science – Higher Level", "ORDINARY LEVEL AGRICULTURAL SCIENCE  |  Pre-Leaving Certificate, 2025", "HIGHER LEVEL AGRICULTURAL SCIENCE  |  Pre-Leaving Certificate, 2025", "Page", "section","ordinary", "higher", "level"]
 
-def get_page_range(pdf_path):
+def compile_keywords(keywords: List[str], ignore_case: bool = False) -> re.Pattern:
+    """
+    Builds one alternation regex for a keyword list, longest keyword first so a
+    phrase wins over a word it contains.
+
+    By default the keywords are lowercased and the pattern is meant to run on
+    text that is already lowercased - that is several times faster than re.IGNORECASE.
+    """
+    if not ignore_case:
+        keywords = [k.lower() for k in keywords]
+    alternatives = sorted({re.escape(k) for k in keywords if k}, key=len, reverse=True)
+    pattern = "|".join(alternatives) or r"(?!)"
+    return re.compile(pattern, re.IGNORECASE if ignore_case else 0)
+
+class LineCleaner:
+    """
+    Per-line cleaning used by extract_text_from_pdf, compiled once per keyword set.
+    - hard_skip: a line containing any of these is dropped
+    - soft_skip: these phrases are removed from the line
+    """
+    def __init__(self, hard_skip: List[str] = HARD_SKIP, soft_skip: List[str] = SOFT_SKIP):
+        self.hard_skip = compile_keywords(hard_skip)
+        self.soft_skip_present = compile_keywords(soft_skip)
+        self.soft_skip = compile_keywords(soft_skip, ignore_case=True)
+
+    def clean_lines(self, text: str) -> List[str]:
+        cleaned_lines = []
+        for line in text.split('\n'):
+            line_lower = line.lower()
+            if self.hard_skip.search(line_lower):
+                continue
+            # Most lines have no soft-skip phrase, so check cheaply before the case-insensitive sub
+            if self.soft_skip_present.search(line_lower):
+                line = self.soft_skip.sub('', line)
+            line = " ".join(line.split())
+            if line:
+                cleaned_lines.append(line)
+        # remove duplicates while preserving order
+        return list(dict.fromkeys(cleaned_lines))
+
+class SkipMatcher:
+    """
+    Finds which SKIP_WORDS-style keywords appear in a question block.
+    For a keyword list this short, substring checks on the lowercased block
+    measured faster than a combined regex (see benchmark_extract.py --micro).
+    """
+    def __init__(self, skip_words: List[str] = SKIP_WORDS):
+        # Normalize skip keywords (strip extra spaces from list entries)
+        self.keywords = list(dict.fromkeys(kw.strip().lower() for kw in skip_words if kw.strip()))
+
+    def present(self, text: str) -> List[str]:
+        text_lower = text.lower()
+        return [kw for kw in self.keywords if kw in text_lower]
+
+DEFAULT_CLEANER = LineCleaner()
+DEFAULT_SKIP_MATCHER = SkipMatcher()
+
+# Per-PDF page text, keyed by (path, mtime, size). pdfplumber's extract_text() is by far
+# the slowest step, so every stage of a document reads pages from here instead of re-parsing.
+# Only the most recent PDFs are kept, so a long batch run does not hold every paper's text.
+PAGE_TEXT_CACHE_SIZE = 8
+
+def _read_page_texts(pdf_path: str) -> List[str]:
     with pdfplumber.open(pdf_path) as pdf:
-        """
+        return [page.extract_text() or "" for page in pdf.pages]
+
+@functools.lru_cache(maxsize=PAGE_TEXT_CACHE_SIZE)
+def _cached_page_texts(pdf_path: str, mtime: float, size: int) -> List[str]:
+    return _read_page_texts(pdf_path)
+
+def get_page_texts(pdf_path: str, use_cache: bool = True) -> List[str]:
+    """
+    Returns the extracted text of every page in `pdf_path` ("" for empty pages).
+    Each page is parsed once while the PDF is among the last PAGE_TEXT_CACHE_SIZE read;
+    later calls reuse the cached list.
+    """
+    if not use_cache:
+        return _read_page_texts(pdf_path)
+    stat = os.stat(pdf_path)
+    return _cached_page_texts(os.path.abspath(pdf_path), stat.st_mtime, stat.st_size)
+
+def clear_page_text_cache():
+    _cached_page_texts.cache_clear()
+
+def get_page_range(pdf_path, page_texts: Optional[List[str]] = None):
+    """
     Analyzes the PDF to find the page numbers where actual 
     exam content begins and ends.
     """
+    texts = page_texts if page_texts is not None else get_page_texts(pdf_path)
     start_page = 0
     end_page = -1 
     # Default to last page
 
-    with pdfplumber.open(pdf_path) as pdf:
-        # Find start "Question 1" or just "1." pattern for offical papers and Q1 or Q 1 for the solutions
-        for i, page in enumerate(pdf.pages):
-            text = page.extract_text()
-            if text and (re.search(r"question\s+1", text, re.IGNORECASE) or 
-                        re.search(r"^\s*1\s*\.", text, re.IGNORECASE | re.MULTILINE) or 
-                        re.search(r"q\s?1", text, re.IGNORECASE)):   
-                start_page = i
-                break
-        
-        # Find end (searching backwards from end for efficiency)
-        for i, page in enumerate(reversed(pdf.pages)):
-            text = page.extract_text()
-            if text and re.search(r"(blank page|acknowledgements)", text, re.IGNORECASE):
-                end_page = len(pdf.pages) - i
-                break
-        
-        # fix bug page range [11:5] 
-        # if end_page is invalid (before start_page), ignore it
+    # Find start "Question 1" or just "1." pattern for offical papers and Q1 or Q 1 for the solutions
+    for i, text in enumerate(texts):
+        if text and (re.search(r"question\s+1", text, re.IGNORECASE) or 
+                    re.search(r"^\s*1\s*\.", text, re.IGNORECASE | re.MULTILINE) or 
+                    re.search(r"q\s?1", text, re.IGNORECASE)):   
+            start_page = i
+            break
     
-        if end_page != -1 and end_page <= start_page:
-            end_page = -1
-        
-        # print(f"[DEBUG get_page_range] Total PDF pages: {len(pdf.pages)}, start: {start_page}, end: {end_page}")
+    # Find end (searching backwards from end for efficiency)
+    for i, text in enumerate(reversed(texts)):
+        if text and re.search(r"(blank page|acknowledgements)", text, re.IGNORECASE):
+            end_page = len(texts) - i
+            break
+    
+    # fix bug page range [11:5] 
+    # if end_page is invalid (before start_page), ignore it
+
+    if end_page != -1 and end_page <= start_page:
+        end_page = -1
+    
+    # print(f"[DEBUG get_page_range] Total PDF pages: {len(texts)}, start: {start_page}, end: {end_page}")
     return start_page, end_page
 
-def _should_skip_question(text: str) -> bool:
+def _should_skip_question(text: str, matcher: Optional[SkipMatcher] = None) -> bool:
     """Check if a question should be skipped based on image/diagram/shown/list keywords.
     
     Special case:
@@ -75,10 +157,7 @@ def _should_skip_question(text: str) -> bool:
     - All other keywords in SKIP_WORDS also trigger skip
     """
     text_lower = text.lower()
-
-    # Normalize skip keywords (strip extra spaces from list entries)
-    present_keywords = [kw.strip() for kw in SKIP_WORDS if kw.strip() and kw.strip() in text_lower]
-
+    present_keywords = (matcher or DEFAULT_SKIP_MATCHER).present(text)
 
     if "labelled diagram" in text_lower:
         others = [kw for kw in present_keywords if kw != "diagram"]
@@ -100,46 +179,36 @@ def _should_skip_question(text: str) -> bool:
     return False
 
 
-def extract_text_from_pdf(pdf_path: str, is_solution: bool = False) -> List[Dict]:
+def extract_text_from_pdf(pdf_path: str, is_solution: bool = False,
+                          cleaner: Optional[LineCleaner] = None,
+                          skip_matcher: Optional[SkipMatcher] = None) -> List[Dict]:
     """
     Extracts text from `pdf_path`, splits into question blocks using
     "Question N" boundaries and returns a list of question dicts.
 
     Blocks matching internal skip heuristics (`_should_skip_question`) are also skipped.
     Set is_solution=True to skip aggressive filtering for solution papers.
+    Pass `cleaner` / `skip_matcher` to use keyword sets other than HARD_SKIP, SOFT_SKIP and SKIP_WORDS.
     """
-    cleaned_text = ""
+    cleaner = cleaner or DEFAULT_CLEANER
+    cleaned_parts = []
 
-    start_page, end_page = get_page_range(pdf_path)
+    page_texts = get_page_texts(pdf_path)
+    start_page, end_page = get_page_range(pdf_path, page_texts)
     if end_page == -1:
         end_page = None
     
     # print(f"[DEBUG] PDF path: {pdf_path}")
     # print(f"[DEBUG] Page range: {start_page}:{end_page}")
 
-    with pdfplumber.open(pdf_path) as pdf:
-        pages = pdf.pages[start_page:end_page]
-        for page in pages:
-            text = page.extract_text()
-            if not text:
-                continue
+    for text in page_texts[start_page:end_page]:
+        if not text:
+            continue
 
-            cleaned_lines = []
-            lines = text.split('\n')
-            for line in lines:
-                if any(h.lower() in line.lower() for h in HARD_SKIP):
-                    continue
-                for skip in SOFT_SKIP:
-                    pattern = re.escape(skip)
-                    line = re.sub(pattern, '', line, flags=re.IGNORECASE)
-                line = " ".join(line.split())
-                if line:
-                    cleaned_lines.append(line)
-
-            # remove duplicates while preserving order
-            cleaned_lines = list(dict.fromkeys(cleaned_lines))
-            if cleaned_lines:
-                cleaned_text += ' '.join(cleaned_lines) + " "
+        cleaned_lines = cleaner.clean_lines(text)
+        if cleaned_lines:
+            cleaned_parts.append(' '.join(cleaned_lines) + " ")
+    cleaned_text = "".join(cleaned_parts)
 
     regex_pattern = r'(?=(?:Question\s+\d+|Q\s?\d+))'
     if re.search(regex_pattern, cleaned_text, re.IGNORECASE):
@@ -185,7 +254,7 @@ def extract_text_from_pdf(pdf_path: str, is_solution: bool = False) -> List[Dict
             continue
 
         # Filter and add new question
-        if not is_solution and _should_skip_question(block_stripped):
+        if not is_solution and _should_skip_question(block_stripped, skip_matcher):
             continue
 
         key = "solution" if is_solution else "text"
@@ -233,28 +302,4 @@ if __name__ == "__main__":
     )
     write_questions_to_json(filtered_solutions, os.path.join(project_dir, "data", "unstructured", f"solutions_2025_higher.json"))
 
-# def extract_topic(text):
-#     text = text.lower()
-#     for topic, keywords in TOPIC_KEYWORDS.items():
-#         if any(keyword in text for keyword in keywords["primary"]):
-#             return topic
-#     return "General"
-
-# TOPIC_KEYWORDS = {
-#     "Animals": {
-#         "primary": ["breed", "cattle", "sheep", "pig", "livestock", "dairy", "beef", 
-#                    "calving", "mastitis", "BCS", "gestation", "oestrus"],
-#         "secondary": ["animal welfare", "herd", "flock", "fertility"]
-#     },
-#     "Soil": {
-#         "primary": ["soil", "pH", "texture", "sand", "silt", "clay", "fertility"],
-#         "secondary": ["nutrients", "drainage", "erosion"]
-#     },
-#     "Crops": {
-#         "primary": ["seed", "germination", "photosynthesis", "crop", "weed"],
-#         "secondary": ["plant growth", "harvest", "planting"]
-#     },
-#     "Scientific Practices":{},
-#     "General": {}
-# }    
-
+# Topic tagging runs after merging - see backend/topic_index.py
@@ -0,0 +1,70 @@
+import os
+import json
+import hashlib
+import threading
+from typing import Any, Dict, Optional
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+project_dir = os.path.dirname(os.path.dirname(script_dir))
+
+DEFAULT_CACHE_PATH = os.path.join(project_dir, "data", "cache", "structure_llm_cache.jsonl")
+
+
+class LLMResultCache:
+    """
+    Content-addressed cache of parsed LLM results, stored as append-only JSONL.
+
+    Keys are a hash of (prompt template, question text, model), so editing a
+    prompt or re-extracting a question only invalidates the items that changed.
+    Every result is appended and flushed as soon as it is parsed, which makes the
+    file a checkpoint too: after a crash, re-running picks up where it stopped.
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH):
+        self.path = path
+        self._results: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    @staticmethod
+    def make_key(prompt: str, text: str, model: str) -> str:
+        payload = json.dumps([prompt, text, model], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb+") as f:
+            content = f.read()
+            # A run killed mid-write leaves a partial last line. Cut it off, or the next
+            # put() would be appended onto the fragment and lost on the following load
+            complete = content.rfind(b"\n") + 1
+            if complete < len(content):
+                f.truncate(complete)
+        for line in content[:complete].decode("utf-8", errors="replace").splitlines():
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            self._results[record["key"]] = record["result"]
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            if key in self._results:
+                self.hits += 1
+                return self._results[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: str, result: Any):
+        with self._lock:
+            self._results[key] = result
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"key": key, "result": result}, ensure_ascii=False) + "\n")
+                f.flush()
+
+    def __len__(self):
+        return len(self._results)
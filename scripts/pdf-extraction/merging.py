@@ -1,51 +1,238 @@
 import json
 import os
-from pydoc import text
+import re
+import glob
+import hashlib
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from records import end_record, group_key, is_end, make_record
 # merge the structured question and solution files into a single file for each year and level
 
+script_dir = os.path.dirname(os.path.abspath(__file__))
+project_dir = os.path.dirname(os.path.dirname(script_dir))
+
+STRUCTURED_DIR = os.path.join(project_dir, "data", "structured")
+MERGED_DIR = os.path.join(project_dir, "data", "merged")
+MANIFEST_PATH = os.path.join(MERGED_DIR, "manifest.json")
+
+STRUCTURED_PATTERN = re.compile(r"^structured_(questions|solutions)_(\d{4})_(higher|ordinary)\.json$")
+
+# (level, year, question, part, subpart) - part/subpart are "" above that nesting level
+NodeKey = Tuple[str, int, str, str, str]
+
+
+def _norm_id(value) -> str:
+    """Normalises ids so both files agree: "Q3" -> "3", "(a)" -> "a", " ii " -> "ii" """
+    text = str(value if value is not None else "").strip().lower()
+    text = re.sub(r"^(question|q)\s*\.?\s*", "", text)
+    return text.strip("() .")
+
+
+def index_nodes(data: List[Dict], level: str, year: int) -> Dict[NodeKey, Dict]:
+    """Indexes every question, part and subpart of a structured file by its full key."""
+    index = {}
+    for q in data:
+        q_num = _norm_id(q.get("question_num"))
+        if not q_num:
+            continue
+        index[(level, year, q_num, "", "")] = q
+        for part in q.get("parts", []) or []:
+            part_id = _norm_id(part.get("id"))
+            if not part_id:
+                continue
+            index[(level, year, q_num, part_id, "")] = part
+            for sub in part.get("subparts", []) or []:
+                sub_id = _norm_id(sub.get("id"))
+                if sub_id:
+                    index[(level, year, q_num, part_id, sub_id)] = sub
+    return index
+
+
+def merge_data(questions_data: List[Dict], solutions_data: List[Dict], level: str = "", year: int = 0) -> List[Dict]:
+    """
+    Merges at every nesting level. The solutions file is the base (it carries
+    both text and answers); any part or subpart whose solution list is empty is
+    filled from the matching question-side entry. Questions marked skip are ignored.
+    """
+    question_index = index_nodes([q for q in questions_data if q.get("skip") is not True], level, year)
+    for key, node in index_nodes(solutions_data, level, year).items():
+        if not key[3] or node.get("solution"):
+            continue
+        source = question_index.get(key)
+        if source and source.get("solution"):
+            node["solution"] = source["solution"]
+    return solutions_data
+
+
 def merge_files(questions_file, solutions_file, output_file):
     with open(questions_file, 'r', encoding='utf-8') as qf:
         questions_data = json.load(qf)
     with open(solutions_file, 'r', encoding='utf-8') as sf:
         solutions_data = json.load(sf)
-    
-    lookup_map = {}
-    for q in questions_data:
-        if q.get("skip") is True:
+
+    merged = merge_data(questions_data, solutions_data)
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump(merged, f, indent=2, ensure_ascii=False)
+
+
+def merge_records(records: Iterable[Dict]) -> Iterator[Dict]:
+    """
+    Streaming form of merge_data over structured pipeline records.
+
+    Questions are merged one at a time: a solution is yielded as a "merged" record
+    as soon as its question-side record has arrived, or as soon as the questions
+    group of that paper has ended without one. Only questions still waiting for
+    their counterpart are held in memory. A paper's merged end record follows its
+    solutions end record once nothing of it is left waiting. Failed records and
+    other kinds (questions_solutions) are not merged, as in merge_all.
+    """
+    # (level, year) -> {"questions": {num: q}, "solutions": {num: s}, "ended": set(), "count": n}
+    papers: Dict[Tuple[str, int], Dict] = {}
+
+    def merged(level, year, question, solution):
+        return make_record(level, year, "merged", merge_data([question] if question else [], [solution], level, year)[0])
+
+    def close_if_done(level, year):
+        paper = papers[(level, year)]
+        if "solutions" in paper["ended"] and not paper["solutions"]:
+            del papers[(level, year)]
+            yield end_record(level, year, "merged", paper["count"])
+
+    for record in records:
+        level, year, kind = group_key(record)
+        if kind not in ("questions", "solutions") or record.get("failed"):
             continue
-        q_num = q.get('question_num')
-        if q_num is not None:
-            for part in q.get('parts', []):
-                part_num = part.get('part_num')
-                if part_num is not None:
-                    lookup_map[f"{q_num}{part_num}"] = part.get("solution", [])
-    for s in solutions_data:
-        if s.get("skip") is True:
+        paper = papers.setdefault((level, year), {"questions": {}, "solutions": {}, "ended": set(), "count": 0})
+        if is_end(record):
+            paper["ended"].add(kind)
+            if kind == "questions":
+                # No question-side record is coming for the solutions still waiting
+                for num in sorted(paper["solutions"], key=_norm_id):
+                    paper["count"] += 1
+                    yield merged(level, year, None, paper["solutions"].pop(num))
+            else:
+                paper["questions"].clear()
+            yield from close_if_done(level, year)
             continue
-        if s.get("solutions")==[]:
+
+        num = _norm_id(record["data"].get("question_num"))
+        if kind == "questions":
+            if record["data"].get("skip") is True:
+                continue
+            solution = paper["solutions"].pop(num, None)
+            if solution is None:
+                if "questions" not in paper["ended"]:
+                    paper["questions"][num] = record["data"]
+                continue
+            paper["count"] += 1
+            yield merged(level, year, record["data"], solution)
+            yield from close_if_done(level, year)
+        else:
+            question = paper["questions"].pop(num, None)
+            if question is None and "questions" not in paper["ended"]:
+                paper["solutions"][num] = record["data"]
+                continue
+            paper["count"] += 1
+            yield merged(level, year, question, record["data"])
+
+    # Papers with no questions group in the stream are merged against nothing, like merge_data([], ...)
+    for (level, year), paper in list(papers.items()):
+        if "solutions" not in paper["ended"]:
             continue
-        s_num = s.get('question_num')
-        if s_num is not None:
-            for part in s.get('parts', []):
-                part_num = part.get('id')
-                if part_num is not None:
-                    key = f"{s_num}{part_num}"
-                    if key in lookup_map:
-                        part['solution'] = lookup_map[key] 
-    
-    
+        for num in sorted(paper["solutions"], key=_norm_id):
+            paper["count"] += 1
+            yield merged(level, year, None, paper["solutions"].pop(num))
+        yield from close_if_done(level, year)
+
+
+def write_merged_group(key: Tuple[str, int, str], items: List[Dict], failed: List[Dict] = (),
+                       merged_dir: str = MERGED_DIR) -> str:
+    """Writes one paper's merged records as the `<level>_merged_<year>_.json` file merge_all produces"""
+    level, year, _ = key
+    # Same order as the structured files, which write_structured_output sorts by question number
+    items = sorted(items, key=lambda q: int(_norm_id(q.get("question_num")) or 0))
+    output_file = os.path.join(merged_dir, f"{level}_merged_{year}_.json")
+    os.makedirs(merged_dir, exist_ok=True)
     with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(solutions_data, f, indent=2, ensure_ascii=False)
+        json.dump(items, f, indent=2, ensure_ascii=False)
+    return output_file
+
+
+def _sha256(path: str) -> Optional[str]:
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def discover_inputs(structured_dir: str = STRUCTURED_DIR) -> Dict[Tuple[str, int], Dict[str, str]]:
+    """{(level, year): {"questions": path, "solutions": path}} for every structured file"""
+    inputs: Dict[Tuple[str, int], Dict[str, str]] = {}
+    for path in glob.glob(os.path.join(structured_dir, "structured_*.json")):
+        match = STRUCTURED_PATTERN.match(os.path.basename(path))
+        if match:
+            kind, year, level = match.groups()
+            inputs.setdefault((level, int(year)), {})[kind] = path
+    return inputs
+
+
+def merge_all(structured_dir: str = STRUCTURED_DIR, merged_dir: str = MERGED_DIR,
+              manifest_path: str = MANIFEST_PATH, force: bool = False) -> Dict[str, List[str]]:
+    """
+    Merges every level and year in one pass, rewriting only outputs whose inputs changed.
+
+    The manifest records the sha256 of both inputs and of the output written from
+    them. An output is rebuilt when an input hash differs, or when the output is
+    missing or was edited by hand. Years without a solutions file are left alone.
+    """
+    manifest = {}
+    if os.path.exists(manifest_path) and not force:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+
+    report = {"merged": [], "unchanged": [], "skipped": []}
+    for (level, year), files in sorted(discover_inputs(structured_dir).items()):
+        output_name = f"{level}_merged_{year}_.json"
+        output_file = os.path.join(merged_dir, output_name)
+        if "solutions" not in files:
+            report["skipped"].append(output_name)
+            continue
+
+        hashes = {kind: _sha256(files.get(kind, "")) for kind in ("questions", "solutions")}
+        entry = manifest.get(output_name, {})
+        if entry.get("inputs") == hashes and entry.get("output") == _sha256(output_file):
+            report["unchanged"].append(output_name)
+            continue
+
+        with open(files["solutions"], 'r', encoding='utf-8') as sf:
+            solutions_data = json.load(sf)
+        questions_data = []
+        if "questions" in files:
+            with open(files["questions"], 'r', encoding='utf-8') as qf:
+                questions_data = json.load(qf)
+        content = json.dumps(merge_data(questions_data, solutions_data, level, year), indent=2, ensure_ascii=False)
+
+        # Skip the write when the merge result is byte-identical, so untouched files keep their mtime
+        new_hash = hashlib.sha256(content.encode("utf-8")).hexdigest()
+        if new_hash != _sha256(output_file):
+            os.makedirs(merged_dir, exist_ok=True)
+            with open(output_file, 'w', encoding='utf-8') as f:
+                f.write(content)
+            report["merged"].append(output_name)
+        else:
+            report["unchanged"].append(output_name)
+        manifest[output_name] = {"inputs": hashes, "output": new_hash}
+
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return report
+
 
 if __name__ == "__main__":
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    project_dir = os.path.dirname(os.path.dirname(script_dir)) 
-    range_ordinary = [2014, 2015, 2016, 2017, 2018, 2019, 2020, 2021, 2023, 2024]
-
-    for i in range_ordinary:
-        questions_file = os.path.join(project_dir, "data", "structured", f"structured_questions_{i}_ordinary.json")
-        solutions_file = os.path.join(project_dir, "data", "structured", f"structured_solutions_{i}_ordinary.json")
-        output_file = os.path.join(project_dir, "data", "merged", f"ordinary_merged_{i}_.json")
-        merge_files(questions_file, solutions_file, output_file)
-        print(f"Merged {questions_file} and {solutions_file} into {output_file}")
-    
+    import sys
+
+    report = merge_all(force="--force" in sys.argv)
+    for name in report["merged"]:
+        print(f"Merged {name}")
+    print(f"{len(report['merged'])} merged, {len(report['unchanged'])} unchanged, "
+          f"{len(report['skipped'])} skipped (no solutions file)")
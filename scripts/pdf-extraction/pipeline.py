@@ -0,0 +1,141 @@
+import os
+import glob
+import argparse
+import concurrent.futures
+from typing import Dict, Iterable, Iterator, List
+
+from batch_extract import LEVELS, UNSTRUCTURED_DIR, PdfPair, discover_pairs, extract_records
+from extract import write_questions_to_json
+from llm_cache import LLMResultCache
+from merging import STRUCTURED_DIR, merge_records, write_merged_group
+from records import (
+    is_end,
+    prefetch,
+    read_records,
+    records_from_json_files,
+    write_json_groups,
+    write_records,
+)
+from scheduler import PROMPTS, project_dir
+from structure_with_llm import MAX_RETRIES, structure_records, write_structured_output
+
+# Runs extract -> structure -> merge as one pipeline of record streams (see records.py).
+#
+#   python pipeline.py                                   # all three stages, side by side
+#   python pipeline.py --level higher --year 2019
+#   python pipeline.py --stages structure,merge          # from the unstructured JSON files
+#
+# Each stage starts on a paper's first question while the stage before it is still on
+# the rest, with at most --buffer records queued between stages. Every stage writes its
+# stream to data/cache/pipeline/<stage>.jsonl as it goes, so a stage can also run in
+# another process and follow it:
+#
+#   python pipeline.py --stages extract
+#   python pipeline.py --stages structure,merge --input data/cache/pipeline/extract.jsonl --follow
+#
+# The JSON array files in data/unstructured, data/structured and data/merged are still
+# written, one as soon as its paper is complete, so merge_all and the backend see no change.
+
+STAGES = ["extract", "structure", "merge"]
+STREAM_DIR = os.path.join(project_dir, "data", "cache", "pipeline")
+# Where a stage's input comes from when it is the first stage run and there is no --input
+SOURCE_DIRS = {"structure": UNSTRUCTURED_DIR, "merge": STRUCTURED_DIR}
+
+
+def _extract_pair_records(pair: PdfPair) -> List[Dict]:
+    """Runs in a worker process; a pair's records travel back in one piece"""
+    return list(extract_records(pair))
+
+
+def extract_all(pairs: List[PdfPair], workers: int) -> Iterator[Dict]:
+    """Every pair's records, in the order pairs finish, with at most `workers` pairs extracted ahead"""
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max(1, min(workers, len(pairs) or 1))) as executor:
+        pending = iter(pairs)
+        futures = {executor.submit(_extract_pair_records, pair): pair for pair in _take(pending, workers)}
+        while futures:
+            done, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                pair = futures.pop(future)
+                try:
+                    yield from future.result()
+                except Exception as e:
+                    print(f"Error extracting {pair.level} {pair.year}: {e}")
+                for next_pair in _take(pending, 1):
+                    futures[executor.submit(_extract_pair_records, next_pair)] = next_pair
+
+
+def _take(iterator: Iterator, n: int) -> List:
+    return [item for _, item in zip(range(n), iterator)]
+
+
+def write_unstructured(key, items, failed):
+    level, year, kind = key
+    write_questions_to_json(items, os.path.join(UNSTRUCTURED_DIR, f"{kind}_{year}_{level}.json"))
+    print(f"Extracted {kind} {year} {level}: {len(items)}")
+
+
+def write_structured(key, items, failed):
+    level, year, kind = key
+    write_structured_output(os.path.join(STRUCTURED_DIR, f"structured_{kind}_{year}_{level}.json"), items, failed)
+    print(f"Structured {kind} {year} {level}: {len(items)} structured, {len(failed)} failed")
+
+
+def write_merged(key, items, failed):
+    print(f"Merged {os.path.basename(write_merged_group(key, items, failed))}: {len(items)} questions")
+
+
+def _matches(record: Dict, levels: List[str], years: List[int]) -> bool:
+    return (not levels or record["level"] in levels) and (not years or record["year"] in years)
+
+
+def build_pipeline(stages: List[str], args) -> Iterable[Dict]:
+    """The chained record stream of `stages`, each stage in its own thread behind prefetch()"""
+    first = stages[0]
+    if first == "extract":
+        records = extract_all(discover_pairs(args.level or LEVELS, args.year), args.workers)
+    elif args.input:
+        records = read_records(args.input, follow=args.follow, idle_timeout_s=args.idle_timeout)
+    else:
+        records = records_from_json_files(glob.glob(os.path.join(SOURCE_DIRS[first], "*.json")))
+    records = (r for r in records if _matches(r, args.level, args.year))
+
+    for name in stages:
+        if name == "extract":
+            records = write_json_groups(records, write_unstructured)
+        elif name == "structure":
+            records = write_json_groups(
+                structure_records(records, PROMPTS, LLMResultCache(), args.llm_workers, args.max_retries), write_structured
+            )
+        elif name == "merge":
+            records = write_json_groups(merge_records(records), write_merged)
+        records = prefetch(write_records(records, os.path.join(STREAM_DIR, f"{name}.jsonl")), args.buffer)
+    return records
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run extract -> structure -> merge as a streaming pipeline")
+    parser.add_argument("--stages", type=lambda s: s.split(","), default=STAGES,
+                        help="comma-separated, consecutive stages to run (default: extract,structure,merge)")
+    parser.add_argument("--level", choices=LEVELS, action="append", help="restrict to one level (repeatable)")
+    parser.add_argument("--year", type=int, action="append", help="restrict to one year (repeatable)")
+    parser.add_argument("--input", help="JSONL stream to read instead of the JSON files of the first stage's input")
+    parser.add_argument("--follow", action="store_true", help="keep reading --input until its writer finishes")
+    parser.add_argument("--idle-timeout", type=float, help="with --follow, give up after this many seconds without a record")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="extraction worker processes")
+    parser.add_argument("--llm-workers", type=int, default=3, help="questions structured concurrently")
+    parser.add_argument("--max-retries", type=int, default=MAX_RETRIES)
+    parser.add_argument("--buffer", type=int, default=64, help="records queued between two stages")
+    args = parser.parse_args()
+
+    if args.stages[0] not in STAGES or args.stages != STAGES[STAGES.index(args.stages[0]):][:len(args.stages)]:
+        parser.error(f"--stages must be consecutive stages out of {','.join(STAGES)}")
+    if args.stages[0] == "extract" and args.input:
+        parser.error("--input cannot be used when the pipeline starts with extract")
+
+    groups = records = 0
+    for record in build_pipeline(args.stages, args):
+        if is_end(record):
+            groups += 1
+        else:
+            records += 1
+    print(f"Done: {records} record(s) in {groups} group(s) out of the {args.stages[-1]} stage")
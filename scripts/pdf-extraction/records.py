@@ -0,0 +1,202 @@
+import os
+import re
+import json
+import time
+import queue
+import threading
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Record-oriented JSONL format shared by the extract -> structure -> merge stages.
+#
+# One question per line, so a stage can start on the first question of a paper
+# while the previous stage is still working on the rest:
+#
+#   {"level": "higher", "year": 2019, "kind": "questions", "question": "3", "data": {...}}
+#   {"level": "higher", "year": 2019, "kind": "questions", "question": "7", "failed": true, "data": {...}}
+#   {"level": "higher", "year": 2019, "kind": "questions", "end": true, "count": 9}
+#   {"eof": true}
+#
+# "data" is exactly what the JSON array files hold for that question. An "end" record
+# closes one (level, year, kind) group - the equivalent of one JSON array file - and
+# "eof" closes the stream, which is how a reader following a file knows its writer is done.
+# The JSON array files stay the interchange format with the backend; write_json_groups()
+# produces them from a stream and records_from_json_files() turns them back into one.
+
+# questions_2019_higher.json / structured_solutions_2019_higher.json / higher_merged_2019_.json
+FILE_PATTERN = re.compile(r"^(?:structured_)?(questions_solutions|questions|solutions)_(\d{4})_(higher|ordinary)\.json$")
+MERGED_PATTERN = re.compile(r"^(higher|ordinary)_merged_(\d{4})_\.json$")
+
+GroupKey = Tuple[str, int, str]
+
+
+def make_record(level: str, year: int, kind: str, data: Dict, question=None, failed: bool = False) -> Dict:
+    if question is None:
+        question = data.get("question_num", data.get("question_number"))
+    record = {"level": level, "year": int(year), "kind": kind, "question": str(question), "data": data}
+    if failed:
+        record["failed"] = True
+    return record
+
+
+def end_record(level: str, year: int, kind: str, count: int) -> Dict:
+    return {"level": level, "year": int(year), "kind": kind, "end": True, "count": count}
+
+
+def group_key(record: Dict) -> GroupKey:
+    return record["level"], record["year"], record["kind"]
+
+
+def is_end(record: Dict) -> bool:
+    return record.get("end") is True
+
+
+def parse_file_name(path: str) -> Optional[GroupKey]:
+    """(level, year, kind) of an unstructured, structured or merged JSON file, None for anything else"""
+    name = os.path.basename(path)
+    if match := FILE_PATTERN.match(name):
+        kind, year, level = match.groups()
+        return level, int(year), kind
+    if match := MERGED_PATTERN.match(name):
+        level, year = match.groups()
+        return level, int(year), "merged"
+    return None
+
+
+def write_records(records: Iterable[Dict], path: str) -> Iterator[Dict]:
+    """
+    Append every record to `path` as one JSON line and pass it on unchanged.
+
+    Each line is flushed as it is written, so read_records(path, follow=True) in
+    another process sees it straight away. The file is truncated first and gets
+    an eof line once `records` is exhausted - not when the consumer stops early.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            yield record
+        f.write(json.dumps({"eof": True}) + "\n")
+
+
+def read_records(path: str, follow: bool = False, poll_s: float = 0.2,
+                 idle_timeout_s: Optional[float] = None) -> Iterator[Dict]:
+    """
+    Yield the records of a JSONL stream, one line at a time.
+
+    With `follow`, keep reading as the writer appends (waiting for the file to be
+    created if needed) until the eof line; a partially written last line is held
+    back until its newline arrives. `idle_timeout_s` gives up on a writer that has
+    gone quiet, e.g. because it crashed. Without `follow` the file is read as it is.
+    """
+    idle_since = time.monotonic()
+    while follow and not os.path.exists(path):
+        if idle_timeout_s is not None and time.monotonic() - idle_since > idle_timeout_s:
+            raise TimeoutError(f"{path} was not created within {idle_timeout_s:.0f}s")
+        time.sleep(poll_s)
+
+    with open(path, 'r', encoding='utf-8') as f:
+        partial = ""
+        while True:
+            line = f.readline()
+            if not line:
+                if not follow:
+                    break
+                if idle_timeout_s is not None and time.monotonic() - idle_since > idle_timeout_s:
+                    raise TimeoutError(f"No new records in {path} for {idle_timeout_s:.0f}s")
+                time.sleep(poll_s)
+                continue
+            if not line.endswith("\n") and follow:
+                partial += line
+                continue
+            line, partial = partial + line, ""
+            idle_since = time.monotonic()
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if record.get("eof") is True:
+                return
+            yield record
+
+
+def records_from_json(path: str, level: str, year: int, kind: str) -> Iterator[Dict]:
+    """One JSON array file as a record group, closed by its end record"""
+    with open(path, 'r', encoding='utf-8') as f:
+        items = json.load(f)
+    for item in items:
+        yield make_record(level, year, kind, item)
+    yield end_record(level, year, kind, len(items))
+
+
+def records_from_json_files(paths: Iterable[str]) -> Iterator[Dict]:
+    """Every recognised JSON array file in `paths` as one stream, one group after another"""
+    for path in sorted(paths):
+        key = parse_file_name(path)
+        if key is None:
+            continue
+        yield from records_from_json(path, *key)
+
+
+def write_json_groups(records: Iterable[Dict], write_group: Callable[[GroupKey, List[Dict], List[Dict]], None],
+                      ) -> Iterator[Dict]:
+    """
+    Pass records on unchanged while collecting each group, and call
+    `write_group(key, items, failed)` with the "data" of its records when its end
+    record goes past - so the JSON array file of a paper appears as soon as that
+    paper is done, not when the whole stream is. Only open groups are held in memory.
+    """
+    groups: Dict[GroupKey, Tuple[List[Dict], List[Dict]]] = {}
+    for record in records:
+        key = group_key(record)
+        items, failed = groups.setdefault(key, ([], []))
+        if is_end(record):
+            write_group(key, items, failed)
+            del groups[key]
+        else:
+            (failed if record.get("failed") else items).append(record["data"])
+        yield record
+
+
+def prefetch(records: Iterable[Dict], maxsize: int = 64) -> Iterator[Dict]:
+    """
+    Run `records` in a background thread, at most `maxsize` records ahead of the consumer.
+
+    Chaining stages through prefetch() makes them run side by side - extraction of the
+    next paper while the current one is being structured - with memory bounded by the
+    queue sizes. An exception in the producer is re-raised in the consumer.
+    """
+    buffer: "queue.Queue" = queue.Queue(maxsize=maxsize)
+    done = object()
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        # Time out now and then, so a consumer that stopped early does not strand the thread
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for record in records:
+                if not put(record):
+                    return
+            put(done)
+        except BaseException as e:
+            put(e)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is done:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
@@ -0,0 +1,265 @@
+import os
+import re
+import sys
+import glob
+import json
+import time
+import queue
+import argparse
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from llm_cache import LLMResultCache
+from structure_with_llm import (
+    QUESTION_PROMPT,
+    SOLUTION_PROMPT,
+    PROMPT_2025,
+    MAX_RETRIES,
+    process_single_question,
+    write_structured_output,
+)
+from structure_validation import repair_counts
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+project_dir = os.path.dirname(os.path.dirname(script_dir))
+
+# Stage timings and token histograms share the backend's metrics module (standard library only)
+sys.path.insert(0, os.path.join(project_dir, "backend"))
+from metrics import REGISTRY, observe_llm_call, stage
+
+UNSTRUCTURED_DIR = os.path.join(project_dir, "data", "unstructured")
+STRUCTURED_DIR = os.path.join(project_dir, "data", "structured")
+
+# questions_2019_higher.json / solutions_2019_higher.json / questions_solutions_2025_ordinary.json
+UNSTRUCTURED_PATTERN = re.compile(r"^(questions_solutions|questions|solutions)_(\d{4})_(higher|ordinary)\.json$")
+PROMPTS = {
+    "questions": QUESTION_PROMPT,
+    "solutions": SOLUTION_PROMPT,
+    "questions_solutions": PROMPT_2025,
+}
+
+
+class AIMDLimiter:
+    """
+    Concurrency limit tuned by additive-increase / multiplicative-decrease.
+
+    Every successful call grows the limit by ~1 per window of `limit` calls.
+    An error, or latency drifting above `latency_slack` x the best smoothed
+    latency seen, halves it - at most once per observed latency so one slow
+    burst does not collapse the limit to the floor.
+    """
+
+    def __init__(self, initial: int = 2, min_limit: int = 1, max_limit: int = 16,
+                 decrease: float = 0.5, latency_slack: float = 2.0):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease = decrease
+        self.latency_slack = latency_slack
+        self.in_flight = 0
+        self.ewma_latency: Optional[float] = None
+        self.best_latency: Optional[float] = None
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+
+    def _back_off(self):
+        now = time.monotonic()
+        if now - self._last_decrease >= (self.ewma_latency or 0.0):
+            self.limit = max(self.min_limit, self.limit * self.decrease)
+            self._last_decrease = now
+
+    def release(self, latency: Optional[float], ok: bool):
+        """`latency` is None for calls that never reached the model (cache hits)"""
+        with self._cond:
+            self.in_flight -= 1
+            if not ok:
+                self._back_off()
+            elif latency is not None:
+                self.ewma_latency = latency if self.ewma_latency is None else 0.8 * self.ewma_latency + 0.2 * latency
+                self.best_latency = min(self.best_latency or self.ewma_latency, self.ewma_latency)
+                if self.ewma_latency > self.best_latency * self.latency_slack:
+                    self._back_off()
+                else:
+                    self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            self._cond.notify_all()
+
+
+@dataclass
+class FileJob:
+    input_path: str
+    output_path: str
+    prompt: str
+    remaining: int = 0
+    results: List[Dict] = field(default_factory=list)
+    failed: List[Dict] = field(default_factory=list)
+
+
+@dataclass
+class WorkItem:
+    job: FileJob
+    question: Dict
+    attempts: int = 0
+
+
+def discover_jobs(unstructured_dir: str = UNSTRUCTURED_DIR, structured_dir: str = STRUCTURED_DIR) -> List[FileJob]:
+    jobs = []
+    for path in sorted(glob.glob(os.path.join(unstructured_dir, "*.json"))):
+        match = UNSTRUCTURED_PATTERN.match(os.path.basename(path))
+        if not match:
+            continue
+        kind, year, level = match.groups()
+        output_path = os.path.join(structured_dir, f"structured_{kind}_{year}_{level}.json")
+        jobs.append(FileJob(path, output_path, PROMPTS[kind]))
+    return jobs
+
+
+class CorpusScheduler:
+    """
+    Streams every question of every unstructured file through one work queue.
+
+    Workers never wait for a file to drain before starting the next one, so the
+    backend stays busy through each file's tail. Results are grouped back per
+    output file, and each file is written as soon as its last question completes.
+    """
+
+    def __init__(self, jobs: List[FileJob], cache: Optional[LLMResultCache] = None,
+                 limiter: Optional[AIMDLimiter] = None, max_retries: int = MAX_RETRIES):
+        self.jobs = jobs
+        self.cache = cache if cache is not None else LLMResultCache()
+        self.limiter = limiter or AIMDLimiter()
+        self.max_retries = max_retries
+        self.queue: "queue.Queue[Optional[WorkItem]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._open_jobs = 0
+        self.completed = 0
+        self.model_calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def _record_usage(self, response):
+        with self._lock:
+            self.model_calls += 1
+            self.prompt_tokens += response.get('prompt_eval_count', 0) or 0
+            self.completion_tokens += response.get('eval_count', 0) or 0
+        observe_llm_call("ollama", response.get('prompt_eval_count', 0) or 0, response.get('eval_count', 0) or 0)
+
+    def _finish_job(self, job: FileJob):
+        """Writes a finished file. Runs outside the lock, and always closes the job"""
+        try:
+            write_structured_output(job.output_path, job.results, job.failed)
+            print(f"Finished {os.path.basename(job.output_path)}: {len(job.results)} structured, {len(job.failed)} failed")
+        except Exception as e:
+            print(f"Error writing {job.output_path}: {e}")
+        finally:
+            with self._lock:
+                self._open_jobs -= 1
+                last = self._open_jobs == 0
+            if last:
+                for _ in range(self.limiter.max_limit):
+                    self.queue.put(None)
+
+    def _complete(self, item: WorkItem, result: Optional[Dict]):
+        with self._lock:
+            if result is None and item.attempts < self.max_retries:
+                item.attempts += 1
+                self.queue.put(item)
+                return
+            if result is None:
+                item.job.failed.append(item.question)
+            else:
+                item.job.results.append(result)
+            self.completed += 1
+            item.job.remaining -= 1
+            finished = item.job.remaining == 0
+        if finished:
+            self._finish_job(item.job)
+
+    def _worker(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            called = []
+            self.limiter.acquire()
+            start = time.perf_counter()
+            try:
+                with stage("structure_question"):
+                    result = process_single_question(
+                        item.question, item.job.prompt, self.cache,
+                        on_response=lambda r: (called.append(True), self._record_usage(r)),
+                    )
+            except Exception as e:
+                print(f"Error processing question {item.question.get('question_number')}: {e}")
+                result = None
+            latency = time.perf_counter() - start if called else None
+            self.limiter.release(latency, result is not None)
+            try:
+                self._complete(item, result)
+            except Exception as e:
+                # One bad item must not take a worker down with it
+                print(f"Error completing question {item.question.get('question_number')}: {e}")
+
+    def run(self) -> Dict:
+        start = time.perf_counter()
+        for job in self.jobs:
+            with open(job.input_path, 'r', encoding='utf-8') as f:
+                questions = json.load(f)
+            if not questions:
+                write_structured_output(job.output_path, [])
+                continue
+            job.remaining = len(questions)
+            self._open_jobs += 1
+            for question in questions:
+                self.queue.put(WorkItem(job, question))
+
+        if self._open_jobs:
+            workers = [threading.Thread(target=self._worker, daemon=True) for _ in range(self.limiter.max_limit)]
+            for w in workers:
+                w.start()
+            for w in workers:
+                w.join()
+
+        elapsed = time.perf_counter() - start
+        return {
+            "files": len(self.jobs),
+            "items": self.completed,
+            "model_calls": self.model_calls,
+            "cache_hits": self.cache.hits,
+            # Replies fixed by the local validator instead of being re-sent to the model
+            "repaired_locally": repair_counts["repaired"],
+            "unrepairable": repair_counts["unrepairable"],
+            "seconds": round(elapsed, 2),
+            "items_per_min": round(self.completed / elapsed * 60, 2) if elapsed else None,
+            "completion_tokens_per_sec": round(self.completion_tokens / elapsed, 2) if elapsed else None,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "final_concurrency": round(self.limiter.limit, 2),
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Structure every unstructured file through one adaptive work queue")
+    parser.add_argument("--kind", choices=list(PROMPTS), action="append", help="only these file kinds (repeatable)")
+    parser.add_argument("--level", choices=["higher", "ordinary"], action="append", help="only these levels (repeatable)")
+    parser.add_argument("--initial-concurrency", type=int, default=2)
+    parser.add_argument("--max-concurrency", type=int, default=16)
+    parser.add_argument("--metrics-out", help="write stage/token histograms here in the Prometheus text format")
+    args = parser.parse_args()
+
+    jobs = discover_jobs()
+    if args.kind:
+        jobs = [j for j in jobs if any(os.path.basename(j.input_path).startswith(f"{k}_2") for k in args.kind)]
+    if args.level:
+        jobs = [j for j in jobs if any(j.input_path.endswith(f"_{lvl}.json") for lvl in args.level)]
+
+    scheduler = CorpusScheduler(jobs, limiter=AIMDLimiter(initial=args.initial_concurrency, max_limit=args.max_concurrency))
+    print(json.dumps(scheduler.run(), indent=2))
+    if args.metrics_out:
+        REGISTRY.write(args.metrics_out)
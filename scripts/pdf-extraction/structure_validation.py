@@ -0,0 +1,305 @@
+import re
+import json
+import threading
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+# Validates LLM output against the schema in QUESTION_PROMPT / SOLUTION_PROMPT and repairs
+# what a parser can fix deterministically, so only hopeless replies cost another model call:
+#
+#   structured, repairs = repair_question(raw_reply, expected_num="3")
+#   structured is None        -> unrepairable, send back to the LLM
+#   repairs == ["fence", ...] -> fixed locally
+#
+# Repairs: markdown fences and surrounding prose, trailing commas, Python literals
+# (True/False/None), a single-item list or {"questions": [...]} wrapper, "Q3" -> "3",
+# "(a)" / "part_a" / "13a" -> "a", "(ii)" / "b_ii" / "2" -> "ii" for subparts, string/number
+# booleans, a bare solution string -> [string].
+
+FENCE = re.compile(r"^\s*```[a-zA-Z]*\s*\n?|\n?\s*```\s*$")
+QUESTION_NUM = re.compile(r"^(?:question|q)?\s*\.?\s*(\d{1,2})\s*[.)]?$", re.IGNORECASE)
+ROMAN = re.compile(r"^(?=[ivxl]+$)l?x{0,3}(ix|iv|v?i{0,3})$")
+ID_PREFIX = re.compile(r"^(?:sub\s*part|subpart|part|section)[\s_-]*", re.IGNORECASE)
+LITERALS = {"True": "true", "False": "false", "None": "null"}
+TRUE_STRINGS = {"true", "yes", "y", "1"}
+FALSE_STRINGS = {"false", "no", "n", "0", "", "none", "null"}
+ROMANS = ["i", "ii", "iii", "iv", "v", "vi", "vii", "viii", "ix", "x", "xi", "xii"]
+
+# Totals across the process, e.g. for a corpus run summary
+repair_counts: Counter = Counter()
+_counts_lock = threading.Lock()
+
+
+def _outside_strings(text: str):
+    """Yields (index, char, in_string) for every character, tracking JSON string state"""
+    in_string = escaped = False
+    for i, char in enumerate(text):
+        yield i, char, in_string
+        if escaped:
+            escaped = False
+        elif char == "\\" and in_string:
+            escaped = True
+        elif char == '"':
+            in_string = not in_string
+
+
+def strip_fences(text: str) -> str:
+    """Drop ```json fences and any prose before the first { / [ or after the matching last } / ]"""
+    text = FENCE.sub("", text.strip())
+    starts = [i for i in (text.find("{"), text.find("[")) if i >= 0]
+    if not starts:
+        return text
+    start = min(starts)
+    end = text.rfind("}" if text[start] == "{" else "]")
+    return text[start:end + 1] if end > start else text[start:]
+
+
+def fix_syntax(text: str) -> str:
+    """Remove trailing commas before } / ] and turn Python literals into JSON ones, outside strings"""
+    out: List[str] = []
+    pending_comma = None
+    literal = re.compile(r"(True|False|None)\b")
+    skip_until = -1
+    for i, char, in_string in _outside_strings(text):
+        if i < skip_until:
+            continue
+        if in_string:
+            out.append(char)
+            continue
+        if char == ",":
+            pending_comma = len(out)
+            out.append(char)
+            continue
+        if char in "}]" and pending_comma is not None and not "".join(out[pending_comma + 1:]).strip():
+            del out[pending_comma]
+        if not char.isspace():
+            pending_comma = None
+        match = literal.match(text, i) if char in "TFN" else None
+        if match and (i == 0 or not (text[i - 1].isalnum() or text[i - 1] == "_")):
+            out.append(LITERALS[match.group(1)])
+            skip_until = match.end()
+            continue
+        out.append(char)
+    return "".join(out)
+
+
+def parse_json(text: str) -> Tuple[Any, List[str]]:
+    """Parsed JSON and the repairs it took; (None, repairs) if it still does not parse"""
+    try:
+        return json.loads(text), []
+    except (json.JSONDecodeError, TypeError):
+        pass
+    repairs = []
+    stripped = strip_fences(text or "")
+    if stripped != (text or "").strip():
+        repairs.append("fence")
+        try:
+            return json.loads(stripped), repairs
+        except json.JSONDecodeError:
+            pass
+    fixed = fix_syntax(stripped)
+    if fixed != stripped:
+        repairs.append("syntax")
+    try:
+        return json.loads(fixed), repairs
+    except json.JSONDecodeError:
+        return None, repairs + ["unparsable"]
+
+
+def normalize_question_num(value) -> Optional[str]:
+    """3, "3", "Q3", "Question 3", "Q.3" -> "3"; None if there is no question number"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)) and float(value).is_integer():
+        return str(int(value))
+    match = QUESTION_NUM.match(str(value or "").strip())
+    return str(int(match.group(1))) if match else None
+
+
+def _clean_id(value) -> str:
+    text = ID_PREFIX.sub("", str(value if value is not None else "").strip().lower())
+    # An opening bracket after an id separates two levels: "b(ii)" -> "b.ii", while "(a)" -> "a"
+    text = re.sub(r"(?<=[a-z0-9])\s*\(", ".", text)
+    return re.sub(r"[()\s]", "", text).strip(".:")
+
+
+def normalize_part_id(value, question_num: Optional[str] = None) -> Optional[str]:
+    """
+    "(a)", "a)", "A", "part_a" -> "a", and "13a" / "13(a)" -> "a" in question 13. Roman part
+    ids ("iv") and compound ones ("a.i", "a(i)" -> "a.i") are kept.
+    """
+    text = _clean_id(value)
+    if question_num and re.fullmatch(rf"{question_num}[._-]?[a-z]{{1,4}}", text):
+        text = text[len(question_num):].lstrip("._-")
+    if re.fullmatch(r"[a-z]{1,4}|\d{1,2}|[a-z0-9]+(?:[._-][a-z0-9]+)+", text):
+        return text
+    return None
+
+
+def normalize_subpart_id(value) -> Optional[str]:
+    """"(ii)", "II", "b_ii", "b.ii", "b(ii)" -> "ii"; "2" -> "ii" since subparts are roman numerals"""
+    if isinstance(value, int) and not isinstance(value, bool):
+        value = str(value)
+    text = _clean_id(value)
+    last = re.split(r"[._-]", text)[-1] if text else ""
+    if last and ROMAN.match(last):
+        return last
+    if last.isdigit() and 1 <= int(last) <= len(ROMANS) and text == last:
+        return ROMANS[int(last) - 1]
+    # Sub-items such as "i-1" are kept as they are
+    return text if re.fullmatch(r"[a-z0-9]+(?:[._-][a-z0-9]+)*", text) else None
+
+
+def coerce_bool(value) -> Optional[bool]:
+    if isinstance(value, bool):
+        return value
+    if value is None:
+        return False
+    if isinstance(value, (int, float)):
+        return bool(value)
+    text = str(value).strip().lower()
+    if text in TRUE_STRINGS:
+        return True
+    if text in FALSE_STRINGS:
+        return False
+    return None
+
+
+def coerce_solution(value) -> List[str]:
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return [value] if value.strip() else []
+    if isinstance(value, list):
+        return [v if isinstance(v, str) else json.dumps(v, ensure_ascii=False) if isinstance(v, (dict, list)) else str(v)
+                for v in value if v is not None and str(v).strip()]
+    return [str(value)]
+
+
+def coerce_text(value) -> str:
+    if value is None:
+        return ""
+    return value if isinstance(value, str) else str(value)
+
+
+def _repair_node(node: Dict, id_normalizer, repairs: List[str], level: str) -> Optional[Dict]:
+    """One part or subpart in schema form, or None if it cannot be repaired"""
+    if not isinstance(node, dict):
+        return None
+    node_id = id_normalizer(node.get("id"))
+    if node_id is None:
+        return None
+    if node_id != node.get("id"):
+        repairs.append(f"{level}_id")
+    repaired = dict(node, id=node_id)
+    for field, coerce in (("text", coerce_text), ("solution", coerce_solution)):
+        value = coerce(node.get(field))
+        if value != node.get(field):
+            repairs.append(f"{level}_{field}")
+        repaired[field] = value
+    skip = coerce_bool(node.get("skip"))
+    if skip is None:
+        return None
+    if skip is not node.get("skip"):
+        repairs.append(f"{level}_skip")
+    repaired["skip"] = skip
+    return repaired
+
+
+def validate_question(data: Any, expected_num=None) -> Tuple[Optional[Dict], List[str]]:
+    """
+    Check a parsed reply against the question schema, repairing it in place of a re-query.
+
+    `expected_num` is the question number from the unstructured source; it fills a missing
+    question_num and overrides one that disagrees. Returns (question, repairs) or
+    (None, repairs) when the structure is beyond local repair.
+    """
+    repairs: List[str] = []
+    if isinstance(data, dict) and isinstance(data.get("questions"), list) and len(data["questions"]) == 1:
+        data = data["questions"][0]
+        repairs.append("unwrap")
+    if isinstance(data, list) and len(data) == 1:
+        data = data[0]
+        repairs.append("unwrap")
+    if not isinstance(data, dict):
+        return None, repairs + ["not_an_object"]
+
+    question = dict(data)
+    num = normalize_question_num(data.get("question_num"))
+    expected = normalize_question_num(expected_num) if expected_num is not None else None
+    if expected is not None and num != expected:
+        num = expected
+    if num is None:
+        return None, repairs + ["question_num"]
+    if num != data.get("question_num"):
+        repairs.append("question_num")
+    question["question_num"] = num
+
+    context = coerce_text(data.get("context"))
+    if context != data.get("context"):
+        repairs.append("context")
+    question["context"] = context
+    skip = coerce_bool(data.get("skip"))
+    if skip is None:
+        return None, repairs + ["skip"]
+    if skip is not data.get("skip"):
+        repairs.append("skip")
+    question["skip"] = skip
+
+    parts = data.get("parts")
+    if parts is None:
+        parts = []
+        repairs.append("parts")
+    if isinstance(parts, dict):
+        parts = [parts]
+        repairs.append("parts")
+    if not isinstance(parts, list):
+        return None, repairs + ["parts"]
+    repaired_parts = []
+    for part in parts:
+        repaired = _repair_node(part, lambda value: normalize_part_id(value, num), repairs, "part")
+        if repaired is None:
+            return None, repairs + ["part"]
+        subparts = part.get("subparts")
+        if subparts is not None:
+            if isinstance(subparts, dict):
+                subparts = [subparts]
+            if not isinstance(subparts, list):
+                return None, repairs + ["subparts"]
+            repaired_subs = [_repair_node(sub, normalize_subpart_id, repairs, "subpart") for sub in subparts]
+            if any(sub is None for sub in repaired_subs):
+                return None, repairs + ["subpart"]
+            repaired["subparts"] = repaired_subs
+        repaired_parts.append(repaired)
+    question["parts"] = repaired_parts
+    return question, repairs
+
+
+def repair_question(text: str, expected_num=None) -> Tuple[Optional[Dict], List[str]]:
+    """Parse, validate and repair one raw LLM reply. None means the LLM has to try again"""
+    data, repairs = parse_json(text)
+    if data is None:
+        question = None
+    else:
+        question, problems = validate_question(data, expected_num)
+        repairs = list(dict.fromkeys(repairs + problems))
+    with _counts_lock:
+        repair_counts["replies"] += 1
+        repair_counts["repaired" if question is not None and repairs else
+                      "unrepairable" if question is None else "valid"] += 1
+        for repair in set(repairs):
+            repair_counts[repair] += 1
+    return question, repairs
+
+
+if __name__ == "__main__":
+    # The examples from the docstrings above
+    for value, expected in [("3", "3"), (3, "3"), ("Q3", "3"), ("Question 3", "3"), ("Q.3", "3")]:
+        assert normalize_question_num(value) == expected, (value, normalize_question_num(value))
+    for value, expected in [("(a)", "a"), ("a)", "a"), ("A", "a"), ("part_a", "a"), ("13a", "a"), ("13(a)", "a"),
+                            ("iv", "iv"), ("a.i", "a.i"), ("a(i)", "a.i")]:
+        assert normalize_part_id(value, "13") == expected, (value, normalize_part_id(value, "13"))
+    for value, expected in [("(ii)", "ii"), ("II", "ii"), ("b_ii", "ii"), ("b.ii", "ii"), ("b(ii)", "ii"), ("2", "ii"),
+                            (2, "ii"), ("i-1", "i-1")]:
+        assert normalize_subpart_id(value) == expected, (value, normalize_subpart_id(value))
+    print("ok")
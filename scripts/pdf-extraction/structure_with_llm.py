@@ -8,6 +8,13 @@ import pdfplumber
 import concurrent.futures
 import threading
 
+from llm_cache import LLMResultCache
+from records import end_record, group_key, is_end, make_record
+from structure_validation import repair_question, validate_question
+
+MODEL_NAME = 'qwen2.5-coder'
+MAX_RETRIES = 2
+
 SOLUTION_PROMPT = """ 
 You are a precision data architect. Your task is to merge raw exam Question Text with its corresponding Marking Scheme (Solution) into a single, highly-structured JSON object.
 
@@ -185,53 +192,186 @@ PROMPT_2025 = """You are a precision data extraction engine. Your task is to con
 6.  **Formatting**: Return ONLY valid JSON. No markdown code fences, no preamble.
 
 ### INPUT DATA"""
-def process_single_question(question_data, prompt):
+def process_single_question(question_data, prompt, cache=None, on_response=None):
+    """
+    Structures one question with the LLM. Returns the validated JSON or None.
+    `on_response` is called with the raw Ollama response (token counts, timings)
+    whenever the model is actually called, i.e. not on cache hits.
+
+    Replies that break the schema are repaired locally where a parser can fix them
+    (fences, trailing commas, "(a)" ids, "Q3" numbers, string booleans); None, and
+    with it a retry against the model, only for replies beyond repair.
+    """
     full_prompt = prompt + question_data['text']
+
+    key = None
+    if cache is not None:
+        key = LLMResultCache.make_key(prompt, question_data['text'], MODEL_NAME)
+        cached = cache.get(key)
+        if cached is not None:
+            # Entries written before validation existed are checked too
+            cached, _ = validate_question(cached, question_data['question_number'])
+        if cached is not None:
+            print(f"Question {question_data['question_number']} loaded from cache.")
+            return cached
     
     # Call Ollama
-    response = ollama.chat(model='qwen2.5-coder', messages=[
+    response = ollama.chat(model=MODEL_NAME, messages=[
         {
             'role': 'user',
             'content': full_prompt,
         },
     ], format='json') # Enforce JSON output
+    if on_response is not None:
+        on_response(response)
 
-    try:
-        structured_q = json.loads(response['message']['content'])
-        print(f"Processed Question {question_data['question_number']} successfully.")
-        return structured_q
-    except json.JSONDecodeError:
-        print(f"Error parsing JSON for Question {question_data['question_number']}")
+    structured_q, repairs = repair_question(response['message']['content'], question_data['question_number'])
+    if structured_q is None:
+        print(f"Error parsing JSON for Question {question_data['question_number']} ({', '.join(repairs)})")
         return None
+    if repairs:
+        print(f"Processed Question {question_data['question_number']} after local repair: {', '.join(repairs)}")
+    else:
+        print(f"Processed Question {question_data['question_number']} successfully.")
+    if cache is not None:
+        cache.put(key, structured_q)
+    return structured_q
     
-def process_with_llm(input_pdf_path, output_json_path, prompt):
+def process_with_llm(input_pdf_path, output_json_path, prompt, cache=None, max_retries=MAX_RETRIES):
+    """
+    Structures every question in `input_pdf_path` with the LLM.
+
+    Parsed results go to the content-addressed cache as soon as they arrive, so
+    unchanged questions are never re-sent and an interrupted run resumes from
+    where it stopped. Questions that fail or return unparsable JSON are queued
+    and retried up to `max_retries` times. Any still failing are written to
+    `<output>.failed.jsonl` instead of being silently dropped.
+    """
+    cache = cache if cache is not None else LLMResultCache()
     with open(input_pdf_path, 'r', encoding='utf-8') as f:
         raw_data = json.load(f)
 
+    hits_before, misses_before = cache.hits, cache.misses
     structured_data = []
-    # Process each question in parallel
-    with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
-      futures = [executor.submit(process_single_question, question_data, prompt) for question_data in raw_data]
-      for future in concurrent.futures.as_completed(futures):
-          try:
-             result = future.result()
-             if result is not None:
-              structured_data.append(result)
-          except Exception as e:
-              print(f"Error processing future: {e}")
+    pending = raw_data
+    attempt = 0
+    while pending and attempt <= max_retries:
+        if attempt:
+            print(f"Retrying {len(pending)} question(s), attempt {attempt + 1} of {max_retries + 1}")
+        failed = []
+        # Process each question in parallel
+        with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
+            futures = {executor.submit(process_single_question, question_data, prompt, cache): question_data
+                       for question_data in pending}
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"Error processing future: {e}")
+                    result = None
+                if result is None:
+                    failed.append(futures[future])
+                else:
+                    structured_data.append(result)
+        pending = failed
+        attempt += 1
+
+    write_structured_output(output_json_path, structured_data, pending)
+    print(f"Finished. Structured data saved to {output_json_path} ({cache.hits - hits_before} cached, {cache.misses - misses_before} sent to the model)")
+
+def structure_records(records, prompts, cache=None, workers=3, max_retries=MAX_RETRIES, max_pending=None):
+    """
+    Streaming form of process_with_llm: structures pipeline records as they arrive
+    and yields the structured records as they complete, in completion order.
+
+    `prompts` maps a record's kind ("questions", "solutions", ...) to its prompt. At most
+    `max_pending` questions (default 2 x workers) are in flight, so a fast upstream is
+    held back instead of piling up in memory. A question that still fails after
+    `max_retries` retries is yielded with "failed": true and its unstructured data. A
+    group's end record is passed on once every question of that group has completed.
+    """
+    cache = cache if cache is not None else LLMResultCache()
+    max_pending = max_pending or workers * 2
+    open_groups = {}  # group key -> [questions in flight, structured so far, end seen]
+    futures = {}
+
+    def submit(executor, record, attempt):
+        prompt = prompts[record["kind"]]
+        futures[executor.submit(process_single_question, record["data"], prompt, cache)] = (record, attempt)
+
+    def finish(future, executor):
+        record, attempt = futures.pop(future)
+        try:
+            result = future.result()
+        except Exception as e:
+            print(f"Error processing question {record['question']}: {e}")
+            result = None
+        if result is None and attempt < max_retries:
+            print(f"Retrying question {record['question']} of {record['level']} {record['year']}, attempt {attempt + 2} of {max_retries + 1}")
+            submit(executor, record, attempt + 1)
+            return
+        group = open_groups[group_key(record)]
+        group[0] -= 1
+        if result is None:
+            yield make_record(record["level"], record["year"], record["kind"], record["data"], record["question"], failed=True)
+        else:
+            group[1] += 1
+            yield make_record(record["level"], record["year"], record["kind"], result)
+        yield from close_if_done(group_key(record))
+
+    def close_if_done(key):
+        in_flight, structured, ended = open_groups[key]
+        if ended and not in_flight:
+            del open_groups[key]
+            yield end_record(*key, structured)
+
+    def wait(executor, return_when):
+        done, _ = concurrent.futures.wait(list(futures), return_when=return_when)
+        for future in done:
+            yield from finish(future, executor)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        for record in records:
+            key = group_key(record)
+            group = open_groups.setdefault(key, [0, 0, False])
+            if is_end(record):
+                group[2] = True
+                yield from close_if_done(key)
+                continue
+            group[0] += 1
+            submit(executor, record, 0)
+            while len(futures) >= max_pending:
+                yield from wait(executor, concurrent.futures.FIRST_COMPLETED)
+        while futures:
+            yield from wait(executor, concurrent.futures.FIRST_COMPLETED)
+    # Groups whose end record never came (upstream stopped early) are closed with what completed
+    for key in list(open_groups):
+        yield end_record(*key, open_groups.pop(key)[1])
+
+def write_structured_output(output_json_path, structured_data, failed=()):
+    """Writes the sorted results, plus `<output>.failed.jsonl` for questions that never parsed"""
+    failed_path = output_json_path + ".failed.jsonl"
+    if failed:
+        with open(failed_path, 'w', encoding='utf-8') as f:
+            for question_data in failed:
+                f.write(json.dumps(question_data, ensure_ascii=False) + "\n")
+        print(f"{len(failed)} question(s) could not be structured, see {failed_path}")
+    elif os.path.exists(failed_path):
+        os.remove(failed_path)
+
     # Sort the list based on the question_num key
     structured_data.sort(key=lambda x: int(x.get('question_num', 0)))
     # Save final result
     with open(output_json_path, 'w', encoding='utf-8') as f:
         json.dump(structured_data, f, indent=2, ensure_ascii=False)
-    print(f"Finished. Structured data saved to {output_json_path}")
 
 if __name__ == "__main__":
   script_dir = os.path.dirname(os.path.abspath(__file__))
   project_dir = os.path.dirname(os.path.dirname(script_dir)) 
   range_higher = [ 2015, 2016, 2017, 2018, 2019, 2020, 2021, 2023, 2024]
+  cache = LLMResultCache()
   for i in range_higher:
     input_json_path = os.path.join(project_dir, "data", "unstructured", f"solutions_{i}_ordinary.json")
     output_json_path = os.path.join(project_dir, "data", "structured", f"structured_solutions_{i}_ordinary.json")
-    process_with_llm(input_json_path, output_json_path, SOLUTION_PROMPT)
+    process_with_llm(input_json_path, output_json_path, SOLUTION_PROMPT, cache=cache)
 